@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Intent classifier accuracy and speed on a labelled corpus.
+
+Each line of intent_corpus.jsonl is {"text", "intent"[, "param"]}; intent is what
+a person would expect the bot to do ("chat" = plain conversation, "video" = the
+bot's news-video command). Messages are classified the way telegram_bot.py sees
+them: video check first, then intent_classifier.detect_intent. The previous
+linear-scan implementation is kept below as a baseline.
+
+Usage:
+  python3 bench/intent_bench.py
+  python3 bench/intent_bench.py --repeat 2000 --misses
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import intent_classifier as ic  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_corpus.jsonl')
+
+
+# ─── Baseline: linear keyword scans, as cli_router.py did before ─────────────
+
+def legacy_detect_intent(user_msg):
+    msg_lower = user_msg.lower()
+    stripped = user_msg.strip()
+    if any(kw in msg_lower for kw in ic.SENTIMENT_KEYWORDS):
+        return ('sentiment_research', user_msg)
+    if any(kw in msg_lower for kw in ic.ESTONIAN_NEWS_KEYWORDS):
+        if any(w in msg_lower for w in ['news', 'uudis', 'report', 'today', 'latest', 'what', 'tell']):
+            return ('estonian_news', user_msg)
+    if (ic.EXEC_PATTERN.match(stripped)
+            and not stripped.endswith('?')
+            and not ic.QUESTION_PATTERN.match(stripped)):
+        return ('exec_task', user_msg)
+    if re.search(r'\b(search|look up|find|google|research|web)\b', msg_lower):
+        query_match = re.search(
+            r'(?:search(?:\s+for)?|look\s+up|find|google|research)\s+(.+)', msg_lower
+        )
+        if query_match:
+            return ('web_search', query_match.group(1).strip())
+        return ('web_search', user_msg)
+    url_match = re.search(r'https?://\S+', user_msg)
+    if url_match:
+        return ('web_fetch', url_match.group(0))
+    return (None, user_msg)
+
+
+def bot_view(detect):
+    def classify(text):
+        if ic.is_video_request(text):
+            return ('video', text)
+        intent, param = detect(text)
+        return (intent or 'chat', param)
+    return classify
+
+
+def evaluate(classify, corpus):
+    hits = param_hits = param_total = 0
+    misses = []
+    for item in corpus:
+        intent, param = classify(item['text'])
+        if intent == item['intent']:
+            hits += 1
+        else:
+            misses.append((item['text'], item['intent'], intent))
+        if 'param' in item:
+            param_total += 1
+            param_hits += param == item['param']
+    return hits, param_hits, param_total, misses
+
+
+def time_per_message(classify, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            classify(text)
+    return (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--corpus', default=CORPUS)
+    parser.add_argument('--repeat', type=int, default=500, help='passes over the corpus for timing')
+    parser.add_argument('--misses', action='store_true', help='list misclassified messages')
+    args = parser.parse_args()
+
+    with open(args.corpus) as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    texts = [item['text'] for item in corpus]
+    print(f'{len(corpus)} labelled messages, timing {args.repeat} passes\n')
+
+    results = {}
+    for name, detect in (('legacy', legacy_detect_intent), ('intent_classifier', ic.detect_intent)):
+        classify = bot_view(detect)
+        hits, param_hits, param_total, misses = evaluate(classify, corpus)
+        us = time_per_message(classify, texts, args.repeat)
+        results[name] = [classify(t) for t in texts]
+        print(f'{name:>18}: accuracy {hits}/{len(corpus)} ({hits / len(corpus):.1%})  '
+              f'params {param_hits}/{param_total}  {us:.2f} µs/message')
+        if args.misses:
+            for text, want, got in misses:
+                print(f'{"":>20}miss: {text!r}  expected {want}, got {got}')
+
+    disagree = sum(a != b for a, b in zip(results['legacy'], results['intent_classifier']))
+    print(f'\nlegacy vs intent_classifier disagreements: {disagree}')
+
+
+if __name__ == '__main__':
+    main()
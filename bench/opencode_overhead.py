@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Per-request overhead: `opencode run` per message vs warm `opencode serve` workers.
+
+Sends the same tiny prompt N times through cli_router.call_opencode, first with
+a fresh CLI process per request (the old behaviour), then through a WarmPool.
+The prompt is trivial, so the difference is almost all spawn/auth/handshake cost.
+
+Usage (on the VPS, router does not need to be running):
+  python3 bench/opencode_overhead.py --runs 10
+  python3 bench/opencode_overhead.py --runs 5 --model opencode/glm-5-free --workers 1
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import cli_router  # noqa: E402
+
+PROMPT = 'Reply with the single word OK.\n\nRespond:'
+
+
+def measure(label, runs, model):
+    times = []
+    for i in range(runs):
+        start = time.monotonic()
+        reply = cli_router.call_opencode(model, PROMPT)
+        times.append(time.monotonic() - start)
+        print(f'  {label} #{i + 1}: {times[-1]:.2f}s  {reply[:40]!r}')
+    return times
+
+
+def summary(times):
+    return (f'mean {statistics.mean(times):.2f}s  p50 {statistics.median(times):.2f}s  '
+            f'min {min(times):.2f}s  max {max(times):.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--model', default=cli_router.MODEL)
+    parser.add_argument('--workers', type=int, default=1, help='warm workers to pre-spawn')
+    parser.add_argument('--opencode', default=cli_router.OPENCODE, help='opencode binary')
+    args = parser.parse_args()
+    cli_router.OPENCODE = args.opencode
+
+    print(f'Cold: `opencode run` per request ({args.runs} runs, {args.model})')
+    cold = measure('cold', args.runs, args.model)
+
+    print(f'Warm: starting {args.workers} `opencode serve` worker(s)...')
+    pool = cli_router.WarmPool(args.workers, max_requests=args.runs + 1)
+    boot_start = time.monotonic()
+    pool.start()
+    print(f'  pre-spawn took {time.monotonic() - boot_start:.2f}s (paid once at router start)')
+    cli_router._WARM_POOL = pool
+    try:
+        warm = measure('warm', args.runs, args.model)
+    finally:
+        pool.stop()
+
+    print()
+    print(f'cold  {summary(cold)}')
+    print(f'warm  {summary(warm)}')
+    saved = statistics.median(cold) - statistics.median(warm)
+    print(f'per-request overhead saved (p50): {saved:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Replay captured router traffic at a chosen concurrency and rate.
+
+Reads a JSONL capture written by the router with ROUTER_CAPTURE_FILE set (one
+{"ts", "path", "body"} per line) and sends the bodies again, cycling through
+the file until --requests have been sent. Each worker thread keeps one HTTP
+connection open, like the bot does. Prints throughput, latency percentiles
+(total and time to first byte) and errors by kind.
+
+Offline, point the router at the deterministic stubs in bench/stubs/:
+  OPENCODE_BIN=bench/stubs/opencode ROUTER_SKILLS_DIR=bench/stubs ROUTER_WORKDIR=. \\
+      ROUTER_CACHE=0 ROUTER_TOOL_CACHE=0 python3 cli_router.py &
+  python3 bench/replay.py bench/replay_sample.jsonl --concurrency 8 --rate 4 --requests 200
+
+Capture on the VPS:  ROUTER_CAPTURE_FILE=/tmp/router_capture.jsonl
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import threading
+import time
+import urllib.parse
+from collections import Counter
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'replay_sample.jsonl')
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+class Replayer:
+    def __init__(self, records, url, concurrency, rate, total, stream, timeout):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.records = records
+        self.concurrency = concurrency
+        self.rate = rate
+        self.total = total
+        self.stream = stream
+        self.timeout = timeout
+        self.next_index = 0
+        self.lock = threading.Lock()
+        self.results = []   # (ok, error kind, latency, first byte)
+        self.start = 0.0
+
+    def _take(self):
+        with self.lock:
+            if self.next_index >= self.total:
+                return None
+            i = self.next_index
+            self.next_index += 1
+        if self.rate:
+            # Open-loop pacing: request i is due at start + i/rate, however slow earlier ones were
+            delay = self.start + i / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return self.records[i % len(self.records)]
+
+    def _send(self, conn, record):
+        body = dict(record['body'])
+        if self.stream is not None:
+            body['stream'] = self.stream
+        data = json.dumps(body).encode()
+        sent = time.monotonic()
+        conn.request('POST', record.get('path', '/v1/chat/completions'), data,
+                     {'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        first = None
+        done = False
+        if body.get('stream') and resp.status == 200:
+            for line in resp:
+                if first is None and line.startswith(b'data:'):
+                    first = time.monotonic() - sent
+                if line.strip() == b'data: [DONE]':
+                    done = True
+            resp.read()
+        else:
+            resp.read(1)
+            first = time.monotonic() - sent
+            resp.read()
+            done = True
+        latency = time.monotonic() - sent
+        if resp.status != 200:
+            return False, str(resp.status), latency, first
+        if not done:
+            return False, 'truncated', latency, first
+        return True, None, latency, first
+
+    def _worker(self):
+        conn = None
+        while True:
+            record = self._take()
+            if record is None:
+                break
+            if conn is None:
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            sent = time.monotonic()
+            try:
+                result = self._send(conn, record)
+            except (OSError, http.client.HTTPException) as e:
+                kind = 'timeout' if isinstance(e, TimeoutError) else type(e).__name__
+                result = (False, kind, time.monotonic() - sent, None)
+                conn.close()
+                conn = None
+            with self.lock:
+                self.results.append(result)
+        if conn:
+            conn.close()
+
+    def run(self):
+        self.start = time.monotonic()
+        threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.monotonic() - self.start
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r[0]]
+    latencies = sorted(round(r[2], 4) for r in ok)
+    firsts = sorted(round(r[3], 4) for r in ok if r[3] is not None)
+    errors = Counter(r[1] for r in results if not r[0])
+    return {
+        'requests': len(results),
+        'ok': len(ok),
+        'errors': sum(errors.values()),
+        'error_rate': round(sum(errors.values()) / len(results), 4) if results else 0,
+        'errors_by_kind': dict(errors),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed else 0,
+        'latency_s': {f'p{p}': percentile(latencies, p) for p in (50, 95, 99)} | {'max': latencies[-1] if latencies else None},
+        'first_byte_s': {f'p{p}': percentile(firsts, p) for p in (50, 95, 99)},
+    }
+
+
+def fmt(seconds):
+    return '-' if seconds is None else f'{seconds:.3f}s'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('capture', nargs='?', default=SAMPLE, help='JSONL capture (default: bench/replay_sample.jsonl)')
+    parser.add_argument('--url', default='http://127.0.0.1:4097')
+    parser.add_argument('--concurrency', type=int, default=4, help='parallel connections')
+    parser.add_argument('--rate', type=float, default=0, help='requests per second, 0 = as fast as workers allow')
+    parser.add_argument('--requests', type=int, default=0, help='total to send (default: one pass over the capture)')
+    parser.add_argument('--stream', choices=('keep', 'on', 'off'), default='keep',
+                        help='override the captured stream flag')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    with open(args.capture) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        parser.error(f'{args.capture} has no requests')
+    total = args.requests or len(records)
+    stream = {'keep': None, 'on': True, 'off': False}[args.stream]
+
+    replayer = Replayer(records, args.url, args.concurrency, args.rate, total, stream, args.timeout)
+    summary = summarize(replayer.results, replayer.run())
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    print(f'{summary["requests"]} requests, concurrency {args.concurrency}, '
+          f'rate {args.rate or "unpaced"}, {summary["elapsed_s"]:.1f}s')
+    print(f'  throughput   {summary["throughput_rps"]:.2f} req/s')
+    print(f'  errors       {summary["errors"]} ({summary["error_rate"]:.1%})'
+          + ''.join(f'  {k}={v}' for k, v in sorted(summary['errors_by_kind'].items())))
+    for name, key in (('latency', 'latency_s'), ('first byte', 'first_byte_s')):
+        print(f'  {name:<12} ' + '  '.join(f'{p} {fmt(v)}' for p, v in summary[key].items()))
+
+
+if __name__ == '__main__':
+    main()
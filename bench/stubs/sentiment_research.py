@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in for sentiment_research.py (same JSON shape, fake findings)."""
+import argparse
+import json
+import sys
+
+import stub_latency as stub
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--topic', required=True)
+parser.add_argument('--lang', default='en')
+args = parser.parse_args()
+
+rng = stub.rng_for('sentiment', args.topic, args.lang)
+stub.sleep(3 * stub.sample(stub.TOOL_LATENCY, rng))   # several fetches in the real tool
+if stub.fails(rng):
+    sys.exit(1)
+print(json.dumps({
+    'topic': args.topic,
+    'timestamp': '2026-01-01T00:00:00',
+    'key_statistics': [f'{rng.randint(5, 95)}%' for _ in range(6)],
+    'poll_data': [{'source': f'Poll {i}', 'stats_found': [f'{rng.randint(5, 95)}%'],
+                   'excerpt': stub.sentence(rng, 40)} for i in range(3)],
+    'social_media': [{'platform': p, 'title': stub.sentence(rng, 6), 'snippet': stub.sentence(rng, 25)}
+                     for p in ('reddit', 'x', 'facebook')],
+    'news': [{'title': stub.sentence(rng, 8), 'snippet': stub.sentence(rng, 25)} for _ in range(3)],
+}))
@@ -0,0 +1,65 @@
+"""
+Shared helpers for the offline stubs in this directory: seeded randomness and
+latency distributions, so the same input always gets the same delay and output.
+
+Environment (all optional):
+  STUB_SEED            base seed, change it to get a different but repeatable run (default 0)
+  STUB_LLM_STARTUP     `opencode run` startup cost before any output (default fixed:0.5)
+  STUB_LLM_LATENCY     model generation time after startup (default lognormal:2,0.5)
+  STUB_TOOL_LATENCY    web_search / web_fetch / sentiment_research run time (default lognormal:0.8,0.4)
+  STUB_ERROR_RATE      fraction of calls that exit 1 without output (default 0)
+
+Distributions: fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA, exp:MEAN
+(all in seconds, never negative).
+"""
+import hashlib
+import os
+import random
+import time
+
+SEED = os.environ.get('STUB_SEED', '0')
+LLM_STARTUP = os.environ.get('STUB_LLM_STARTUP', 'fixed:0.5')
+LLM_LATENCY = os.environ.get('STUB_LLM_LATENCY', 'lognormal:2,0.5')
+TOOL_LATENCY = os.environ.get('STUB_TOOL_LATENCY', 'lognormal:0.8,0.4')
+ERROR_RATE = float(os.environ.get('STUB_ERROR_RATE', '0'))
+
+WORDS = ('the router answers each question with a short summary of current events in estonia '
+         'and the wider world including weather markets politics science and local culture').split()
+
+
+def rng_for(*parts):
+    """Random generator seeded by STUB_SEED and the call's inputs."""
+    digest = hashlib.sha256('\x00'.join([SEED, *map(str, parts)]).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], 'big'))
+
+
+def sample(spec, rng):
+    """Draw a delay in seconds from a distribution spec like 'lognormal:2,0.5'."""
+    kind, _, params = spec.partition(':')
+    p = [float(x) for x in params.split(',') if x]
+    if kind == 'fixed':
+        value = p[0]
+    elif kind == 'uniform':
+        value = rng.uniform(p[0], p[1])
+    elif kind == 'normal':
+        value = rng.gauss(p[0], p[1])
+    elif kind == 'lognormal':
+        value = p[0] * rng.lognormvariate(0, p[1])
+    elif kind == 'exp':
+        value = rng.expovariate(1 / p[0])
+    else:
+        raise ValueError(f'unknown distribution {spec!r}')
+    return max(value, 0.0)
+
+
+def fails(rng):
+    return rng.random() < ERROR_RATE
+
+
+def sentence(rng, n=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+
+def sleep(seconds):
+    if seconds > 0:
+        time.sleep(seconds)
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in for the web-browser skill's web_fetch.py (readable page text)."""
+import argparse
+import sys
+
+import stub_latency as stub
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--url', required=True)
+parser.add_argument('--max-chars', type=int, default=3000)
+args = parser.parse_args()
+
+rng = stub.rng_for('web_fetch', args.url)
+stub.sleep(stub.sample(stub.TOOL_LATENCY, rng))
+if stub.fails(rng):
+    sys.exit(1)
+print('\n\n'.join(stub.sentence(rng, 40) for _ in range(12))[:args.max_chars])
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""Deterministic stand-in for the web-browser skill's web_search.py (JSON list of results)."""
+import argparse
+import json
+import sys
+
+import stub_latency as stub
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--query', required=True)
+parser.add_argument('--max-results', type=int, default=5)
+args = parser.parse_args()
+
+rng = stub.rng_for('web_search', args.query)
+stub.sleep(stub.sample(stub.TOOL_LATENCY, rng))
+if stub.fails(rng):
+    sys.exit(1)
+slug = '-'.join(args.query.lower().split())[:40]
+print(json.dumps([
+    {'title': stub.sentence(rng, 6), 'snippet': stub.sentence(rng, 30), 'url': f'https://example.com/{slug}/{i}'}
+    for i in range(args.max_results)
+]))
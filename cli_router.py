@@ -10,10 +10,20 @@ Changes over v6:
        conversational LLM call — the subagent uses real bash tools.
   NEW: Exec tasks use a separate EXEC_TIMEOUT (600s) since installs take longer.
 """
-import json, subprocess, os, re, time, sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
-
-LOG = '/tmp/router_debug.log'
+import json, subprocess, os, re, time, sys, threading, atexit, hashlib, sqlite3, uuid, signal, resource
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as futures_wait
+import logging, logging.handlers, queue, urllib.error, urllib.request
+from collections import deque, OrderedDict
+from contextlib import contextmanager, nullcontext
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from history_policy import TOOL_ARGS_CHARS, history_line, recent_within_budget, trim_turn
+from intent_classifier import detect_intent
+
+LOG = os.environ.get('ROUTER_LOG', '/tmp/router_debug.log')
+LOG_LEVEL = os.environ.get('ROUTER_LOG_LEVEL', 'DEBUG').upper()
+LOG_MAX_BYTES = int(os.environ.get('ROUTER_LOG_MAX_MB', '10')) * 1024 * 1024
+LOG_BACKUPS = int(os.environ.get('ROUTER_LOG_BACKUPS', '3'))
 MODEL = os.environ.get('ROUTER_MODEL', 'opencode/minimax-m2.5-free')
 OPENCODE = os.environ.get('OPENCODE_BIN', '/home/ubuntu/.opencode/bin/opencode')
 TIMEOUT = int(os.environ.get('ROUTER_TIMEOUT', '300'))
@@ -22,7 +32,8 @@ SENTIMENT_TIMEOUT = 90   # seconds for deep research (multiple fetches)
 EXEC_TIMEOUT = 600       # seconds for subagent task execution (installs, builds)
 
 WORKSPACE = '/home/ubuntu/.openclaw/workspace'
-SKILLS_DIR = f'{WORKSPACE}/skills/web-browser/scripts'
+SKILLS_DIR = os.environ.get('ROUTER_SKILLS_DIR', f'{WORKSPACE}/skills/web-browser/scripts')
+WORKDIR = os.environ.get('ROUTER_WORKDIR', '/home/ubuntu')   # cwd for opencode and skill scripts
 WEB_SEARCH = f'{SKILLS_DIR}/web_search.py'
 WEB_FETCH = f'{SKILLS_DIR}/web_fetch.py'
 SENTIMENT_TOOL = f'{SKILLS_DIR}/sentiment_research.py'
@@ -30,13 +41,401 @@ SENTIMENT_TOOL = f'{SKILLS_DIR}/sentiment_research.py'
 # Prompt size limits
 MAX_PROMPT_CHARS = 10000
 MAX_SYSTEM_CHARS = 2000
-MAX_HISTORY_CHARS = 2500
+# History budget (MAX_HISTORY_BYTES) lives in history_policy.py, shared with the bot
 MAX_TOOL_RESULT_CHARS = 4000  # larger for research results
 
+# Concurrency — each model gets its own bounded worker pool with a wait queue
+WORKERS_PER_MODEL = int(os.environ.get('ROUTER_WORKERS', '2'))
+MODEL_WORKERS = os.environ.get('ROUTER_MODEL_WORKERS', '')   # "model=n,model=n" overrides
+EXEC_WORKERS = int(os.environ.get('ROUTER_EXEC_WORKERS', '1'))    # background job executor size
+JOB_QUEUE_MAX = int(os.environ.get('ROUTER_JOB_QUEUE_MAX', '8'))   # queued exec jobs before 429
+JOB_RETENTION = 3600   # seconds a finished job stays pollable
+QUEUE_MAX = int(os.environ.get('ROUTER_QUEUE_MAX', '16'))     # waiting requests per pool
+QUEUE_TIMEOUT = int(os.environ.get('ROUTER_QUEUE_TIMEOUT', '120'))
+# Admission control — priority lanes inside every pool, per-client rate limits, 429 when saturated
+PRIORITIES = ('interactive', 'agent', 'batch')   # highest first
+DEFAULT_PRIORITY = os.environ.get('ROUTER_DEFAULT_PRIORITY', 'agent')   # no header / @suffix
+CLASS_QUEUES = os.environ.get('ROUTER_CLASS_QUEUES', '')   # "class=n,…" waiting-request caps per pool
+INTERACTIVE_RESERVE = int(os.environ.get('ROUTER_INTERACTIVE_RESERVE', '1'))   # workers batch may never take
+CLIENT_RATE = float(os.environ.get('ROUTER_CLIENT_RATE', '120'))   # requests/minute per client, 0 = unlimited
+CLIENT_RATES = os.environ.get('ROUTER_CLIENT_RATES', '')   # "client=n,…" per-client overrides
+BATCH_MAX = int(os.environ.get('ROUTER_BATCH_MAX', '16'))   # chat bodies per /v1/batch request
+SESSION_TTL = int(os.environ.get('ROUTER_SESSION_TTL', '1800'))   # idle seconds before a session is dropped
+SESSION_MAX = int(os.environ.get('ROUTER_SESSION_MAX', '1024'))   # sessions held; 0 = stateless only
+KEEPALIVE_TIMEOUT = int(os.environ.get('ROUTER_KEEPALIVE_TIMEOUT', '75'))  # idle seconds before closing a connection
+
+# Child processes — every opencode / skill subprocess runs in its own process group with these rlimits
+CHILD_MEM_MB = int(os.environ.get('ROUTER_CHILD_MEM_MB', '4096'))       # data segment per process, 0 = no limit
+CHILD_CPU_SECONDS = int(os.environ.get('ROUTER_CHILD_CPU_S', '900'))    # CPU time per process, 0 = no limit
+CHILD_MAX_FILES = int(os.environ.get('ROUTER_CHILD_MAX_FILES', '4096'))  # open file descriptors
+CHILD_TERM_GRACE = 5   # seconds between SIGTERM and SIGKILL when stopping a long-lived child
+
+# Warm workers — long-lived `opencode serve` processes (0 = spawn `opencode run` per request)
+WARM_WORKERS = int(os.environ.get('ROUTER_WARM_WORKERS', '0'))
+WARM_BASE_PORT = int(os.environ.get('ROUTER_WARM_BASE_PORT', '4200'))
+WARM_MAX_REQUESTS = int(os.environ.get('ROUTER_WARM_MAX_REQUESTS', '50'))  # recycle after N
+WARM_HEALTH_INTERVAL = 30   # seconds between idle worker health checks
+WARM_START_TIMEOUT = 60     # seconds for `opencode serve` to come up
+
+# Backends — opencode CLI models and OpenAI-compatible HTTP endpoints (JSON file, see CLI_ROUTER.md)
+BACKENDS_FILE = os.environ.get('ROUTER_BACKENDS', '')
+BREAKER_FAILURES = int(os.environ.get('ROUTER_BREAKER_FAILURES', '3'))   # consecutive failures to open
+BREAKER_COOLDOWN = int(os.environ.get('ROUTER_BREAKER_COOLDOWN', '60'))  # seconds before a trial request
+ADHOC_BACKENDS_MAX = int(os.environ.get('ROUTER_ADHOC_BACKENDS', '32'))  # unconfigured model ids kept, LRU
+EWMA_ALPHA = 0.3   # weight of the newest sample in latency / error-rate averages
+DEFAULT_BACKENDS = {
+    'backends': {
+        'opencode': {
+            'type': 'cli',
+            'models': [MODEL, 'opencode/minimax-m2.5-free', 'opencode/trinity-large-preview-free',
+                       'opencode/glm-5-free'],
+        },
+    },
+    # Any requested model containing the key is rewritten (kimi was dropped from the free tier)
+    'aliases': {'kimi': 'opencode/glm-5-free'},
+}
+
+# Hedging — race a second backend when the first is slower than usual (conversational requests only)
+HEDGE_ENABLED = os.environ.get('ROUTER_HEDGE', '1') != '0'
+HEDGE_PERCENTILE = float(os.environ.get('ROUTER_HEDGE_PERCENTILE', '95'))
+HEDGE_MIN_DELAY = float(os.environ.get('ROUTER_HEDGE_MIN_DELAY', '10'))   # never hedge sooner (seconds)
+HEDGE_RATE = float(os.environ.get('ROUTER_HEDGE_RATE', '2'))              # hedges per minute, bursts of up to this
+HEDGE_MIN_SAMPLES = 10   # first-response times needed before a backend's percentile is trusted
+
+# Response cache — exact prompt match + near-duplicate questions, persisted in SQLite
+CACHE_ENABLED = os.environ.get('ROUTER_CACHE', '1') != '0'
+CACHE_DB = os.environ.get('ROUTER_CACHE_DB', os.path.expanduser('~/.cache/claw-router/responses.db'))
+CACHE_MAX_ENTRIES = int(os.environ.get('ROUTER_CACHE_MAX', '500'))
+CACHE_NEAR_THRESHOLD = float(os.environ.get('ROUTER_CACHE_NEAR', '0.8'))  # Jaccard, 0 = off
+CACHE_NEAR_MIN_WORDS = int(os.environ.get('ROUTER_CACHE_NEAR_MIN_WORDS', '8'))  # shorter: wording must match
+CACHE_TTLS = {   # seconds per intent; 'chat' = no tool intent
+    'estonian_news': 900,
+    'web_search': 1800,
+    'web_fetch': 3600,
+    'sentiment_research': 3600,
+    'chat': 3600,
+}
+
+# Tool result cache — skips web_search.py / web_fetch.py runs for repeated queries
+TOOL_CACHE_ENABLED = os.environ.get('ROUTER_TOOL_CACHE', '1') != '0'
+TOOL_CACHE_MAX_BYTES = int(os.environ.get('ROUTER_TOOL_CACHE_MB', '16')) * 1024 * 1024
+TOOL_CACHE_TTLS = {   # seconds fresh; entries are served stale for another TTL while refreshing
+    'estonian_news': 300,
+    'web_search': 900,
+    'web_fetch': 3600,
+    'sentiment_research': 1800,
+}
+
+# Traffic capture — append sanitized chat-completion bodies to a JSONL file for bench/replay.py
+CAPTURE_FILE = os.environ.get('ROUTER_CAPTURE_FILE', '')
+
+
+# ─── Logging ─────────────────────────────────────────────────────────────────
+# log() only enqueues a record; a background QueueListener thread formats it as a
+# JSON line and writes it to a size-rotated file, so request threads never block
+# on file I/O and concurrent lines never interleave.
+
+_log_ctx = threading.local()
+
+
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname.lower(),
+        }
+        if getattr(record, 'rid', None):
+            entry['rid'] = record.rid
+        entry['msg'] = record.getMessage()
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _setup_logger():
+    logger = logging.getLogger('cli_router')
+    logger.setLevel(getattr(logging, LOG_LEVEL, logging.DEBUG))
+    logger.propagate = False
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+    file_handler.setFormatter(JsonLineFormatter())
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.start()
+    atexit.register(listener.stop)   # flush what's queued on shutdown
+    return logger
+
+
+# Captured traffic goes through the same queue + listener pattern, one raw JSON
+# line per request. Secrets and personal identifiers are redacted first, so a
+# capture can be copied off the VPS and replayed on a laptop.
+
+_REDACT_PATTERNS = [
+    (re.compile(r'\b\d{6,12}:[A-Za-z0-9_-]{30,}'), '<telegram-token>'),
+    (re.compile(r'\b(?:sk|gsk|pk|rk)[-_][A-Za-z0-9_-]{16,}'), '<api-key>'),
+    (re.compile(r'\bAIza[A-Za-z0-9_-]{30,}'), '<api-key>'),
+    (re.compile(r'(?i)\bbearer\s+[A-Za-z0-9._~+/=-]{12,}'), 'Bearer <token>'),
+    (re.compile(r'[\w.+-]+@[\w-]+\.[\w.-]+'), '<email>'),
+    (re.compile(r'\+\d[\d ()-]{7,}\d'), '<phone>'),
+    (re.compile(r'\b\d{7,}\b'), '<number>'),   # chat / user ids
+]
+_DROP_FIELDS = {'user', 'api_key', 'metadata'}
+
+
+def sanitize(value):
+    """Copy of a request body with secrets, emails and long numbers redacted."""
+    if isinstance(value, str):
+        for pattern, replacement in _REDACT_PATTERNS:
+            value = pattern.sub(replacement, value)
+        return value
+    if isinstance(value, dict):
+        return {k: sanitize(v) for k, v in value.items() if k not in _DROP_FIELDS}
+    if isinstance(value, list):
+        return [sanitize(v) for v in value]
+    return value
+
+
+def _setup_capture():
+    if not CAPTURE_FILE:
+        return None
+    logger = logging.getLogger('cli_router.capture')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    file_handler = logging.FileHandler(CAPTURE_FILE, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+
+_logger = _setup_logger()
+_capture = _setup_capture()
+_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+
+
+def capture_request(path, body):
+    """Record an incoming request body for replay (no-op unless ROUTER_CAPTURE_FILE is set)."""
+    if _capture:
+        _capture.info(json.dumps({'ts': round(time.time(), 3), 'path': path, 'body': sanitize(body)},
+                                 ensure_ascii=False))
+
+
+def set_request_id(rid):
+    """Tag every log line from this thread with a request (or job) id."""
+    _log_ctx.rid = rid
+
+
+def current_request_id():
+    return getattr(_log_ctx, 'rid', None)
+
+
+def log(msg, level='info', **fields):
+    """Log one JSON line; extra keyword fields (durations, sizes…) are included as keys."""
+    levelno = _LEVELS.get(level, logging.INFO)
+    if _logger.isEnabledFor(levelno):
+        _logger.log(levelno, msg, extra={'rid': current_request_id(), 'fields': fields})
+
+
+# ─── Metrics ─────────────────────────────────────────────────────────────────
+# In-process counters and histograms rendered as Prometheus text on GET /metrics.
+# Pool, cache, job and flight gauges are read from their own stats() at scrape time.
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+_METRICS = []
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_str(names, values, extra=()):
+    """Prometheus label set, e.g. {model="x",le="5"}; '' when there are no labels."""
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape_label(v)}"' for n, v in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_label_str(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _METRICS.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_label_str(self.labels, key, [("le", bound)])} {count}')
+                lines.append(f'{self.name}_bucket{_label_str(self.labels, key, [("le", "+Inf")])} {series[-1]}')
+                lines.append(f'{self.name}_sum{_label_str(self.labels, key)} {round(series[-2], 6)}')
+                lines.append(f'{self.name}_count{_label_str(self.labels, key)} {series[-1]}')
+        return lines
+
+
+M_REQUESTS = Counter('router_requests_total', 'Chat requests by detected intent', ('intent',))
+M_HTTP = Counter('router_http_responses_total', 'HTTP responses by route and status', ('route', 'code'))
+M_TIMEOUTS = Counter('router_timeouts_total', 'Timed-out tool and LLM calls', ('stage',))
+M_REQUEST_SECONDS = Histogram('router_request_seconds', 'Whole HTTP request time', ('route',))
+M_TOOL_SECONDS = Histogram('router_tool_seconds', 'Tool pre-execution time by intent', ('intent',))
+M_PROMPT_SECONDS = Histogram('router_prompt_build_seconds', 'Prompt assembly time, including tool pre-execution')
+M_QUEUE_SECONDS = Histogram('router_queue_wait_seconds', 'Time waiting for a pool worker', ('pool', 'priority'))
+M_FIRST_BYTE_SECONDS = Histogram('router_llm_first_byte_seconds', 'opencode spawn to first response line',
+                                 ('model', 'mode'))
+M_LLM_SECONDS = Histogram('router_llm_seconds', 'Total opencode generation time', ('model', 'mode'))
+
+
+def _gauge(name, help_text, samples, kind='gauge'):
+    """Render {labels_str: value} read from a component's stats() at scrape time."""
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+    lines += [f'{name}{labels} {value}' for labels, value in samples.items()]
+    return lines
+
+
+def render_metrics():
+    lines = []
+    for metric in _METRICS:
+        lines += metric.render()
+
+    pools = pool_stats()
+    for key, name, help_text, kind in (
+            ('active', 'router_pool_active', 'Requests running on a pool', 'gauge'),
+            ('queue_depth', 'router_pool_queue_depth', 'Requests waiting for a pool worker', 'gauge'),
+            ('workers', 'router_pool_workers', 'Pool size', 'gauge'),
+            ('rejected', 'router_pool_rejected_total', 'Requests rejected with 429 (class queue full)', 'counter'),
+            ('timed_out', 'router_pool_timeouts_total', 'Requests that gave up waiting for a worker', 'counter')):
+        lines += _gauge(name, help_text, {_label_str(('pool',), (p,)): s[key] for p, s in pools.items()}, kind)
+    lines += _gauge('router_pool_class_queue_depth', 'Requests waiting for a pool worker by priority class', {
+        _label_str(('pool', 'priority'), (p, c)): n for p, s in pools.items() for c, n in s['queues'].items()})
+
+    caches = {}
+    if RESPONSE_CACHE:
+        r = RESPONSE_CACHE.stats()
+        caches['responses'] = {'hit': r['hits_exact'] + r['hits_near'], 'miss': r['misses'], 'entries': r['entries']}
+        lines += _gauge('router_response_cache_lookups_total', 'Response cache lookups by result', {
+            _label_str(('result',), ('exact',)): r['hits_exact'],
+            _label_str(('result',), ('near',)): r['hits_near'],
+            _label_str(('result',), ('miss',)): r['misses']}, 'counter')
+    if TOOL_CACHE:
+        t = TOOL_CACHE.stats()
+        caches['tools'] = {'hit': t['hits'] + t['stale_hits'], 'miss': t['misses'], 'entries': t['entries']}
+    m = SYSTEM_MEMO.stats()
+    caches['system_prompt'] = {'hit': m['hits'], 'miss': m['misses'], 'entries': m['entries']}
+    lines += _gauge('router_cache_hit_ratio', 'Hit rate since start', {
+        _label_str(('cache',), (c,)): round(v['hit'] / (v['hit'] + v['miss']), 4) if v['hit'] + v['miss'] else 0
+        for c, v in caches.items()})
+    lines += _gauge('router_cache_entries', 'Entries held', {
+        _label_str(('cache',), (c,)): v['entries'] for c, v in caches.items()})
+
+    backends = BACKENDS.stats()
+    lines += _gauge('router_backend_latency_seconds', 'EWMA latency per backend', {
+        _label_str(('backend',), (b,)): st['latency_s'] for b, st in backends.items() if st['latency_s'] is not None})
+    lines += _gauge('router_backend_error_rate', 'EWMA error rate per backend', {
+        _label_str(('backend',), (b,)): st['error_rate'] for b, st in backends.items()})
+    lines += _gauge('router_backend_circuit_open', '1 while the circuit breaker holds the backend out', {
+        _label_str(('backend',), (b,)): int(st['state'] == 'open') for b, st in backends.items()})
+
+    ch = CHILDREN.stats()
+    lines += _gauge('router_child_processes', 'Live subprocesses started by the router', {
+        _label_str(('kind',), (k,)): n for k, n in ch['live'].items()})
+    lines += _gauge('router_child_group_processes', 'Processes in live child process groups (grandchildren included)', {
+        _label_str(('kind',), (k,)): n for k, n in CHILDREN.group_sizes().items()})
+    lines += _gauge('router_child_spawned_total', 'Subprocesses started', {
+        _label_str(('kind',), (k,)): n for k, n in ch['spawned'].items()}, 'counter')
+    lines += _gauge('router_child_killed_total', 'Process groups killed', {
+        _label_str(('kind', 'reason'), tuple(key.split('/'))): n for key, n in ch['killed'].items()}, 'counter')
+
+    f = FLIGHTS.stats()
+    c = CONNECTIONS.stats()
+    lines += _gauge('router_http_connections_open', 'Client connections currently open', {'': c['open']})
+    lines += _gauge('router_http_connections_total', 'Client connections accepted', {'': c['opened']}, 'counter')
+    lines += _gauge('router_http_requests_reused_total', 'Requests served on an already-used connection',
+                    {'': c['reused']}, 'counter')
+    lines += _gauge('router_http_idle_closed_total', 'Connections closed after KEEPALIVE_TIMEOUT idle',
+                    {'': c['idle_closed']}, 'counter')
+    ss = SESSIONS.stats()
+    lines += _gauge('router_sessions', 'Conversation sessions held', {'': ss['active']})
+    lines += _gauge('router_session_requests_total', 'Session requests by outcome', {
+        _label_str(('result',), (label,)): ss[k]
+        for k, label in (('started', 'started'), ('resumed', 'resumed'), ('resyncs', 'resync'))}, 'counter')
+    lines += _gauge('router_sessions_dropped_total', 'Sessions dropped by reason', {
+        _label_str(('reason',), (k,)): ss[k] for k in ('expired', 'evicted')}, 'counter')
+    lines += _gauge('router_flights_in_flight', 'LLM calls currently running', {'': f['in_flight']})
+    lines += _gauge('router_flights_coalesced_total', 'Requests that joined an in-flight call',
+                    {'': f['coalesced']}, 'counter')
+    statuses = {}
+    for job in JOBS.list():
+        statuses[job.status] = statuses.get(job.status, 0) + 1
+    lines += _gauge('router_jobs', 'Retained exec jobs by status', {
+        _label_str(('status',), (st,)): n for st, n in sorted(statuses.items())})
+    return '\n'.join(lines) + '\n'
+
+
+def parse_kv_spec(spec, env_name):
+    """Parse a "key=n,key=n" env override into {key: int}."""
+    values = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, n = item.rsplit('=', 1)
+            try:
+                values[name.strip()] = int(n)
+            except ValueError:
+                log(f'Ignoring bad {env_name} entry: {item!r}', 'warning')
+    return values
 
-def log(msg):
-    with open(LOG, 'a') as f:
-        f.write(f'[{time.strftime("%H:%M:%S")}] {msg}\n')
+
+CACHE_TTLS.update(parse_kv_spec(os.environ.get('ROUTER_CACHE_TTLS', ''), 'ROUTER_CACHE_TTLS'))
+CLASS_QUEUE_MAX = {'interactive': QUEUE_MAX, 'agent': QUEUE_MAX // 2, 'batch': 4}
+CLASS_QUEUE_MAX.update(parse_kv_spec(CLASS_QUEUES, 'ROUTER_CLASS_QUEUES'))
+TOOL_CACHE_TTLS.update(parse_kv_spec(os.environ.get('ROUTER_TOOL_CACHE_TTLS', ''), 'ROUTER_TOOL_CACHE_TTLS'))
 
 
 def content_to_text(content):
@@ -66,7 +465,7 @@ def clean_user_msg(text):
     return cleaned
 
 
-def compress_system_prompt(text):
+def _compress_system_prompt(text):
     """
     Extract essential identity and behavior from OpenClaw's 26K system prompt.
     Return a minimal ~2K char version.
@@ -129,71 +528,222 @@ def compress_system_prompt(text):
     return result[:MAX_SYSTEM_CHARS]
 
 
-# ─── Intent detection & pre-execution ───────────────────────────────────────
+class SystemPromptMemo:
+    """
+    Bounded LRU of compressed system prompts keyed by a hash of the full text.
+    OpenClaw resends the same ~26K prompt every turn, so the regex extraction
+    runs once per distinct prompt. Tracks how much compression time hits saved.
+    """
 
-ESTONIAN_NEWS_KEYWORDS = [
-    'estonian news', 'estonia news', 'eesti uudised', 'eesti uudis',
-    'err.ee', 'postimees', 'delfi', 'estonian', 'estonia',
-]
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.compute_time = 0.0   # total seconds spent compressing on misses
+
+    def avg_cost(self):
+        return self.compute_time / self.misses if self.misses else 0.0
+
+    def compress(self, text):
+        """Return (compressed, seconds_saved) — seconds_saved is 0.0 on a miss."""
+        if not text or len(text) < 500:
+            return text, 0.0
+        key = hashlib.sha1(text.encode()).hexdigest()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key], self.avg_cost()
+        start = time.perf_counter()
+        compressed = _compress_system_prompt(text)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.misses += 1
+            self.compute_time += elapsed
+            self._entries[key] = compressed
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compressed, 0.0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'avg_compress_ms': round(self.avg_cost() * 1000, 3),
+                'saved_ms': round(self.hits * self.avg_cost() * 1000, 1),
+            }
 
-SENTIMENT_KEYWORDS = [
-    'sentiment', 'public opinion', 'what do people think', 'what are people saying',
-    'what are conservatives', 'what are liberals', 'social media', 'facebook',
-    'twitter', 'polls', 'poll', 'survey', 'opinion poll', 'population thinks',
-    'citizens think', 'society thinks', 'public view', 'community thinks',
-    'what does society', 'population sentiment', 'deep research', 'scientific research',
-    'how do estonians', 'eestlased', 'hoiakud', 'rahvaküsitlus', 'küsitlus',
-    'what do estonians think', 'estonian opinion', 'citizen sentiment',
-]
 
-# Exec task: imperative action words that should trigger real subagent execution
-EXEC_PATTERNS = re.compile(
-    r'^(install|uninstall|remove|setup|deploy|configure|run |execute|start|stop|restart'
-    r'|create|build|make |fix|update|upgrade|download|clone|write|implement|add skill'
-    r'|install skill|test |generate|render|compile)',
-    re.IGNORECASE
-)
-# Words that flip exec → question (don't exec if it's a question about doing something)
-QUESTION_WORDS = re.compile(r'^(what|how|why|when|where|which|can you|could you|would|should|is there|are there)', re.IGNORECASE)
-
-
-def detect_intent(user_msg):
-    """Return (intent, query) tuple."""
-    msg_lower = user_msg.lower()
-    stripped = user_msg.strip()
-
-    # Sentiment / deep research — check before news/search (more specific)
-    if any(kw in msg_lower for kw in SENTIMENT_KEYWORDS):
-        return ('sentiment_research', user_msg)
-
-    # Estonian news
-    if any(kw in msg_lower for kw in ESTONIAN_NEWS_KEYWORDS):
-        if any(w in msg_lower for w in ['news', 'uudis', 'report', 'today', 'latest', 'what', 'tell']):
-            return ('estonian_news', user_msg)
-
-    # Exec task: imperative verb, no question mark, not a question opener
-    if (EXEC_PATTERNS.match(stripped)
-            and not stripped.endswith('?')
-            and not QUESTION_WORDS.match(stripped)):
-        return ('exec_task', user_msg)
-
-    # Explicit web search
-    if re.search(r'\b(search|look up|find|google|research|web)\b', msg_lower):
-        query_match = re.search(
-            r'(?:search(?:\s+for)?|look\s+up|find|google|research)\s+(.+)', msg_lower
-        )
-        if query_match:
-            return ('web_search', query_match.group(1).strip())
-        return ('web_search', user_msg)
+SYSTEM_MEMO = SystemPromptMemo()
 
-    # URL in message — fetch it
-    url_match = re.search(r'https?://\S+', user_msg)
-    if url_match:
-        return ('web_fetch', url_match.group(0))
 
-    return (None, user_msg)
+def compress_system_prompt(text):
+    """Memoized _compress_system_prompt — same input always gives the same output."""
+    return SYSTEM_MEMO.compress(text)[0]
+
+
+# ─── Child processes ─────────────────────────────────────────────────────────
+# subprocess.run(timeout=…) and Popen.kill() only signal the direct child, so
+# opencode's own tool processes and web_fetch.py's headless browsers survived
+# timeouts. Every router subprocess is started through CHILDREN instead: it
+# gets its own process group (killed as a whole), rlimits, and is tracked
+# until reaped so /metrics can show what is running.
+
+class ChildProcesses:
+    """Spawns, limits, kills and counts the router's subprocesses."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._live = {}   # pid → (kind, Popen)
+        self.spawned = {}
+        self.killed = {}   # (kind, reason) → n
+
+    @staticmethod
+    def _limit(pid, cpu_seconds):
+        # prlimit after fork instead of preexec_fn, which isn't safe in a threaded server.
+        # RLIMIT_DATA rather than RLIMIT_AS: node/bun and Chromium reserve huge address ranges.
+        limits = []
+        if CHILD_MEM_MB:
+            limits.append((resource.RLIMIT_DATA, CHILD_MEM_MB * 1024 * 1024))
+        if cpu_seconds:
+            limits.append((resource.RLIMIT_CPU, cpu_seconds))
+        if CHILD_MAX_FILES:
+            limits.append((resource.RLIMIT_NOFILE, CHILD_MAX_FILES))
+        for which, value in limits:
+            try:
+                _, hard = resource.prlimit(pid, which)
+                if hard != resource.RLIM_INFINITY:
+                    value = min(value, hard)
+                if which == resource.RLIMIT_CPU:   # SIGXCPU at the soft limit, SIGKILL 5s of CPU later
+                    hard = value + 5 if hard == resource.RLIM_INFINITY else min(value + 5, hard)
+                resource.prlimit(pid, which, (value, hard))
+            except (OSError, ValueError) as e:
+                log(f'prlimit {which} on {pid} failed: {e}', 'warning')
+
+    def spawn(self, kind, cmd, cpu_seconds=CHILD_CPU_SECONDS, **kwargs):
+        """Popen in a new process group with rlimits applied; reap() or kill() it when done."""
+        proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+        self._limit(proc.pid, cpu_seconds)
+        with self._lock:
+            self._live[proc.pid] = (kind, proc)
+            self.spawned[kind] = self.spawned.get(kind, 0) + 1
+        return proc
+
+    def kill(self, proc, reason='timeout', sig=signal.SIGKILL):
+        """Signal the child's whole process group. Safe to call on an already finished child."""
+        with self._lock:
+            kind = self._live.get(proc.pid, ('unknown',))[0]
+        try:
+            os.killpg(proc.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return False
+        if sig == signal.SIGKILL:
+            with self._lock:
+                self.killed[(kind, reason)] = self.killed.get((kind, reason), 0) + 1
+        return True
+
+    def stop(self, proc, grace=CHILD_TERM_GRACE):
+        """SIGTERM the group, SIGKILL it if the leader is still up after `grace` seconds."""
+        if self.kill(proc, 'stopped', signal.SIGTERM):
+            try:
+                proc.wait(timeout=grace)
+            except subprocess.TimeoutExpired:
+                pass
+        self.kill(proc, 'stopped')
+        self.reap(proc)
+
+    def reap(self, proc, kill_leftovers=False):
+        """Wait for a finished (or killed) child and stop tracking it."""
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.kill(proc, 'stuck')
+            proc.wait()
+        if kill_leftovers and self._group_counts().get(proc.pid):
+            self.kill(proc, 'leftover')   # the leader is gone; whatever is left in its group was orphaned
+        with self._lock:
+            self._live.pop(proc.pid, None)
+
+    @staticmethod
+    def _group_counts():
+        """{pgid: running (non-zombie) processes} read from /proc."""
+        counts = {}
+        try:
+            pids = [p for p in os.listdir('/proc') if p.isdigit()]
+        except OSError:
+            return counts
+        for pid in pids:
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    state, _, _, pgid = f.read().rsplit(')', 1)[1].split()[:4]
+            except (OSError, ValueError):
+                continue
+            if state != 'Z':
+                counts[int(pgid)] = counts.get(int(pgid), 0) + 1
+        return counts
+
+    def group_sizes(self):
+        """{kind: processes in live child groups}, grandchildren included."""
+        with self._lock:
+            groups = {pid: kind for pid, (kind, _) in self._live.items()}
+        counts = self._group_counts()
+        sizes = dict.fromkeys(groups.values(), 0)
+        for pgid, kind in groups.items():
+            sizes[kind] += counts.get(pgid, 0)
+        return sizes
+
+    def stats(self):
+        with self._lock:
+            live = {}
+            for kind, _ in self._live.values():
+                live[kind] = live.get(kind, 0) + 1
+            return {'live': live, 'spawned': dict(self.spawned),
+                    'killed': {f'{k}/{r}': n for (k, r), n in self.killed.items()}}
+
+    def kill_all(self):
+        with self._lock:
+            procs = [proc for _, proc in self._live.values()]
+        for proc in procs:
+            self.kill(proc, 'shutdown')
+
+
+CHILDREN = ChildProcesses()
+atexit.register(CHILDREN.kill_all)
+
+
+def run_child(kind, cmd, timeout, **kwargs):
+    """subprocess.run(capture_output=True, text=True) that kills the whole process tree on timeout."""
+    proc = CHILDREN.spawn(kind, cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, **kwargs)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                out, err = proc.communicate(timeout=max(0.0, min(0.5, deadline - time.monotonic())))
+                break
+            except subprocess.TimeoutExpired:   # communicate() keeps what it read so far
+                if proc.poll() is not None:
+                    # The tool answered and exited but a grandchild (browser) still holds the pipes
+                    CHILDREN.kill(proc, 'leftover')
+                    out, err = proc.communicate()
+                    break
+                if time.monotonic() >= deadline:
+                    CHILDREN.kill(proc)
+                    proc.communicate()
+                    raise subprocess.TimeoutExpired(cmd, timeout)
+    finally:
+        CHILDREN.reap(proc, kill_leftovers=True)   # tools must not leave browsers behind once they've answered
+    return subprocess.CompletedProcess(cmd, proc.returncode, out, err)
 
 
+# ─── Intent detection & pre-execution ───────────────────────────────────────
+
+# Keyword lists, exec/question patterns and detect_intent() live in intent_classifier.py
+# (shared with telegram_bot.py).
+
 def format_sentiment_data(data):
     """Convert sentiment_research.py JSON output into a readable context for the LLM."""
     lines = [f'DEEP RESEARCH DATA — Topic: {data.get("topic", "unknown")}',
@@ -267,10 +817,7 @@ def format_sentiment_data(data):
 def run_tool(cmd, timeout=TOOL_TIMEOUT):
     """Run a shell command and return stdout, stripping ANSI and warning lines."""
     try:
-        result = subprocess.run(
-            cmd, capture_output=True, text=True, timeout=timeout,
-            cwd='/home/ubuntu'
-        )
+        result = run_child('tool', cmd, timeout, cwd=WORKDIR)
         out = result.stdout + result.stderr
         # Strip ANSI
         out = re.sub(r'\x1b\[[0-9;]*m', '', out)
@@ -281,9 +828,11 @@ def run_tool(cmd, timeout=TOOL_TIMEOUT):
         ).strip()
         return out
     except subprocess.TimeoutExpired:
+        log(f'Tool timed out after {timeout}s: {cmd[:2]}', 'warning')
+        M_TIMEOUTS.inc(stage='tool')
         return None
     except Exception as e:
-        log(f'Tool error: {e}')
+        log(f'Tool error: {e}', 'error')
         return None
 
 
@@ -379,31 +928,29 @@ def do_sentiment_research(user_msg):
     # Keep a reasonable topic length
     topic = topic[:120]
     try:
-        result = subprocess.run(
-            ['python3', SENTIMENT_TOOL, '--topic', topic, '--lang', 'en'],
-            capture_output=True, text=True, timeout=SENTIMENT_TIMEOUT,
-            cwd='/home/ubuntu'
-        )
+        result = run_child('tool', ['python3', SENTIMENT_TOOL, '--topic', topic, '--lang', 'en'],
+                           SENTIMENT_TIMEOUT, cwd=WORKDIR)
         if result.stdout:
             data = json.loads(result.stdout)
             formatted = format_sentiment_data(data)
             log(f'Sentiment research complete: {len(formatted)} chars')
             return formatted
     except subprocess.TimeoutExpired:
-        log('Sentiment research timed out — falling back to web search')
+        log('Sentiment research timed out — falling back to web search', 'warning')
         return do_web_search(topic + ' public opinion poll sentiment 2026')
     except Exception as e:
-        log(f'Sentiment research error: {e}')
+        log(f'Sentiment research error: {e}', 'error')
     return None
 
 
-def do_exec_task(task_description, model=None):
+def do_exec_task(task_description, model=None, job=None):
     """
     Spawn a real opencode subagent (--agent build) to execute a task with bash tools.
-    Returns (exec_output, is_exec) where is_exec=True means skip normal LLM call.
+    Returns the subagent's output. When run as a job, output lines are appended to
+    job.output as they arrive and the process is registered for cancellation.
     """
     if model is None:
-        model = MODEL
+        model = DEFAULT_MODEL
     log(f'Exec subagent: "{task_description[:80]}"')
 
     exec_prompt = (
@@ -411,32 +958,137 @@ def do_exec_task(task_description, model=None):
         f"Execute the following task using bash commands. "
         f"Be a DOER not a talker: actually run commands, show real output, fix errors.\n\n"
         f"TASK: {task_description}\n\n"
-        f"Working directory: /home/ubuntu\n"
+        f"Working directory: {WORKDIR}\n"
         f"Available: python3, pip3, npm, node, ffmpeg, git, apt (sudo), curl, wget\n"
         f"Report exactly what you ran and what the output was. If it failed, fix it."
     )
 
+    lines = []
+    for line in stream_opencode(
+            model, exec_prompt, timeout=EXEC_TIMEOUT, agent='build', noise_prefix=10,
+            timeout_msg=f'Subagent timed out after {EXEC_TIMEOUT}s — the task may still be running in the background.',
+            empty_msg='Task completed (no output)', on_spawn=job.attach if job else None):
+        if job and job.status == 'cancelled':
+            break   # killed: what follows is the stream's own end-of-run message, not output
+        lines.append(line)
+        if job:
+            job.output.append(line)
+    output = ''.join(lines).strip()
+    log(f'Exec subagent done: {len(output)} chars')
+    return output
+
+
+def opencode_env():
     env = os.environ.copy()
     env['PATH'] = os.path.dirname(OPENCODE) + ':' + env.get('PATH', '')
+    return env
 
+
+def is_opencode_noise(line, prefix=20):
+    """True for blank lines and opencode's '> build' style startup/status lines."""
+    return not line or line.startswith('>') or 'build' in line.lower()[:prefix]
+
+
+def stream_opencode(model, prompt, timeout=TIMEOUT, agent=None, noise_prefix=20,
+                    timeout_msg=None, empty_msg='No response', on_spawn=None):
+    """
+    Run `opencode run` and yield cleaned response lines as soon as they are printed.
+    ANSI codes and startup noise are stripped line by line. With warm workers
+    enabled the CLI attaches to an idle `opencode serve` instead of booting its own.
+    on_spawn(proc) is called once the process exists (used for job cancellation).
+    """
+    srv = None
+    args = ['-m', model] + (['--agent', agent] if agent else []) + [prompt]
+    cmd = [OPENCODE, 'run'] + args
+    if _WARM_POOL:
+        try:
+            srv = _WARM_POOL.checkout(wait=0)
+            cmd = [OPENCODE, 'run', '--attach', srv.url] + args
+        except WarmUnavailable:
+            pass
+    if timeout_msg is None:
+        timeout_msg = f'Taking longer than {timeout}s — free model is still working. Try again in a moment.'
+
+    mode = 'attach' if srv else 'cold'
+    start = time.monotonic()
     try:
-        result = subprocess.run(
-            [OPENCODE, 'run', '--agent', 'build', '-m', model, exec_prompt],
-            capture_output=True, text=True, timeout=EXEC_TIMEOUT,
-            env=env, cwd='/home/ubuntu'
+        proc = CHILDREN.spawn(
+            'exec' if agent else 'opencode', cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, bufsize=1, env=opencode_env(), cwd=WORKDIR
         )
-        raw = result.stdout + result.stderr
-        cleaned = re.sub(r'\x1b\[[0-9;]*m', '', raw)
-        lines = [l.strip() for l in cleaned.split('\n')
-                 if l.strip() and not l.strip().startswith('>') and 'build' not in l.strip().lower()[:10]]
-        output = '\n'.join(lines).strip() or 'Task completed (no output)'
-        log(f'Exec subagent done: {len(output)} chars')
-        return output
-    except subprocess.TimeoutExpired:
-        return f'Subagent timed out after {EXEC_TIMEOUT}s — the task may still be running in the background.'
     except Exception as e:
-        log(f'Exec subagent error: {e}')
-        return f'Subagent error: {e}'
+        log(f'Error: {e}', 'error')
+        if srv:
+            _WARM_POOL.checkin(srv)
+        yield f'Router error: {e}'
+        return
+
+    if on_spawn:
+        on_spawn(proc)
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        CHILDREN.kill(proc)
+
+    timer = threading.Timer(timeout, on_timeout)
+    timer.start()
+    total = 0
+    first_at = None
+    try:
+        for raw in proc.stdout:
+            line = re.sub(r'\x1b\[[0-9;]*m', '', raw).strip()
+            if is_opencode_noise(line, noise_prefix):
+                continue
+            if first_at is None:
+                first_at = time.monotonic() - start
+                M_FIRST_BYTE_SECONDS.observe(first_at, model=BACKENDS.label(model), mode=mode)
+            total += len(line) + 1
+            yield line + '\n'
+        proc.wait()
+        M_LLM_SECONDS.observe(time.monotonic() - start, model=BACKENDS.label(model), mode=mode)
+        if timed_out.is_set():
+            log(f'TIMEOUT after {timeout}s', 'warning')
+            M_TIMEOUTS.inc(stage='llm')
+            yield timeout_msg
+        elif not total:
+            yield empty_msg
+        else:
+            elapsed = time.monotonic() - start
+            log(f'LLM response ({total} chars, first line after {first_at:.1f}s, done in {elapsed:.1f}s)',
+                stage='llm', model=model, chars=total,
+                first_byte_ms=int(first_at * 1000), ms=int(elapsed * 1000))
+    finally:
+        timer.cancel()
+        if proc.poll() is None:   # client went away mid-stream
+            CHILDREN.kill(proc, 'abandoned')
+        CHILDREN.reap(proc)
+        if srv:
+            srv.requests += 1
+            _WARM_POOL.checkin(srv)
+
+
+def call_opencode(model, prompt, timeout=TIMEOUT, on_spawn=None):
+    """Run a conversational opencode call and return the cleaned response text.
+
+    Uses a warm `opencode serve` worker when the pool is enabled, otherwise
+    (or if no worker is usable) spawns a fresh `opencode run`. on_spawn gets
+    the process, or a WarmCall for a warm worker.
+    """
+    if _WARM_POOL:
+        start = time.monotonic()
+        try:
+            cleaned = _WARM_POOL.prompt(model, prompt, timeout, on_spawn=on_spawn) or 'No response'
+            M_LLM_SECONDS.observe(time.monotonic() - start, model=BACKENDS.label(model), mode='warm')
+            log(f'LLM response (warm, {len(cleaned)} chars): {cleaned[:150]}')
+            return cleaned
+        except TimeoutError:
+            log(f'TIMEOUT after {timeout}s (warm)', 'warning')
+            M_TIMEOUTS.inc(stage='llm')
+            return f'Taking longer than {timeout}s — free model is still working. Try again in a moment.'
+        except WarmUnavailable as e:
+            log(f'Warm worker unavailable ({e}), spawning opencode run')
+    return ''.join(stream_opencode(model, prompt, timeout=timeout, on_spawn=on_spawn)).strip()
 
 
 def pre_execute_tools(user_msg):
@@ -447,32 +1099,36 @@ def pre_execute_tools(user_msg):
     """
     intent, param = detect_intent(user_msg)
     log(f'Intent detected: {intent}')
+    M_REQUESTS.inc(intent=intent or 'chat')
+    if intent is None:
+        return (None, False)
+
+    with M_TOOL_SECONDS.time(intent=intent):
+        return _run_intent(intent, param)
 
+
+def _run_intent(intent, param):
+    """Run the pre-execution step for a detected intent (timed by pre_execute_tools)."""
     if intent == 'exec_task':
-        output = do_exec_task(param)
-        return (output, True)  # bypass LLM, return exec output directly
+        # Runs on the job executor so exec tasks can't starve conversational traffic
+        job = JOBS.submit(param)
+        job.wait(EXEC_TIMEOUT + QUEUE_TIMEOUT)
+        return (job.result or job.error or 'Subagent still running — check /v1/jobs/' + job.id, True)
     elif intent == 'sentiment_research':
-        return (do_sentiment_research(param), False)
+        return (cached_tool('sentiment_research', param, do_sentiment_research), False)
     elif intent == 'estonian_news':
-        return (fetch_estonian_news(), False)
+        return (cached_tool('estonian_news', '', lambda _: fetch_estonian_news()), False)
     elif intent == 'web_search':
-        return (do_web_search(param), False)
+        return (cached_tool('web_search', param, do_web_search), False)
     elif intent == 'web_fetch':
-        return (do_web_fetch(param), False)
+        return (cached_tool('web_fetch', param, do_web_fetch), False)
     return (None, False)
 
 
 # ─── Prompt assembly ─────────────────────────────────────────────────────────
 
-def build_prompt(messages, tools=None):
-    """
-    Build a compact prompt for the LLM.
-
-    v5 changes:
-    - History is properly limited (fixes v4 bug where history_text never updated)
-    - User message is ALWAYS included (truncate history, not the end of the prompt)
-    - Tool results are injected before the user message
-    """
+def parse_messages(messages):
+    """Split chat messages into (system text, cleaned history entries, last user text)."""
     system_text = ''
     history_entries = []
     last_user_msg = ''
@@ -490,13 +1146,32 @@ def build_prompt(messages, tools=None):
                 history_entries.append(('user', cleaned))
         elif role == 'assistant':
             if text:
-                truncated = text[:200] + '…' if len(text) > 200 else text
-                history_entries.append(('assistant', truncated))
+                history_entries.append(('assistant', trim_turn('assistant', text)))
             for tc in msg.get('tool_calls', []):
                 fn = tc.get('function', {})
-                history_entries.append(('tool_call', f"{fn.get('name','?')}({fn.get('arguments','')[:60]})"))
+                history_entries.append(('tool_call', f"{fn.get('name','?')}({fn.get('arguments','')[:TOOL_ARGS_CHARS]})"))
         elif role == 'tool':
-            history_entries.append(('tool_result', text[:150]))
+            history_entries.append(('tool_result', trim_turn('tool_result', text)))
+
+    return system_text, history_entries, last_user_msg
+
+
+def build_prompt(messages, tools=None, session=None):
+    """
+    Build a compact prompt for the LLM.
+
+    v5 changes:
+    - History is properly limited (fixes v4 bug where history_text never updated)
+    - User message is ALWAYS included (truncate history, not the end of the prompt)
+    - Tool results are injected before the user message
+
+    With a session, messages are only what is new since the last exchange; the
+    session supplies the earlier history and the compressed system prompt.
+    """
+    build_start = time.perf_counter()
+    system_text, history_entries, last_user_msg = parse_messages(messages)
+    if session is not None:
+        history_entries = session.entries + history_entries
 
     # Clean current user message
     current_user = clean_user_msg(last_user_msg)
@@ -504,27 +1179,26 @@ def build_prompt(messages, tools=None):
     # Pre-execute tools based on intent
     tool_context = None
     is_exec = False
+    tool_time = 0.0
     if current_user:
+        tool_start = time.perf_counter()
         tool_context, is_exec = pre_execute_tools(current_user)
+        tool_time = time.perf_counter() - tool_start
         if tool_context and not is_exec:
             tool_context = tool_context[:MAX_TOOL_RESULT_CHARS]
 
     # Build compressed system prompt
-    sys_compressed = compress_system_prompt(system_text) if system_text else (
-        "You are Claw 🦞, a direct AI assistant. User: DaN. Be concise, do tasks, don't describe capabilities."
-    )
+    sys_saved = 0.0
+    if system_text:
+        sys_compressed, sys_saved = SYSTEM_MEMO.compress(system_text)
+    elif session is not None and session.sys_compressed:
+        sys_compressed = session.sys_compressed
+    else:
+        sys_compressed = "You are Claw 🦞, a direct AI assistant. User: DaN. Be concise, do tasks, don't describe capabilities."
 
-    # Build history — CORRECTLY limit to MAX_HISTORY_CHARS
-    # Take most recent entries that fit
-    history_lines = []
-    history_total = 0
-    for role, text in reversed(history_entries[:-1]):  # exclude last user (added separately)
-        prefix = {'user': 'U', 'assistant': 'A', 'tool_call': 'T', 'tool_result': 'R'}.get(role, role[0].upper())
-        line = f'{prefix}: {text}'
-        if history_total + len(line) + 1 > MAX_HISTORY_CHARS:
-            break
-        history_lines.insert(0, line)
-        history_total += len(line) + 1
+    # Build history — most recent entries that fit MAX_HISTORY_BYTES
+    history_lines = [history_line(role, text)
+                     for role, text in recent_within_budget(history_entries[:-1])]  # last user added separately
 
     # Assemble prompt — user message is ALWAYS present
     parts = [sys_compressed, '']
@@ -558,145 +1232,2166 @@ def build_prompt(messages, tools=None):
         else:
             prompt = prompt[:MAX_PROMPT_CHARS]
 
-    log(f'Prompt built: {len(prompt)} chars, tool_context: {bool(tool_context)}, is_exec: {is_exec}, history_entries: {len(history_lines)}')
+    log(f'Prompt built: {len(prompt)} chars, tool_context: {bool(tool_context)}, is_exec: {is_exec}, history_entries: {len(history_lines)}'
+        + (f', system memo hit (saved {sys_saved * 1000:.2f}ms)' if sys_saved else ''),
+        stage='prompt_build', chars=len(prompt), tool_ms=int(tool_time * 1000),
+        ms=int((time.perf_counter() - build_start) * 1000))
+    M_PROMPT_SECONDS.observe(time.perf_counter() - build_start)
     return prompt, is_exec, (tool_context if is_exec else None)
 
 
+# ─── Response cache ──────────────────────────────────────────────────────────
+
+FAILED_RESPONSE_PREFIXES = ('Taking longer than', 'Router error', 'No response', 'Subagent')
+
+
+def normalize_text(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def canonical_question(text):
+    """A question with case, whitespace and punctuation differences removed."""
+    return ' '.join(re.sub(r'[^\w\s]+', ' ', normalize_text(text)).split())
+
+
+def shingles(text, n=3):
+    """Character n-gram set of a question, for cheap near-duplicate matching."""
+    t = re.sub(r'[^\w ]+', '', normalize_text(text))
+    if len(t) <= n:
+        return {t}
+    return {t[i:i + n] for i in range(len(t) - n + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    """
+    Two-tier LLM response cache.
+
+    Exact tier: key = hash(model + normalized prompt from build_prompt).
+    Near tier: same model + context, where the context is the intent, its exact
+    tool parameter (URL, query) and the prompt before the USER line (system,
+    history, tool output) — an answer is never reused across conversations or
+    for another URL or query. Questions must match up to case, whitespace and
+    punctuation; only plain chat questions of CACHE_NEAR_MIN_WORDS+ words with
+    the same numbers may differ further, down to CACHE_NEAR_THRESHOLD (Jaccard
+    of 3-gram shingles).
+
+    Entries expire per intent (CACHE_TTLS), are evicted LRU beyond max_entries
+    and are written through to SQLite so they survive restarts.
+    """
+
+    def __init__(self, path, max_entries=CACHE_MAX_ENTRIES, near_threshold=CACHE_NEAR_THRESHOLD,
+                 near_min_words=CACHE_NEAR_MIN_WORDS):
+        self.max_entries = max_entries
+        self.near_threshold = near_threshold
+        self.near_min_words = near_min_words
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> dict(model, context, intent, question, response, expires)
+        self._near = {}                 # key -> (canonical question, shingle set or None) for the near tier
+        self.hits_exact = 0
+        self.hits_near = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, '
+                'context TEXT, intent TEXT, question TEXT, response TEXT, created REAL, expires REAL)'
+            )
+            self._db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+            self._db.commit()
+            self._load()
+        except sqlite3.Error as e:
+            log(f'Response cache: SQLite unavailable ({e}), memory only')
+            self._db = None
+
+    def _load(self):
+        rows = self._db.execute(
+            'SELECT key, model, context, intent, question, response, expires FROM responses '
+            'ORDER BY created DESC LIMIT ?', (self.max_entries,)
+        ).fetchall()
+        for key, model, context, intent, question, response, expires in reversed(rows):
+            self._remember(key, dict(model=model, context=context, intent=intent,
+                                     question=question, response=response, expires=expires))
+        log(f'Response cache: loaded {len(rows)} entries from {CACHE_DB}')
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._near[key] = self._near_form(entry['intent'], entry['question'])
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        self._near.pop(key, None)
+        if self._db:
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._db.commit()
+
+    @staticmethod
+    def key(model, prompt):
+        return hashlib.sha256(f'{model}\0{normalize_text(prompt)}'.encode()).hexdigest()
+
+    @staticmethod
+    def context(intent, param, prompt):
+        head = prompt[:prompt.rfind('USER: ')]
+        digest = hashlib.sha256(f'{normalize_text(param or "")}\0{normalize_text(head)}'.encode())
+        return f'{intent}:{digest.hexdigest()[:24]}'
+
+    def _near_form(self, intent, question):
+        """(canonical question, shingles) — shingles only where fuzzy matching is allowed."""
+        canon = canonical_question(question)
+        fuzzy = intent == 'chat' and len(canon.split()) >= self.near_min_words
+        return canon, (shingles(canon) if fuzzy else None)
+
+    def get(self, model, intent, param, prompt, question):
+        """Return (response, tier) or (None, None)."""
+        key = self.key(model, prompt)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry['expires'] > now:
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry['response'], 'exact'
+            if entry:
+                self._forget(key)
+
+            if self.near_threshold > 0:
+                ctx = self.context(intent, param, prompt)
+                canon, q = self._near_form(intent, question)
+                numbers = re.findall(r'\d+', canon)
+                best_key, best_score = None, 0.0
+                for k, (c, sh) in self._near.items():
+                    e = self._entries[k]
+                    if e['model'] != model or e['context'] != ctx or e['expires'] <= now:
+                        continue
+                    if c == canon:
+                        best_key, best_score = k, 1.0
+                        break
+                    # Fuzzy only between long chat questions; a different number is a different question
+                    if q is None or sh is None or re.findall(r'\d+', c) != numbers:
+                        continue
+                    score = jaccard(q, sh)
+                    if score > best_score:
+                        best_key, best_score = k, score
+                if best_key and best_score >= self.near_threshold:
+                    self._entries.move_to_end(best_key)
+                    self.hits_near += 1
+                    log(f'Cache near hit ({best_score:.2f}): "{self._entries[best_key]["question"][:60]}"')
+                    return self._entries[best_key]['response'], 'near'
+
+            self.misses += 1
+            return None, None
+
+    def put(self, model, intent, param, prompt, question, response):
+        ttl = CACHE_TTLS.get(intent, CACHE_TTLS['chat'])
+        if ttl <= 0 or not response or response.startswith(FAILED_RESPONSE_PREFIXES):
+            return
+        key = self.key(model, prompt)
+        now = time.time()
+        entry = dict(model=model, context=self.context(intent, param, prompt), intent=intent,
+                     question=question, response=response, expires=now + ttl)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (key, model, entry['context'], intent, question, response, now, entry['expires'])
+                )
+                self._db.commit()
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._forget(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits_exact + self.hits_near + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits_exact': self.hits_exact,
+                'hits_near': self.hits_near,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits_exact + self.hits_near) / lookups, 3) if lookups else 0.0,
+            }
+
+
+RESPONSE_CACHE = ResponseCache(CACHE_DB) if CACHE_ENABLED else None
+
+
+# ─── Tool result cache ───────────────────────────────────────────────────────
+
+class ToolCache:
+    """
+    TTL cache for pre-executed tool output, keyed by (tool, normalized argument).
+
+    Within the tool's TTL an entry is served as-is. For one more TTL after that
+    it is served stale while a background thread refreshes it (stale-while-
+    revalidate), so follow-up questions never wait on the tool. Total cached
+    text is capped at max_bytes, evicting least recently used entries first.
+    """
+
+    def __init__(self, ttls=TOOL_CACHE_TTLS, max_bytes=TOOL_CACHE_MAX_BYTES):
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (value, fetched_at, size)
+        self._refreshing = set()
+        self.bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(tool, arg):
+        # URLs are case-sensitive; queries are not
+        arg = arg.strip().rstrip('.,;)') if tool == 'web_fetch' else normalize_text(arg)
+        return (tool, arg)
+
+    def fetch(self, tool, arg, fn):
+        key = self.key(tool, arg)
+        ttl = self.ttls.get(tool, 0)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                value, fetched_at, _ = entry
+                age = now - fetched_at
+                if age < ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    log(f'Tool cache hit: {tool} ({int(age)}s old)')
+                    return value
+                if age < 2 * ttl:
+                    self._entries.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, arg, fn), daemon=True).start()
+                    log(f'Tool cache stale hit: {tool} ({int(age)}s old), refreshing in background')
+                    return value
+                self._drop(key)
+            self.misses += 1
+        value = fn(arg)
+        self._store(key, value)
+        return value
+
+    def _refresh(self, key, arg, fn):
+        value = None
+        try:
+            value = fn(arg)
+            self._store(key, value)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+                if value:
+                    self.refreshes += 1
+
+    def _store(self, key, value):
+        if not value:
+            return   # failed runs are retried next time
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (value, time.time(), size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'evictions': self.evictions,
+            }
+
+
+TOOL_CACHE = ToolCache() if TOOL_CACHE_ENABLED else None
+
+
+def cached_tool(tool, arg, fn):
+    """Run fn(arg) through the tool cache (or directly when it is disabled)."""
+    if TOOL_CACHE is None:
+        return fn(arg)
+    return TOOL_CACHE.fetch(tool, arg, fn)
+
+
+# ─── Worker pools ────────────────────────────────────────────────────────────
+
+class PoolBusy(Exception):
+    """
+    Raised when a request can't be admitted: 429 when a queue is full or a
+    client is over its rate limit (shed now, retry later), 503 when the wait
+    for a worker timed out.
+    """
+
+    def __init__(self, pool, reason, retry_after, status=503):
+        super().__init__(f'{pool}: {reason}')
+        self.pool = pool
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status = status
+
+
+class Admission:
+    """A place held in a WorkerPool class queue between admission() and slot()."""
+
+    __slots__ = ('pool', 'priority', 'held')
+
+    def __init__(self, pool, priority):
+        self.pool = pool
+        self.priority = priority
+        self.held = True
+
+    def release(self):
+        with self.pool._cond:
+            self.pool._hand_over(self)
+
+
+class WorkerPool:
+    """
+    Bounded concurrency gate for one model. Up to `size` requests run at once;
+    the rest wait in one FIFO queue per priority class (at most CLASS_QUEUE_MAX
+    each) and a freed worker always goes to the highest class waiting. Batch
+    requests never hold the last INTERACTIVE_RESERVE workers, so a chat message
+    arriving mid-digest waits for at most the interactive requests ahead of it.
+    Tracks queue depth and wait times so they can be reported.
+
+    admission() holds a place in the class queue while a request is still
+    being prepared (tool pre-execution), so a full queue is refused before
+    that work starts rather than after. The place is handed over when the
+    request reaches slot(), so each request counts against the queue once.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = max(1, size)
+        self.queue_max = CLASS_QUEUE_MAX
+        self.batch_limit = max(1, self.size - INTERACTIVE_RESERVE)
+        self._cond = threading.Condition()
+        self._waiters = {p: deque() for p in PRIORITIES}
+        self._admitted = {p: 0 for p in PRIORITIES}   # requests between admission() and the queue
+        self.active = 0
+        self.active_batch = 0
+        self.served = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+
+    def _ahead(self, priority, same_class=True):
+        """Waiting requests that will be served before a new arrival of this class."""
+        higher = PRIORITIES[:PRIORITIES.index(priority) + same_class]
+        return sum(len(self._waiters[p]) for p in higher)
+
+    def _can_start(self, priority):
+        if self.active >= self.size:
+            return False
+        return priority != 'batch' or self.active_batch < self.batch_limit
+
+    def _start(self, priority):
+        self.active += 1
+        if priority == 'batch':
+            self.active_batch += 1
+
+    def _acquire(self, timeout, priority, admission=None):
+        with self._cond:
+            self._hand_over(admission)   # from here on the lane (or a worker) counts it
+            if self._can_start(priority) and not self._ahead(priority):
+                self._start(priority)
+                return 0.0
+            if timeout <= 0:   # caller only wants an idle worker (hedges)
+                raise PoolBusy(self.name, 'no idle worker', self._retry_after(priority))
+            lane = self._waiters[priority]
+            if len(lane) >= self.queue_max.get(priority, QUEUE_MAX):
+                self.rejected += 1
+                raise PoolBusy(self.name, f'{priority} queue full', self._retry_after(priority), status=429)
+            ticket = object()
+            lane.append(ticket)
+            start = time.monotonic()
+            deadline = start + timeout
+            while True:
+                if (lane[0] is ticket and self._can_start(priority)
+                        and not self._ahead(priority, same_class=False)):
+                    lane.popleft()
+                    self._start(priority)
+                    self._cond.notify_all()
+                    return time.monotonic() - start
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    lane.remove(ticket)
+                    self.timed_out += 1
+                    self._cond.notify_all()
+                    raise PoolBusy(self.name, f'no worker free after {timeout}s', self._retry_after(priority))
+                self._cond.wait(remaining)
+
+    def _free(self, priority):
+        """Workers a request of this class could start on right now."""
+        free = self.size - self.active
+        if priority == 'batch':
+            free = min(free, self.batch_limit - self.active_batch)
+        return max(0, free)
+
+    @contextmanager
+    def admission(self, priority=DEFAULT_PRIORITY):
+        """
+        Reserve a place for a request that will need a worker; 429 if the class
+        queue is full. Yields an Admission to pass to slot(), which takes over
+        the place; whatever is left is given back on exit.
+        """
+        with self._cond:
+            limit = self.queue_max.get(priority, QUEUE_MAX) + self._free(priority)
+            if len(self._waiters[priority]) + self._admitted[priority] >= limit:
+                self.rejected += 1
+                raise PoolBusy(self.name, f'{priority} queue full', self._retry_after(priority), status=429)
+            self._admitted[priority] += 1
+        admission = Admission(self, priority)
+        try:
+            yield admission
+        finally:
+            admission.release()
+
+    def _hand_over(self, admission):
+        """Drop an admission's reserved place. Caller holds self._cond."""
+        if admission is not None and admission.held:
+            admission.held = False
+            self._admitted[admission.priority] -= 1
+
+    def _release(self, priority, wait, run):
+        with self._cond:
+            self.active -= 1
+            if priority == 'batch':
+                self.active_batch -= 1
+            self.served += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.total_run += run
+            self._cond.notify_all()
+
+    def _retry_after(self, priority):
+        """Rough seconds until a slot frees up for this class, from the average run time."""
+        avg_run = self.total_run / self.served if self.served else 30.0
+        return max(1, int(avg_run * (self._ahead(priority) + 1) / self.size))
+
+    @contextmanager
+    def slot(self, timeout=QUEUE_TIMEOUT, priority=DEFAULT_PRIORITY, admission=None):
+        wait = self._acquire(timeout, priority, admission)
+        M_QUEUE_SECONDS.observe(wait, pool=BACKENDS.label(self.name), priority=priority)
+        if wait > 1:
+            log(f'Pool {self.name}: {priority} request waited {wait:.1f}s for a worker', stage='queue_wait',
+                pool=self.name, priority=priority, ms=int(wait * 1000))
+        start = time.monotonic()
+        try:
+            yield wait
+        finally:
+            self._release(priority, wait, time.monotonic() - start)
+
+    def idle(self):
+        with self._cond:
+            return not self.active and not any(self._waiters.values()) and not any(self._admitted.values())
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.size,
+                'active': self.active,
+                'active_batch': self.active_batch,
+                'queue_depth': sum(len(lane) for lane in self._waiters.values()),
+                'queues': {p: len(lane) for p, lane in self._waiters.items()},
+                'admitting': dict(self._admitted),
+                'queue_max': self.queue_max,
+                'served': self.served,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_wait_s': round(self.total_wait / self.served, 3) if self.served else 0.0,
+                'max_wait_s': round(self.max_wait, 3),
+            }
+
+
+_MODEL_WORKER_SIZES = parse_kv_spec(MODEL_WORKERS, 'ROUTER_MODEL_WORKERS')
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(name):
+    """Return the worker pool for a model, creating it on first use."""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(name)
+        if pool is None:
+            size = _MODEL_WORKER_SIZES.get(name) or BACKENDS.get(name).workers or WORKERS_PER_MODEL
+            pool = _POOLS[name] = WorkerPool(name, size)
+            # Pools of ad-hoc backends the registry has dropped go once idle
+            for stale in [n for n, p in _POOLS.items() if not BACKENDS.known(n) and p.idle()]:
+                del _POOLS[stale]
+        return pool
+
+
+def pool_stats():
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return {p.name: p.stats() for p in pools}
+
+
+# ─── Backends ────────────────────────────────────────────────────────────────
+# Every routable model is a Backend: an opencode CLI model or a model behind an
+# OpenAI-compatible HTTP endpoint. Each tracks an EWMA of its latency and error
+# rate; a circuit breaker ejects it after repeated failures and lets a single
+# trial request through after BREAKER_COOLDOWN. The model "auto" (or any model
+# whose circuit is open) is routed to the fastest healthy backend.
+
+class Backend:
+    def __init__(self, name, kind='cli', upstream=None, url=None, api_key_env=None,
+                 timeout=TIMEOUT, workers=None, auto=True, adhoc=False):
+        self.name = name
+        self.kind = kind
+        self.upstream = upstream or name
+        self.url = url
+        self.api_key_env = api_key_env
+        self.timeout = timeout
+        self.workers = workers
+        self.auto = auto
+        self.adhoc = adhoc    # made up for a model id missing from the config
+        self.latency = None   # EWMA seconds, None until the first call
+        self.error_rate = 0.0
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_at = None   # when the current half-open trial request was let through
+        self.first_response = deque(maxlen=200)   # recent seconds-to-first-output, for hedging
+        self._lock = threading.Lock()
+
+    def _trial_due(self, now):
+        # A trial that never reported back (cache hit, client gone) expires after `timeout`
+        return (now - self.opened_at >= BREAKER_COOLDOWN
+                and (self.trial_at is None or now - self.trial_at > self.timeout))
+
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half_open' if self._trial_due(time.monotonic()) else 'open'
+
+    def admit(self):
+        """True if a request may use this backend now; claims the trial slot when half-open."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if not self._trial_due(now):
+                return False
+            self.trial_at = now
+            return True
+
+    def record(self, latency, ok):
+        """Feed one call's outcome; latency None (a fast failure) leaves the latency average alone."""
+        with self._lock:
+            self.calls += 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else (
+                    EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency)
+            self.error_rate = EWMA_ALPHA * (0.0 if ok else 1.0) + (1 - EWMA_ALPHA) * self.error_rate
+            if ok:
+                self.consecutive_failures = 0
+                if self.opened_at is not None:
+                    log(f'Backend {self.name}: circuit closed')
+                self.opened_at = None
+                self.trial_at = None
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.trial_at is not None or self.consecutive_failures >= BREAKER_FAILURES:
+                log(f'Backend {self.name}: circuit open after {self.consecutive_failures} failures',
+                    'warning', backend=self.name)
+                self.opened_at = time.monotonic()
+                self.trial_at = None
+
+    def observe_first(self, seconds):
+        with self._lock:
+            self.first_response.append(seconds)
+
+    def percentile(self, pct):
+        """pct-th percentile of recent time-to-first-output, None until HEDGE_MIN_SAMPLES calls."""
+        with self._lock:
+            samples = sorted(self.first_response)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def stats(self):
+        state = self.state()
+        p = self.percentile(HEDGE_PERCENTILE)
+        with self._lock:
+            return {
+                'type': self.kind,
+                'upstream': self.upstream,
+                'adhoc': self.adhoc,
+                'state': state,
+                'latency_s': round(self.latency, 3) if self.latency is not None else None,
+                f'first_output_p{HEDGE_PERCENTILE:g}_s': round(p, 3) if p is not None else None,
+                'error_rate': round(self.error_rate, 3),
+                'calls': self.calls,
+                'failures': self.failures,
+            }
+
+
+class BackendRegistry:
+    """
+    Backends loaded from a JSON config shaped like {"backends": {provider: {"type",
+    "models", ...}}, "aliases": {...}}; "models" is a list of ids or an
+    {exposed id: upstream id} map. Unknown model ids become CLI backends on first use;
+    those are served when asked for by name but never picked for "auto" or as a
+    hedge backup, and only the ADHOC_BACKENDS_MAX most recently used are kept,
+    so client input can't grow the registry (or /metrics) without bound.
+    """
+
+    def __init__(self, config):
+        self.aliases = config.get('aliases', {})
+        self._backends = OrderedDict()
+        self._adhoc = OrderedDict()   # name -> Backend, least recently used first
+        self.adhoc_dropped = 0
+        self._lock = threading.Lock()
+        for provider, cfg in config.get('backends', {}).items():
+            models = cfg.get('models', [])
+            if isinstance(models, list):
+                models = {m: m for m in models}
+            for name, upstream in models.items():
+                if name == 'auto' or name in self._backends:
+                    continue
+                self._backends[name] = Backend(
+                    name, kind=cfg.get('type', 'cli'), upstream=upstream, url=cfg.get('url'),
+                    api_key_env=cfg.get('api_key_env'), timeout=cfg.get('timeout', TIMEOUT),
+                    workers=cfg.get('workers'), auto=cfg.get('auto', True))
+
+    @classmethod
+    def load(cls, path):
+        if not path:
+            return cls(DEFAULT_BACKENDS)
+        try:
+            with open(os.path.expanduser(path)) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            log(f'Could not load ROUTER_BACKENDS {path}: {e} — using defaults', 'error')
+            return cls(DEFAULT_BACKENDS)
+        config.setdefault('aliases', DEFAULT_BACKENDS['aliases'])
+        return cls(config)
+
+    def get(self, name):
+        with self._lock:
+            backend = self._backends.get(name)
+            if backend is None:
+                backend = self._backends[name] = self._adhoc[name] = Backend(name, auto=False, adhoc=True)
+                while len(self._adhoc) > ADHOC_BACKENDS_MAX:
+                    old, _ = self._adhoc.popitem(last=False)
+                    del self._backends[old]
+                    self.adhoc_dropped += 1
+            elif backend.adhoc:
+                self._adhoc.move_to_end(name)
+            return backend
+
+    def known(self, name):
+        with self._lock:
+            return name in self._backends
+
+    def label(self, name):
+        """Metric label for a model: its name if configured, 'other' for ad-hoc ids."""
+        with self._lock:
+            backend = self._backends.get(name)
+        return name if backend is not None and not backend.adhoc else 'other'
+
+    def all(self):
+        with self._lock:
+            return list(self._backends.values())
+
+    def fastest(self, kind=None, exclude=None):
+        """
+        Healthy backend with the lowest latency EWMA. Untried backends go first so
+        they get measured; ones failing more often than not go last.
+        """
+        candidates = [b for b in self.all()
+                      if b.auto and b is not exclude and (kind is None or b.kind == kind)
+                      and b.state() != 'open']
+        candidates.sort(key=lambda b: (b.error_rate >= 0.5, -1 if not b.calls else (
+            b.latency if b.latency is not None else float('inf'))))
+        for backend in candidates:
+            if backend.admit():
+                return backend
+        return None
+
+    def resolve(self, requested, kind=None):
+        """Pick the backend for a requested model id (alias-mapped, breaker-aware)."""
+        name = requested or MODEL
+        for alias, target in self.aliases.items():
+            if alias in name.lower():
+                name = target
+                break
+        if name == 'auto':
+            return self.fastest(kind) or self.get(DEFAULT_MODEL)
+        backend = self.get(name)
+        if kind and backend.kind != kind:
+            return self.fastest(kind) or self.get(DEFAULT_MODEL)
+        if not backend.admit():
+            alt = self.fastest(kind, exclude=backend)
+            if alt:
+                log(f'Backend {name} circuit open, routing to {alt.name}')
+                return alt
+        return backend
+
+    def stats(self):
+        return {b.name: b.stats() for b in self.all()}
+
+
+def stream_openai(backend, prompt, timeout, on_spawn=None):
+    """
+    Yield response text from an OpenAI-compatible /chat/completions endpoint as it streams.
+    on_spawn(resp) gets the open response, so another thread can close() it.
+    """
+    headers = {'Content-Type': 'application/json'}
+    api_key = os.environ.get(backend.api_key_env, '') if backend.api_key_env else ''
+    if api_key:
+        headers['Authorization'] = f'Bearer {api_key}'
+    req = urllib.request.Request(
+        backend.url.rstrip('/') + '/chat/completions', method='POST', headers=headers,
+        data=json.dumps({'model': backend.upstream, 'stream': True,
+                         'messages': [{'role': 'user', 'content': prompt}]}).encode())
+    start = time.monotonic()
+    total = 0
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            if on_spawn:
+                on_spawn(resp)
+            for raw in resp:
+                if time.monotonic() - start > timeout:
+                    raise TimeoutError
+                line = raw.decode('utf-8', 'replace').strip()
+                if not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    delta = json.loads(data)['choices'][0].get('delta', {}).get('content')
+                except (ValueError, KeyError, IndexError, TypeError):
+                    continue
+                if not delta:
+                    continue
+                if not total:
+                    M_FIRST_BYTE_SECONDS.observe(time.monotonic() - start, model=backend.name, mode='http')
+                total += len(delta)
+                yield delta
+    except TimeoutError:
+        log(f'TIMEOUT after {timeout}s ({backend.name})', 'warning')
+        M_TIMEOUTS.inc(stage='llm')
+        yield f'Taking longer than {timeout}s — free model is still working. Try again in a moment.'
+        return
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        log(f'Backend {backend.name} error: {e}', 'error')
+        yield f'Router error: {e}'
+        return
+    elapsed = time.monotonic() - start
+    M_LLM_SECONDS.observe(elapsed, model=backend.name, mode='http')
+    if not total:
+        yield 'No response'
+    else:
+        log(f'LLM response ({total} chars from {backend.name}, done in {elapsed:.1f}s)',
+            stage='llm', model=backend.name, chars=total, ms=int(elapsed * 1000))
+
+
+DEFAULT_MODEL = MODEL if MODEL != 'auto' else 'opencode/minimax-m2.5-free'
+BACKENDS = BackendRegistry.load(BACKENDS_FILE)
+
+
+# ─── In-flight request coalescing ────────────────────────────────────────────
+
+def flight_key(model, prompt):
+    return hashlib.sha256(f'{model}\0{prompt}'.encode()).hexdigest()
+
+
+def llm_pieces(model, prompt, stream, on_spawn=None, cancelled=None):
+    """
+    Response text for one LLM call — line by line when streaming, else in one piece.
+    The outcome feeds the backend's latency/error averages and circuit breaker,
+    unless the call was `cancelled` (a hedge that lost the race).
+    """
+    backend = BACKENDS.get(model)
+    start = time.monotonic()
+    if backend.kind == 'openai':
+        source = stream_openai(backend, prompt, backend.timeout, on_spawn=on_spawn)
+    elif stream:
+        source = stream_opencode(model, prompt, timeout=backend.timeout, on_spawn=on_spawn)
+    else:
+        source = iter([call_opencode(model, prompt, timeout=backend.timeout, on_spawn=on_spawn)])
+    text = ''
+    for piece in source:
+        if not text:
+            first_at = time.monotonic() - start
+        text += piece
+        yield piece
+    if cancelled is not None and cancelled.is_set():
+        return
+    text = text.strip()
+    ok = bool(text) and not text.startswith(FAILED_RESPONSE_PREFIXES)
+    # Timeouts count towards latency; instant errors would make a broken backend look fast
+    slow = ok or text.startswith('Taking longer than')
+    backend.record(time.monotonic() - start if slow else None, ok)
+    if ok:
+        backend.observe_first(first_at)
+
+
+class Flight:
+    """
+    One running LLM invocation whose output any number of requests can follow.
+    Pieces are kept so late subscribers replay from the start; the producer runs
+    on its own thread, so one client disconnecting doesn't cut off the others.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.pieces = []
+        self.started = False
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.abandoned = False
+
+    def mark_started(self):
+        with self._cond:
+            self.started = True
+            self._cond.notify_all()
+
+    def publish(self, piece):
+        with self._cond:
+            self.pieces.append(piece)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def wait_started(self, timeout):
+        """Block until the producer got a worker; raises PoolBusy if it never will."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.started or self.done, timeout)
+            if isinstance(self.error, PoolBusy):
+                raise self.error
+            if not (self.started or self.done):
+                raise PoolBusy('flight', f'no worker free after {timeout}s', QUEUE_TIMEOUT)
+
+    def subscribe(self, deadline=None, cancelled=None):
+        """
+        Yield the flight's pieces from the start; raises TimeoutError past
+        `deadline` (monotonic) and stops early once `cancelled` (an Event) is set.
+        """
+        with self._cond:
+            self.subscribers += 1
+        i = 0
+        ready = lambda: i < len(self.pieces) or self.done
+        try:
+            while True:
+                with self._cond:
+                    while not ready():
+                        if cancelled is not None and cancelled.is_set():
+                            return
+                        timeout = None if deadline is None else deadline - time.monotonic()
+                        if timeout is not None and timeout <= 0:
+                            raise TimeoutError('deadline exceeded')
+                        if cancelled is not None:   # nothing notifies us of a cancel, so look again soon
+                            timeout = 0.5 if timeout is None else min(timeout, 0.5)
+                        self._cond.wait(timeout)
+                    if i >= len(self.pieces):
+                        return
+                    piece = self.pieces[i]
+                i += 1
+                yield piece
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+                if self.subscribers == 0 and not self.done:
+                    self.abandoned = True   # nobody is listening any more
+
+
+class Singleflight:
+    """Deduplicates identical concurrent LLM calls (keyed by model + final prompt)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key, pool, producer, on_done=None, priority=DEFAULT_PRIORITY, admission=None):
+        """
+        Return (flight, is_leader). The leader's producer runs on a new thread,
+        which hands `admission` (see WorkerPool.admission) to the pool slot.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight:
+                self.coalesced += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+        threading.Thread(target=self._run, daemon=True,
+                         args=(key, flight, pool, producer, on_done, priority, admission,
+                               current_request_id())).start()
+        return flight, True
+
+    def _run(self, key, flight, pool, producer, on_done, priority, admission, rid):
+        set_request_id(rid)
+        error = None
+        try:
+            with pool.slot(priority=priority, admission=admission):
+                flight.mark_started()
+                pieces = producer()
+                try:
+                    for piece in pieces:
+                        flight.publish(piece)
+                        if flight.abandoned:
+                            log('All clients left, stopping opencode early')
+                            break
+                finally:
+                    pieces.close()
+        except PoolBusy as e:
+            error = e
+        except Exception as e:
+            log(f'Error: {e}', 'error')
+            flight.publish(f'Router error: {e}')
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.finish(error)
+        if on_done and not error and not flight.abandoned:
+            on_done(''.join(flight.pieces).strip())
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._flights), 'leaders': self.leaders, 'coalesced': self.coalesced}
+
+
+FLIGHTS = Singleflight()
+
+
+# ─── Hedged requests ─────────────────────────────────────────────────────────
+# Free models have long latency tails. If a conversational call has produced
+# nothing by its backend's HEDGE_PERCENTILE time-to-first-output, a backup call
+# starts on the fastest other healthy backend; the first good output wins and
+# the other call's process is killed. A token bucket caps how often this happens.
+
+class TokenBucket:
+    """Allows `rate` events per `per` seconds on average, in bursts of up to `burst`."""
+
+    def __init__(self, rate, per=60.0, burst=None):
+        self.rate = rate / per
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, n=1):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            return True
+
+    def retry_after(self, n=1):
+        """Whole seconds until `n` tokens are available."""
+        with self._lock:
+            return max(1, int((n - self.tokens) / self.rate + 0.999))
+
+
+HEDGE_BUCKET = TokenBucket(HEDGE_RATE)
+M_HEDGES = Counter('router_hedges_total', 'Hedged requests by outcome', ('result',))
+
+
+def abort_call(handle):
+    """Stop an in-progress LLM call given the handle on_spawn received (process, WarmCall or response)."""
+    try:
+        if isinstance(handle, subprocess.Popen):
+            CHILDREN.kill(handle, 'cancelled')
+        elif isinstance(handle, WarmCall):
+            handle.abort()
+        else:
+            handle.close()
+    except Exception:
+        pass
+
+
+class HedgeRunner:
+    """Runs one llm_pieces() call on its own thread, posting (runner, piece) and a final (runner, None)."""
+
+    def __init__(self, model, prompt, stream, events, pool=None, priority=DEFAULT_PRIORITY):
+        self.model = model
+        self.handles = []
+        self.cancelled = threading.Event()
+        self._args = (prompt, stream, events, pool, priority, current_request_id())
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        prompt, stream, events, pool, priority, rid = self._args
+        set_request_id(rid)
+        try:
+            with pool.slot(timeout=0, priority=priority) if pool else nullcontext():
+                pieces = llm_pieces(self.model, prompt, stream,
+                                    on_spawn=self.handles.append, cancelled=self.cancelled)
+                try:
+                    for piece in pieces:
+                        if self.cancelled.is_set():
+                            break
+                        events.put((self, piece))
+                finally:
+                    pieces.close()
+        except PoolBusy as e:
+            log(f'Hedge on {self.model} skipped: {e.reason}')
+        except Exception as e:
+            log(f'Error: {e}', 'error')
+            events.put((self, f'Router error: {e}'))
+        finally:
+            events.put((self, None))
+
+    def cancel(self):
+        self.cancelled.set()
+        for handle in list(self.handles):
+            abort_call(handle)
+
+
+def hedged_pieces(model, prompt, stream, priority=DEFAULT_PRIORITY):
+    """llm_pieces() for conversational calls, with a backup call if the first one is slow."""
+    primary = BACKENDS.get(model)
+    delay = primary.percentile(HEDGE_PERCENTILE) if HEDGE_ENABLED else None
+    if delay is None:
+        yield from llm_pieces(model, prompt, stream)
+        return
+    delay = max(delay, HEDGE_MIN_DELAY)
+
+    events = queue.SimpleQueue()
+    start = time.monotonic()
+    runners = [HedgeRunner(model, prompt, stream, events)]   # the caller already holds its pool slot
+    finished = set()
+    failure = None
+    winner = None
+    hedge_checked = False
+    try:
+        # Phase 1: wait for the first good piece from any runner
+        while winner is None and len(finished) < len(runners):
+            wait = None if hedge_checked else max(0.0, delay - (time.monotonic() - start))
+            try:
+                runner, piece = events.get(timeout=wait)
+            except queue.Empty:
+                hedge_checked = True
+                backup = BACKENDS.fastest(exclude=primary)
+                if not backup:
+                    continue
+                if not HEDGE_BUCKET.take():
+                    M_HEDGES.inc(result='rate_limited')
+                    continue
+                log(f'No output from {model} after {delay:.1f}s, hedging to {backup.name}')
+                M_HEDGES.inc(result='fired')
+                runners.append(HedgeRunner(backup.name, prompt, stream, events, get_pool(backup.name), priority))
+                continue
+            if piece is None:
+                finished.add(runner)
+            elif piece.startswith(FAILED_RESPONSE_PREFIXES) and len(runners) - len(finished) > 1:
+                failure = failure or piece   # let the other call finish before giving up
+            else:
+                winner = runner
+                first = piece
+
+        if winner is None:
+            yield failure or 'No response'
+            return
+        for runner in runners:
+            if runner is not winner:
+                runner.cancel()
+        if len(runners) > 1:
+            won = 'backup_won' if winner is not runners[0] else 'primary_won'
+            M_HEDGES.inc(result=won)
+            log(f'Hedge race: {winner.model} answered first ({won})')
+
+        # Phase 2: relay the winner
+        yield first
+        while True:
+            runner, piece = events.get()
+            if runner is not winner:
+                continue
+            if piece is None:
+                return
+            yield piece
+    finally:
+        for runner in runners:   # no-op for a winner that already finished
+            runner.cancel()
+
+
+# ─── Admission control ───────────────────────────────────────────────────────
+# Callers pick a priority class with an X-Router-Priority header or a model
+# suffix ("opencode/glm-5-free@batch") and name themselves with X-Router-Client
+# (the peer address otherwise). Each client gets a token bucket; over the limit,
+# or when its class queue is full, the request is shed with 429 + Retry-After
+# before any tool or model work is done.
+
+def request_priority(headers, model):
+    """Return (priority, model with any @priority suffix removed)."""
+    model, _, suffix = (model or '').partition('@')
+    priority = (headers.get('X-Router-Priority') or suffix or DEFAULT_PRIORITY).strip().lower()
+    if priority not in PRIORITIES:
+        log(f'Unknown priority {priority!r}, using {DEFAULT_PRIORITY}', 'warning')
+        priority = DEFAULT_PRIORITY
+    return priority, model or MODEL
+
+
+class ClientLimiter:
+    """Per-client request rate limits (requests per minute, bursts of the same size)."""
+
+    MAX_CLIENTS = 1024   # oldest buckets are forgotten beyond this (they'd be full again anyway)
+
+    def __init__(self, default_rate, rates):
+        self.default_rate = default_rate
+        self.rates = rates
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.limited = {}
+
+    def admit(self, client, n=1):
+        """Raise PoolBusy (429) if the client is over its rate (a batch takes one token per request)."""
+        rate = self.rates.get(client, self.default_rate)
+        if rate <= 0 or n <= 0:
+            return
+        with self._lock:
+            bucket = self._buckets.pop(client, None) or TokenBucket(rate)
+            self._buckets[client] = bucket
+            while len(self._buckets) > self.MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+        n = min(n, bucket.burst)   # a batch bigger than the burst would otherwise never fit
+        if not bucket.take(n):
+            with self._lock:
+                self.limited[client] = self.limited.get(client, 0) + 1
+            raise PoolBusy(f'client {client}', f'rate limit {rate:g}/min', bucket.retry_after(n), status=429)
+
+    def stats(self):
+        with self._lock:
+            return {'default_rate_per_min': self.default_rate, 'rates': self.rates,
+                    'clients': len(self._buckets), 'limited': dict(self.limited)}
+
+
+CLIENTS = ClientLimiter(CLIENT_RATE, parse_kv_spec(CLIENT_RATES, 'ROUTER_CLIENT_RATES'))
+
+
+# ─── Exec jobs ───────────────────────────────────────────────────────────────
+
+class Job:
+    """
+    One exec subagent task running in the background. Status changes and the
+    child process handle go through _lock, so a cancel() racing run() or
+    attach() always ends with the job cancelled and its process killed.
+    """
+
+    def __init__(self, task, model):
+        self.id = 'job_' + uuid.uuid4().hex[:12]
+        self.task = task
+        self.model = model
+        self.status = 'queued'   # queued → running → done | failed | cancelled
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.output = []         # lines seen so far
+        self.result = None
+        self.error = None
+        self.future = None
+        self._proc = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def attach(self, proc):
+        """Register the job's child; one started after a cancel() is killed at once."""
+        with self._lock:
+            self._proc = proc
+            cancelled = self.status == 'cancelled'
+        if cancelled:
+            CHILDREN.kill(proc, 'cancelled')
+
+    def cancel(self):
+        with self._lock:
+            if self.status in ('done', 'failed', 'cancelled'):
+                return False
+            self.status = 'cancelled'
+            proc = self._proc
+        if self.future and self.future.cancel():
+            self._finish()
+        elif proc and proc.poll() is None:
+            CHILDREN.kill(proc, 'cancelled')
+        return True
+
+    def run(self):
+        with self._lock:
+            if self.status == 'cancelled':   # cancelled after the executor picked it up
+                self._finish()
+                return
+            self.status = 'running'
+            self.started = time.time()
+        set_request_id(self.id)
+        try:
+            result = do_exec_task(self.task, self.model, job=self)
+            with self._lock:
+                if self.status == 'cancelled':
+                    self.result = (''.join(self.output).strip() + '\n[cancelled]').lstrip()
+                else:
+                    self.result = result
+                    self.status = 'done'
+        except Exception as e:
+            log(f'Job {self.id} failed: {e}', 'error')
+            with self._lock:
+                self.error = f'Subagent error: {e}'
+                if self.status != 'cancelled':
+                    self.status = 'failed'
+        finally:
+            self._finish()
+
+    def _finish(self):
+        self.finished = time.time()
+        self._done.set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'object': 'job', 'status': self.status, 'task': self.task,
+            'model': self.model, 'created': int(self.created),
+            'started': int(self.started) if self.started else None,
+            'finished': int(self.finished) if self.finished else None,
+            'output': ''.join(self.output).strip(),
+            'result': self.result, 'error': self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs exec tasks on their own bounded executor, separate from the per-model
+    pools that serve conversational traffic. At most EXEC_WORKERS run at once
+    and JOB_QUEUE_MAX wait; finished jobs stay pollable for JOB_RETENTION.
+    """
+
+    def __init__(self, workers=EXEC_WORKERS, queue_max=JOB_QUEUE_MAX):
+        self.queue_max = queue_max
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='exec-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, task, model=None):
+        job = Job(task, model or BACKENDS.resolve(None, kind='cli').name)
+        with self._lock:
+            self._prune()
+            queued = sum(1 for j in self._jobs.values() if j.status == 'queued')
+            if queued >= self.queue_max:
+                raise PoolBusy('jobs', 'job queue full', EXEC_TIMEOUT // 4, status=429)
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(job.run)
+        log(f'Job {job.id} queued: "{task[:80]}"')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+
+JOBS = JobManager()
+
+
+# ─── Warm opencode workers ───────────────────────────────────────────────────
+
+class WarmUnavailable(Exception):
+    """No warm worker could serve the request — caller falls back to `opencode run`."""
+
+
+def _http_json(method, url, body=None, timeout=10):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as r:
+        raw = r.read()
+    return json.loads(raw) if raw else None
+
+
+def render_parts(parts):
+    """Turn opencode message parts into plain text (text parts + tool output)."""
+    out = []
+    for part in parts or []:
+        kind = part.get('type')
+        if kind == 'text' and part.get('text'):
+            out.append(part['text'].strip())
+        elif kind == 'tool':
+            state = part.get('state') or {}
+            cmd = (state.get('input') or {}).get('command', '')
+            out.append(f"$ {cmd}" if cmd else f"[{part.get('tool', 'tool')}]")
+            if state.get('output'):
+                out.append(str(state['output']).strip())
+    return '\n'.join(p for p in out if p).strip()
+
+
+class WarmCall:
+    """A prompt running on a warm worker; abort() stops it without restarting the worker."""
+
+    def __init__(self, srv, sid):
+        self.srv = srv
+        self.sid = sid
+        self.aborted = False
+
+    def abort(self):
+        self.aborted = True
+        _http_json('POST', f'{self.srv.url}/session/{self.sid}/abort', {}, timeout=5)
+
+
+class OpencodeServer:
+    """One long-lived `opencode serve` process on a loopback port."""
+
+    def __init__(self, port):
+        self.port = port
+        self.url = f'http://127.0.0.1:{port}'
+        self.proc = None
+        self.requests = 0
+        self.started = 0.0
+
+    def start(self):
+        self.proc = CHILDREN.spawn(
+            'opencode_serve', [OPENCODE, 'serve', '--port', str(self.port), '--hostname', '127.0.0.1'],
+            cpu_seconds=0,   # long-lived: CPU time adds up across requests, recycling bounds it instead
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env=opencode_env(), cwd=WORKDIR
+        )
+        self.requests = 0
+        self.started = time.monotonic()
+        deadline = self.started + WARM_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.healthy():
+                log(f'Warm worker :{self.port} up in {time.monotonic() - self.started:.1f}s')
+                return True
+            if self.proc.poll() is not None:
+                break
+            time.sleep(0.5)
+        log(f'Warm worker :{self.port} failed to start', 'error')
+        self.stop()
+        return False
+
+    def healthy(self):
+        if not self.proc or self.proc.poll() is not None:
+            return False
+        try:
+            _http_json('GET', f'{self.url}/config', timeout=3)
+            return True
+        except urllib.error.HTTPError as e:
+            return e.code < 500   # server is answering — good enough
+        except Exception:
+            return False
+
+    def prompt(self, model, text, timeout, agent=None, on_spawn=None):
+        provider, _, model_id = model.partition('/')
+        session = _http_json('POST', f'{self.url}/session', {}, timeout=10)
+        sid = session['id']
+        body = {'parts': [{'type': 'text', 'text': text}],
+                'model': {'providerID': provider, 'modelID': model_id}}
+        if agent:
+            body['agent'] = agent
+        call = WarmCall(self, sid)
+        if on_spawn:
+            on_spawn(call)
+        try:
+            reply = None if call.aborted else _http_json('POST', f'{self.url}/session/{sid}/message', body,
+                                                         timeout=timeout)
+        finally:
+            try:
+                _http_json('DELETE', f'{self.url}/session/{sid}', timeout=5)
+            except Exception:
+                pass
+        self.requests += 1
+        return render_parts((reply or {}).get('parts'))
+
+    def stop(self):
+        if self.proc:
+            CHILDREN.stop(self.proc)
+        self.proc = None
+
+
+class WarmPool:
+    """
+    Pre-spawned `opencode serve` workers. Each request checks out one worker,
+    so startup, auth and model handshake are paid once per worker instead of
+    once per message. Workers are recycled after WARM_MAX_REQUESTS and
+    health-checked while idle.
+    """
+
+    def __init__(self, size, base_port=WARM_BASE_PORT, max_requests=WARM_MAX_REQUESTS):
+        self.max_requests = max_requests
+        self._servers = [OpencodeServer(base_port + i) for i in range(size)]
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self.recycled = 0
+        self.failures = 0
+
+    def start(self):
+        threads = [threading.Thread(target=self._boot, args=(srv,), daemon=True)
+                   for srv in self._servers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(WARM_START_TIMEOUT + 5)   # stragglers keep retrying in the background
+        threading.Thread(target=self._health_loop, daemon=True).start()
+        atexit.register(self.stop)
+
+    def _boot(self, srv):
+        while not srv.start():
+            self.failures += 1
+            time.sleep(WARM_HEALTH_INTERVAL)
+        with self._cond:
+            self._idle.append(srv)
+            self._cond.notify()
+
+    def _recycle(self, srv):
+        """Restart a worker in the background; it rejoins the idle set once healthy."""
+        self.recycled += 1
+        srv.stop()
+        threading.Thread(target=self._boot, args=(srv,), daemon=True).start()
+
+    def _health_loop(self):
+        while True:
+            time.sleep(WARM_HEALTH_INTERVAL)
+            with self._cond:
+                idle = list(self._idle)
+            for srv in idle:
+                if srv.healthy():
+                    continue
+                with self._cond:
+                    if srv not in self._idle:
+                        continue   # checked out meanwhile
+                    self._idle.remove(srv)
+                log(f'Warm worker :{srv.port} unhealthy, restarting', 'warning')
+                self._recycle(srv)
+
+    def checkout(self, wait=5):
+        """Take an idle worker, waiting up to `wait` seconds for one to free up."""
+        with self._cond:
+            if not self._idle and wait:
+                self._cond.wait(timeout=wait)
+            if not self._idle:
+                raise WarmUnavailable('all warm workers busy')
+            return self._idle.popleft()
+
+    def checkin(self, srv, healthy=True):
+        """Return a worker after use, recycling it if it failed or is worn out."""
+        if not healthy:
+            self._recycle(srv)
+        elif srv.requests >= self.max_requests:
+            log(f'Warm worker :{srv.port} served {srv.requests} requests, recycling')
+            self._recycle(srv)
+        else:
+            with self._cond:
+                self._idle.append(srv)
+                self._cond.notify()
+
+    def prompt(self, model, text, timeout, agent=None, on_spawn=None):
+        srv = self.checkout()
+        try:
+            result = srv.prompt(model, text, timeout, agent=agent, on_spawn=on_spawn)
+        except TimeoutError:
+            # The model is slow, not the worker — don't retry on a cold spawn
+            self.checkin(srv, healthy=False)
+            raise
+        except Exception as e:
+            self.failures += 1
+            self.checkin(srv, healthy=False)
+            raise WarmUnavailable(f'worker :{srv.port} failed: {e}')
+        self.checkin(srv)
+        return result
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': len(self._servers),
+                'idle': len(self._idle),
+                'recycled': self.recycled,
+                'failures': self.failures,
+                'requests': {srv.port: srv.requests for srv in self._servers},
+            }
+
+    def stop(self):
+        for srv in self._servers:
+            srv.stop()
+
+
+_WARM_POOL = None
+
+
+# ─── Sessions ────────────────────────────────────────────────────────────────
+# Optional per-conversation state, so a client can send only what is new
+# instead of the system prompt and the whole history every turn. A request
+# carries "session": {"id": ..., "seq": n}; seq is the value the previous
+# response returned, or 0 to (re)start from a full history. An unknown,
+# expired or out-of-step session is a 409 — the client resends everything with
+# seq 0. Requests without "session" are stateless, exactly as before.
+
+class SessionResync(Exception):
+    def __init__(self, session_id):
+        super().__init__(f'session {session_id} unknown or out of sync')
+        self.session_id = session_id
+
+
+class Session:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.seq = 0                # messages exchanged (sent + replies) so far
+        self.sys_compressed = None
+        self.entries = []           # cleaned history, within MAX_HISTORY_BYTES; replaced, never mutated
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """LRU of sessions with idle TTL. open() before the call, commit() after the reply."""
+
+    def __init__(self, ttl, max_sessions):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()   # least recently used first
+        self.started = 0
+        self.resumed = 0
+        self.resyncs = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _sweep(self, now):
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used < self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def open(self, session_id, seq):
+        """The session to build on; None when sessions are off. Raises SessionResync."""
+        if not self.max_sessions:
+            if seq:
+                raise SessionResync(session_id)
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            if not seq:
+                session = Session(session_id)
+                self._sessions[session_id] = session
+                self._sessions.move_to_end(session_id)
+                self.started += 1
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted += 1
+                return session
+            session = self._sessions.get(session_id)
+            if session is None or session.seq != seq:
+                self.resyncs += 1
+                raise SessionResync(session_id)
+            session.last_used = now
+            self._sessions.move_to_end(session_id)
+            self.resumed += 1
+            return session
+
+    def commit(self, session, seq, system_text, entries, count):
+        """
+        Add a finished exchange (the new entries + reply) and return the seq the
+        client sends next. 0 if another request moved the session on meanwhile —
+        the client then starts over.
+        """
+        sys_compressed = SYSTEM_MEMO.compress(system_text)[0] if system_text else None
+        with self._lock:
+            if session.seq != seq or self._sessions.get(session.id) is not session:
+                self._sessions.pop(session.id, None)
+                return 0
+            if sys_compressed:
+                session.sys_compressed = sys_compressed
+            session.entries = recent_within_budget(session.entries + entries)
+            session.seq = seq + count
+            session.last_used = time.monotonic()
+            return session.seq
+
+    def stats(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+            return {'active': len(self._sessions), 'started': self.started, 'resumed': self.resumed,
+                    'resyncs': self.resyncs, 'expired': self.expired, 'evicted': self.evicted}
+
+
+SESSIONS = SessionStore(SESSION_TTL, SESSION_MAX)
+
+
+def session_spec_error(body):
+    """Why a body's "session" field is malformed, or None if it is fine (or absent)."""
+    spec = body.get('session')
+    if spec is None:
+        return None
+    if not isinstance(spec, dict):
+        return 'session must be an object {"id", "seq"}'
+    if not isinstance(spec.get('id'), str) or not spec['id']:
+        return 'session.id must be a non-empty string'
+    seq = spec.get('seq', 0)
+    if isinstance(seq, bool) or not isinstance(seq, int) or seq < 0:
+        return 'session.seq must be a non-negative integer'
+    return None
+
+
+def open_session(body, messages):
+    """
+    (session, on_reply) for a chat body. on_reply(text) records the reply and
+    returns the "session" object for the response; both are None when stateless.
+    The body has passed session_spec_error.
+    """
+    spec = body.get('session')
+    if spec is None:
+        return None, None
+    session_id = spec['id']
+    seq = spec.get('seq', 0)
+    session = SESSIONS.open(session_id, seq)
+    if session is None:
+        return None, None
+
+    def on_reply(text):
+        system_text, entries, _ = parse_messages(messages)
+        if text:
+            entries.append(('assistant', trim_turn('assistant', text)))
+        return {'id': session_id, 'seq': SESSIONS.commit(session, seq, system_text, entries, len(messages) + 1)}
+
+    return session, on_reply
+
+
+# ─── Chat completions ────────────────────────────────────────────────────────
+
+def chat_pieces(body, model, priority, stream=False, deadline=None, cancelled=None):
+    """
+    Run one chat-completion body up to the LLM call and return
+    (prompt, pieces, on_reply), where pieces iterates the answer text: an exec
+    result or cache hit in one piece, otherwise the live (possibly shared)
+    flight (see Flight.subscribe for deadline and cancelled). on_reply is the
+    session hook (see open_session) or None. Raises PoolBusy or SessionResync.
+    """
+    messages = body.get('messages', [])
+    session, on_reply = open_session(body, messages)
+    sys_len = sum(len(content_to_text(m.get('content', ''))) for m in messages if m.get('role') == 'system')
+    last_user = ''
+    for m in reversed(messages):
+        if m.get('role') == 'user':
+            last_user = clean_user_msg(content_to_text(m.get('content', '')))
+            break
+    log(f'POST msgs={len(messages)} sys={sys_len} model={model} priority={priority} user="{last_user[:80]}"'
+        + (f' session={session.id}' if session else ''))
+
+    # Map model aliases and route around backends whose circuit is open
+    actual_model = BACKENDS.resolve(model).name
+
+    # Hold a place in the class queue from here on: a full queue is shed
+    # before tools run, not after. Exec tasks go to the job queue instead.
+    is_exec = detect_intent(last_user)[0] == 'exec_task'
+    with nullcontext() if is_exec else get_pool(actual_model).admission(priority) as admission:
+        return _chat_pieces(body, messages, session, on_reply, actual_model, last_user,
+                            priority, stream, deadline, cancelled, admission)
+
+
+def _chat_pieces(body, messages, session, on_reply, actual_model, last_user, priority, stream, deadline,
+                 cancelled, admission):
+    """chat_pieces from prompt assembly on, inside the pool admission (handed to the flight's slot)."""
+    # Build prompt (includes tool pre-execution)
+    prompt, is_exec, exec_output = build_prompt(messages, body.get('tools', []), session)
+
+    # Exec tasks are never cached — they have side effects
+    cache = RESPONSE_CACHE if (RESPONSE_CACHE and not is_exec) else None
+    intent, param = detect_intent(last_user) if cache else (None, None)
+    if not intent:
+        intent, param = 'chat', None
+    cached, tier = cache.get(actual_model, intent, param, prompt, last_user) if cache else (None, None)
+
+    if is_exec and exec_output:
+        # Exec task: subagent already ran — return its output directly
+        log(f'Exec task complete, returning {len(exec_output)} chars directly')
+        return prompt, iter([exec_output]), on_reply
+    if cached:
+        log(f'Cache {tier} hit ({intent}), returning {len(cached)} chars')
+        return prompt, iter([cached]), on_reply
+
+    # LLM call on the model's worker pool. Identical in-flight requests
+    # (same model + prompt) share one opencode run instead of starting another;
+    # slow conversational calls are hedged to a second backend.
+    on_done = (lambda text: cache.put(actual_model, intent, param, prompt, last_user, text)) if cache else None
+    if is_exec:
+        producer = lambda: llm_pieces(actual_model, prompt, stream)
+    else:
+        producer = lambda: hedged_pieces(actual_model, prompt, stream, priority)
+    flight, leader = FLIGHTS.join(
+        flight_key(actual_model, prompt), get_pool(actual_model), producer, on_done, priority, admission)
+    if not leader:
+        if admission:
+            admission.release()   # a follower never queues for a worker itself
+        log(f'Coalesced onto in-flight request for "{last_user[:60]}"')
+    wait = QUEUE_TIMEOUT + 5
+    if deadline is not None:
+        wait = max(0.0, min(wait, deadline - time.monotonic()))
+    flight.wait_started(wait)
+    return prompt, flight.subscribe(deadline, cancelled), on_reply
+
+
+def session_resync_error(e):
+    return {'error': {'message': f'{e} — resend the full history with seq 0', 'type': 'session_resync'},
+            'session': {'id': e.session_id, 'seq': 0}}
+
+
+def token_counts(prompt, text):
+    """Rough (prompt, completion) token counts — whitespace words, at least 1."""
+    return max(len(prompt.split()), 1), max(len(text.split()), 1)
+
+
+def completion_response(chat_id, ts, model, prompt, text):
+    prompt_tokens, completion_tokens = token_counts(prompt, text)
+    return {
+        'id': chat_id, 'object': 'chat.completion', 'created': ts, 'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens}
+    }
+
+
+BATCH_CANCELLED = 424, {'error': {'message': 'cancelled after another batch item failed',
+                                  'type': 'batch_cancelled'}}
+
+
+def _batch_item(index, item, headers, deadline, cancelled):
+    """(status, result) for one /v1/batch entry; gives up with 424 once `cancelled` is set."""
+    if not isinstance(item, dict) or not item.get('messages'):
+        return 400, {'error': {'message': 'messages required', 'type': 'invalid_request'}}
+    invalid = session_spec_error(item)
+    if invalid:
+        return 400, {'error': {'message': invalid, 'type': 'invalid_request'}}
+    priority, model = request_priority(headers, item.get('model', MODEL))
+    ts = int(time.time())
+    try:
+        if cancelled.is_set():
+            return BATCH_CANCELLED
+        prompt, pieces, on_reply = chat_pieces(item, model, priority, deadline=deadline, cancelled=cancelled)
+        text = ''.join(pieces).strip()
+        if cancelled.is_set():
+            return BATCH_CANCELLED
+    except SessionResync as e:
+        return 409, session_resync_error(e)
+    except PoolBusy as e:
+        return e.status, {'error': {'message': f'Router busy ({e.reason}), retry later',
+                                    'type': 'rate_limited' if e.status == 429 else 'overloaded',
+                                    'retry_after': e.retry_after}}
+    except TimeoutError:
+        return 504, {'error': {'message': 'batch deadline exceeded', 'type': 'timeout'}}
+    except Exception as e:
+        log(f'Batch item {index} failed: {e}', 'error')
+        return 500, {'error': {'message': str(e), 'type': 'server_error'}}
+    response = completion_response(f'chatcmpl-{ts}-{index}', ts, model, prompt, text)
+    if on_reply:
+        response['session'] = on_reply(text)
+    return 200, {'response': response}
+
+
+def run_batch(items, headers, timeout, partial):
+    """
+    Run chat-completion bodies concurrently and return (status, payload) with
+    results in request order. Each item goes through the normal pools, cache
+    and coalescing, so pool limits and priority lanes still apply. Items not
+    finished by the deadline get 504 and their calls are abandoned. Without
+    `partial`, the first failed item fails the whole batch with its status and
+    the items still running are cancelled (424).
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    rid = current_request_id()
+    cancelled = threading.Event()
+
+    def run(index, item):
+        set_request_id(f'{rid}.{index}')
+        return _batch_item(index, item, headers, deadline, cancelled)
+
+    executor = ThreadPoolExecutor(max_workers=len(items), thread_name_prefix='batch')
+    futures = {executor.submit(run, i, item): i for i, item in enumerate(items)}
+    outcomes = {}
+    first_failure = None
+    pending = set(futures)
+    while pending:
+        done, pending = futures_wait(pending, timeout=max(0.0, deadline - time.monotonic()) + 1,
+                                     return_when=FIRST_COMPLETED)
+        if not done:   # stuck in tool pre-execution past the deadline
+            break
+        for future in done:
+            status, result = future.result()
+            outcomes[futures[future]] = status, result
+            if status not in (200, 424) and first_failure is None:
+                first_failure = status
+                if not partial:
+                    cancelled.set()   # the batch has failed; stop paying for the rest
+    executor.shutdown(wait=False)
+    results = []
+    for i in range(len(items)):
+        status, result = outcomes.get(i, (504, {'error': {'message': 'batch deadline exceeded',
+                                                          'type': 'timeout'}}))
+        results.append({'index': i, 'status': status, **result})
+
+    failed = [r for r in results if r['status'] != 200]
+    log(f'Batch of {len(items)} done: {len(failed)} failed', ms=int((time.monotonic() - start) * 1000))
+    payload = {'object': 'batch', 'results': results, 'completed': len(results) - len(failed),
+               'failed': len(failed), 'elapsed_ms': int((time.monotonic() - start) * 1000)}
+    if failed and not partial:
+        payload['error'] = {'message': f'{len(failed)} of {len(items)} requests failed', 'type': 'batch_failed'}
+        return first_failure or failed[0]['status'], payload
+    return 200, payload
+
+
 # ─── HTTP Handler ─────────────────────────────────────────────────────────────
 
+class ConnectionStats:
+    """Counts HTTP connections and how many requests reuse an already-open one."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.open = 0
+        self.requests = 0
+        self.reused = 0
+        self.idle_closed = 0
+
+    def connected(self):
+        with self._lock:
+            self.opened += 1
+            self.open += 1
+
+    def disconnected(self):
+        with self._lock:
+            self.open -= 1
+
+    def request(self, nth_on_connection):
+        with self._lock:
+            self.requests += 1
+            if nth_on_connection > 1:
+                self.reused += 1
+
+    def idle_timeout(self):
+        with self._lock:
+            self.idle_closed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'opened': self.opened,
+                'open': self.open,
+                'requests': self.requests,
+                'reused': self.reused,
+                'idle_closed': self.idle_closed,
+                'requests_per_connection': round(self.requests / self.opened, 2) if self.opened else 0.0,
+            }
+
+
+CONNECTIONS = ConnectionStats()
+
+
 class RouterHandler(BaseHTTPRequestHandler):
+    # Persistent HTTP/1.1 connections: every response has a Content-Length or is
+    # chunked, and a connection idle for KEEPALIVE_TIMEOUT is closed.
     protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+
+    def setup(self):
+        super().setup()
+        self.requests_on_connection = 0
+        CONNECTIONS.connected()
+
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            CONNECTIONS.disconnected()
+
+    def handle_one_request(self):
+        set_request_id(uuid.uuid4().hex[:8])
+        self.command = None
+        self.raw_requestline = None
+        start = time.monotonic()
+        super().handle_one_request()
+        if self.raw_requestline is None:   # readline timed out: idle keep-alive connection
+            CONNECTIONS.idle_timeout()
+        if self.command:
+            self.requests_on_connection += 1
+            CONNECTIONS.request(self.requests_on_connection)
+            elapsed = time.monotonic() - start
+            M_REQUEST_SECONDS.observe(elapsed, route=self._route())
+            log('Request done', 'debug', stage='total', method=self.command, path=self.path,
+                ms=int(elapsed * 1000))
+
+    def _route(self):
+        """Path with ids collapsed, so metric labels stay bounded."""
+        if self.path.startswith('/v1/jobs/'):
+            return '/v1/jobs/{id}'
+        known = ('/v1/chat/completions', '/v1/completions', '/v1/models', '/v1/cache',
+                 '/v1/jobs', '/v1/batch', '/v1/pools', '/v1/backends', '/metrics', '/')
+        return self.path if self.path in known else 'other'
+
+    def log_request(self, code='-', size='-'):
+        M_HTTP.inc(route=self._route(), code=getattr(code, 'value', code))
+        super().log_request(code, size)
 
     def log_message(self, fmt, *args):
-        log(f'HTTP: {fmt % args}')
+        log(f'HTTP: {fmt % args}', 'debug')
 
     def do_GET(self):
         if self.path == '/v1/models':
-            self._json({'object': 'list', 'data': [
-                {'id': MODEL, 'object': 'model'},
-                {'id': 'opencode/minimax-m2.5-free', 'object': 'model'},
-                {'id': 'opencode/trinity-large-preview-free', 'object': 'model'},
-                {'id': 'opencode/glm-5-free', 'object': 'model'},
-            ]})
+            self._json({'object': 'list', 'data': [{'id': 'auto', 'object': 'model'}] + [
+                {'id': b.name, 'object': 'model'} for b in BACKENDS.all() if not b.adhoc]})
+        elif self.path == '/v1/backends':
+            self._json({'object': 'backends', 'aliases': BACKENDS.aliases, 'backends': BACKENDS.stats()})
+        elif self.path == '/v1/cache':
+            self._json({'object': 'cache',
+                        'responses': RESPONSE_CACHE.stats() if RESPONSE_CACHE else None,
+                        'tools': TOOL_CACHE.stats() if TOOL_CACHE else None,
+                        'system_prompt': SYSTEM_MEMO.stats()})
+        elif self.path == '/v1/jobs':
+            self._json({'object': 'list', 'data': [j.to_dict() for j in JOBS.list()]})
+        elif self.path.startswith('/v1/jobs/'):
+            job = JOBS.get(self.path.rsplit('/', 1)[1])
+            if job:
+                self._json(job.to_dict())
+            else:
+                self._json({'error': 'job not found'}, 404)
+        elif self.path == '/metrics':
+            payload = render_metrics().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        elif self.path == '/v1/pools':
+            self._json({'object': 'pools', 'pools': pool_stats(), 'flights': FLIGHTS.stats(),
+                        'warm': _WARM_POOL.stats() if _WARM_POOL else None,
+                        'connections': CONNECTIONS.stats(), 'clients': CLIENTS.stats(),
+                        'children': CHILDREN.stats(), 'sessions': SESSIONS.stats()})
         else:
             self._json({'status': 'openclaw router v5'})
 
     def do_POST(self):
         length = int(self.headers.get('Content-Length', 0))
-        body = json.loads(self.rfile.read(length))
-        model = body.get('model', MODEL)
-        messages = body.get('messages', [])
+        try:
+            body = json.loads(self.rfile.read(length))
+        except ValueError as e:
+            self._json({'error': f'invalid JSON body: {e}'}, 400)
+            return
+        if not isinstance(body, dict):
+            self._json({'error': 'request body must be a JSON object'}, 400)
+            return
+        priority, model = request_priority(self.headers, body.get('model', MODEL))
         is_stream = body.get('stream', False)
-        tools = body.get('tools', [])
-
-        msg_count = len(messages)
-        sys_len = sum(len(content_to_text(m.get('content', ''))) for m in messages if m.get('role') == 'system')
-        last_user_preview = ''
-        for m in reversed(messages):
-            if m.get('role') == 'user':
-                last_user_preview = clean_user_msg(content_to_text(m.get('content', '')))[:80]
-                break
-        log(f'POST msgs={msg_count} sys={sys_len} model={model} user="{last_user_preview}"')
 
-        if self.path not in ('/v1/chat/completions', '/v1/completions'):
-            self._json({'error': 'not found'}, 404)
+        try:
+            CLIENTS.admit(self.headers.get('X-Router-Client') or self.client_address[0])
+        except PoolBusy as e:
+            self._busy(e)
             return
 
-        # Build prompt (includes tool pre-execution)
-        prompt, is_exec, exec_output = build_prompt(messages, tools)
+        if self.path == '/v1/jobs':
+            self._submit_job(body, model)
+            return
 
-        # Map model names
-        actual_model = model
-        if 'kimi' in model.lower():
-            actual_model = 'opencode/glm-5-free'
+        if self.path == '/v1/batch':
+            capture_request(self.path, body)
+            self._batch(body)
+            return
 
-        if is_exec and exec_output:
-            # Exec task: subagent already ran — return its output directly
-            cleaned = exec_output
-            log(f'Exec task complete, returning {len(cleaned)} chars directly')
-        else:
-            # Normal conversational LLM call
-            env = os.environ.copy()
-            env['PATH'] = os.path.dirname(OPENCODE) + ':' + env.get('PATH', '')
-            try:
-                result = subprocess.run(
-                    [OPENCODE, 'run', '-m', actual_model, prompt],
-                    capture_output=True, text=True, timeout=TIMEOUT,
-                    env=env, cwd='/home/ubuntu'
-                )
-                raw = result.stdout + result.stderr
-                # Clean ANSI
-                cleaned = re.sub(r'\x1b\[[0-9;]*m', '', raw)
-                # Remove opencode startup noise
-                lines = []
-                for line in cleaned.split('\n'):
-                    line = line.strip()
-                    if line and not line.startswith('>') and 'build' not in line.lower()[:20]:
-                        lines.append(line)
-                cleaned = '\n'.join(lines).strip() or 'No response'
-                log(f'LLM response ({len(cleaned)} chars): {cleaned[:150]}')
-            except subprocess.TimeoutExpired:
-                cleaned = f'Taking longer than {TIMEOUT}s — free model is still working. Try again in a moment.'
-                log(f'TIMEOUT after {TIMEOUT}s')
-            except Exception as e:
-                cleaned = f'Router error: {e}'
-                log(f'Error: {e}')
+        if self.path not in ('/v1/chat/completions', '/v1/completions'):
+            self._json({'error': 'not found'}, 404)
+            return
+        capture_request(self.path, body)
+        invalid = session_spec_error(body)
+        if invalid:
+            self._json({'error': invalid}, 400)
+            return
 
         ts = int(time.time())
         chat_id = f'chatcmpl-{ts}'
-        prompt_tokens = max(len(prompt.split()), 1)
-        completion_tokens = max(len(cleaned.split()), 1)
+        try:
+            prompt, pieces, on_reply = chat_pieces(body, model, priority, is_stream)
+        except SessionResync as e:
+            log(f'{e}, asking client to resync')
+            self._json(session_resync_error(e), 409)
+            return
+        except PoolBusy as e:
+            self._busy(e)
+            return
 
         if is_stream:
-            self._stream_response(chat_id, ts, model, cleaned, prompt_tokens, completion_tokens, body)
+            # Stream opencode's output to the client as it is generated
+            self._stream_chunks(chat_id, ts, model, pieces, prompt, body, on_reply)
         else:
-            self._json({
-                'id': chat_id, 'object': 'chat.completion', 'created': ts, 'model': model,
-                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': cleaned}, 'finish_reason': 'stop'}],
-                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens}
-            })
-
-    def _stream_response(self, chat_id, ts, model, text, prompt_tokens, completion_tokens, body):
-        chunks = [
-            'data: ' + json.dumps({
-                'id': chat_id, 'object': 'chat.completion.chunk', 'created': ts, 'model': model,
-                'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}]
-            }) + '\n\n',
-            'data: ' + json.dumps({
+            text = ''.join(pieces).strip()
+            response = completion_response(chat_id, ts, model, prompt, text)
+            if on_reply:
+                response['session'] = on_reply(text)
+            self._json(response)
+
+    def do_DELETE(self):
+        job = JOBS.get(self.path.rsplit('/', 1)[1]) if self.path.startswith('/v1/jobs/') else None
+        if not job:
+            self._json({'error': 'job not found'}, 404)
+            return
+        if job.cancel():
+            log(f'Job {job.id} cancelled')
+        self._json(job.to_dict())
+
+    def _submit_job(self, body, model):
+        """POST /v1/jobs — {"task": "..."} or chat-style {"messages": [...]}; returns 202 + job id."""
+        task = body.get('task', '')
+        if not task:
+            for m in reversed(body.get('messages', [])):
+                if m.get('role') == 'user':
+                    task = clean_user_msg(content_to_text(m.get('content', '')))
+                    break
+        if not task:
+            self._json({'error': 'task or user message required'}, 400)
+            return
+        model = BACKENDS.resolve(model, kind='cli').name   # exec needs the opencode agent
+        try:
+            job = JOBS.submit(task, model)
+        except PoolBusy as e:
+            self._busy(e)
+            return
+        self._json(job.to_dict(), 202)
+
+    def _batch(self, body):
+        """POST /v1/batch — {"requests": [chat bodies], "timeout": s, "partial": bool}."""
+        items = body.get('requests')
+        if not isinstance(items, list) or not items:
+            self._json({'error': 'requests must be a non-empty list'}, 400)
+            return
+        if len(items) > BATCH_MAX:
+            self._json({'error': f'at most {BATCH_MAX} requests per batch'}, 400)
+            return
+        for i, item in enumerate(items):
+            messages = item.get('messages') if isinstance(item, dict) else None
+            if not isinstance(messages, list) or not messages or not all(isinstance(m, dict) for m in messages):
+                self._json({'error': f'requests[{i}] must be an object with a non-empty messages list'}, 400)
+                return
+        timeout = body.get('timeout')
+        if timeout is None:
+            timeout = TIMEOUT
+        elif isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+            self._json({'error': 'timeout must be a positive number of seconds'}, 400)
+            return
+        partial = body.get('partial', False)
+        if not isinstance(partial, bool):
+            self._json({'error': 'partial must be true or false'}, 400)
+            return
+        try:   # the batch already took one token on arrival
+            CLIENTS.admit(self.headers.get('X-Router-Client') or self.client_address[0], len(items) - 1)
+        except PoolBusy as e:
+            self._busy(e)
+            return
+        status, payload = run_batch(items, self.headers, float(timeout), partial)
+        headers = None
+        if status in (429, 503):   # rejected as a whole: say when to retry, like the other busy paths
+            waits = [r['error'].get('retry_after') or 1 for r in payload['results'] if r['status'] == status]
+            headers = {'Retry-After': str(max(waits))}
+        self._json(payload, status, headers)
+
+    def _stream_chunks(self, chat_id, ts, model, pieces, prompt, body, on_reply=None):
+        """Send an SSE chat.completion.chunk stream, one delta per piece of text."""
+        def event(delta, finish_reason=None, **extra):
+            return ('data: ' + json.dumps({
                 'id': chat_id, 'object': 'chat.completion.chunk', 'created': ts, 'model': model,
-                'choices': [{'index': 0, 'delta': {'content': text}, 'finish_reason': None}]
-            }) + '\n\n',
-        ]
-        finish = {
-            'id': chat_id, 'object': 'chat.completion.chunk', 'created': ts, 'model': model,
-            'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
-        }
-        if body.get('stream_options', {}).get('include_usage'):
-            finish['usage'] = {
-                'prompt_tokens': prompt_tokens,
-                'completion_tokens': completion_tokens,
-                'total_tokens': prompt_tokens + completion_tokens
-            }
-        chunks.append('data: ' + json.dumps(finish) + '\n\n')
-        chunks.append('data: [DONE]\n\n')
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+                **extra,
+            }) + '\n\n').encode()
 
-        payload = ''.join(chunks).encode()
         self.send_response(200)
         self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
         self.send_header('Cache-Control', 'no-cache')
-        self.send_header('Connection', 'close')
-        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Transfer-Encoding', 'chunked')   # length unknown, connection stays open
         self.end_headers()
-        self.wfile.write(payload)
-        self.wfile.flush()
+
+        text = ''
+        try:
+            self._chunk(event({'role': 'assistant', 'content': ''}))
+            for piece in pieces:
+                text += piece
+                self._chunk(event({'content': piece}))
+            extra = {}
+            if body.get('stream_options', {}).get('include_usage'):
+                prompt_tokens, completion_tokens = token_counts(prompt, text)
+                extra['usage'] = {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens
+                }
+            if on_reply:
+                extra['session'] = on_reply(text.strip())
+            self._chunk(event({}, 'stop', **extra) + b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            log(f'Client disconnected after {len(text)} chars')
+            self.close_connection = True
+        finally:
+            close = getattr(pieces, 'close', None)
+            if close:
+                close()   # stops the opencode process if we bailed out early
         log(f'Streamed {len(text)} chars')
 
-    def _json(self, data, code=200):
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def _busy(self, e):
+        log(f'Pool busy: {e}', 'warning', pool=e.pool, status=e.status, retry_after=e.retry_after)
+        self._json({'error': {'message': f'Router busy ({e.reason}), retry later',
+                              'type': 'rate_limited' if e.status == 429 else 'overloaded'}}, e.status,
+                   headers={'Retry-After': str(e.retry_after)})
+
+    def _json(self, data, code=200, headers=None):
         payload = json.dumps(data).encode()
         self.send_response(code)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Content-Length', str(len(payload)))
-        self.send_header('Connection', 'close')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(payload)
 
@@ -704,6 +3399,15 @@ class RouterHandler(BaseHTTPRequestHandler):
 if __name__ == '__main__':
     port = int(os.environ.get('ROUTER_PORT', '4097'))
     log(f'=== OpenClaw Router v6 starting on 0.0.0.0:{port} ===')
-    log(f'Model: {MODEL}, Timeout: {TIMEOUT}s')
-    server = HTTPServer(('0.0.0.0', port), RouterHandler)
+    log(f'Model: {MODEL}, Timeout: {TIMEOUT}s, Workers/model: {WORKERS_PER_MODEL}, Queue: {QUEUE_MAX}')
+    log(f'Backends: {", ".join(f"{b.name} ({b.kind})" for b in BACKENDS.all())}')
+    if WARM_WORKERS > 0:
+        _WARM_POOL = WarmPool(WARM_WORKERS)
+        _WARM_POOL.start()
+        log(f'Warm workers ready: {_WARM_POOL.stats()["idle"]}/{WARM_WORKERS}')
+    server = ThreadingHTTPServer(('0.0.0.0', port), RouterHandler)
+    server.daemon_threads = True
+    # Children run in their own process groups, so a plain SIGTERM would orphan them:
+    # exit through atexit, which stops warm workers and kills what's still running
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     server.serve_forever()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Conversation history budget shared by cli_router.py and telegram_bot.py.
+
+The router turns past messages into "U: …" / "A: …" lines, cuts each turn to a
+fixed length and keeps only the newest lines that fit in MAX_HISTORY_BYTES.
+The bot uses the same functions to decide what to store and send, so it never
+ships (or keeps in RAM) history the router would throw away, and the two
+cannot drift apart.
+
+Sizes are UTF-8 bytes of the prompt line, newline included.
+
+Deploy next to cli_router.py and telegram_bot.py (both import it as a sibling).
+"""
+
+MAX_HISTORY_BYTES = 2500   # past turns in the prompt; the current message is extra
+ASSISTANT_CHARS = 200      # assistant replies are cut to this (+ '…')
+TOOL_RESULT_CHARS = 150
+TOOL_ARGS_CHARS = 60
+
+ROLE_PREFIX = {'user': 'U', 'assistant': 'A', 'tool_call': 'T', 'tool_result': 'R'}
+
+
+def trim_turn(role, text):
+    """A turn as the prompt will carry it. Idempotent: trimming twice changes nothing."""
+    if role == 'assistant' and len(text) > ASSISTANT_CHARS:
+        return text[:ASSISTANT_CHARS] + '…'
+    if role == 'tool_result':
+        return text[:TOOL_RESULT_CHARS]
+    return text
+
+
+def history_line(role, text):
+    return f'{ROLE_PREFIX.get(role, role[0].upper())}: {text}'
+
+
+def line_bytes(role, text):
+    """Prompt bytes one (already trimmed) turn costs, newline included."""
+    return len(history_line(role, text).encode()) + 1
+
+
+def recent_within_budget(entries, budget=MAX_HISTORY_BYTES):
+    """
+    The newest (role, text) entries whose lines fit in budget, oldest first.
+    Stops at the first entry that does not fit — history stays contiguous.
+    """
+    kept = []
+    total = 0
+    for role, text in reversed(entries):
+        cost = line_bytes(role, text)
+        if total + cost > budget:
+            break
+        kept.append((role, text))
+        total += cost
+    kept.reverse()
+    return kept
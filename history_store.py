@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Conversation history for telegram_bot.py, kept in SQLite so it survives restarts.
+
+- WAL journal: the flusher writes while handlers read without blocking each other
+- Write-behind: appends land in RAM at once and are written in batches by a
+  background thread (every FLUSH_INTERVAL seconds, sooner under load)
+- Lazy load: a chat is read from disk the first time it is touched
+- LRU: only the max_chats most recently used chats stay in RAM
+- Byte budget: a chat keeps its newest message plus the older turns that fit
+  the router's history budget (history_policy.py), trimmed the way the router
+  trims them — nothing is stored that the router would drop
+
+Every method is thread-safe, so it can be called from async handlers and from
+asyncio.to_thread workers alike. Reads return copies.
+
+Deploy next to telegram_bot.py (imported as a sibling).
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+
+from history_policy import MAX_HISTORY_BYTES, recent_within_budget, trim_turn
+
+FLUSH_INTERVAL = 2.0   # seconds between write-behind flushes
+FLUSH_BATCH = 64       # flush early once this many writes are pending
+LOAD_ROWS = 200        # rows read per chat on load, before the byte budget applies
+
+
+class HistoryStore:
+    def __init__(self, path, budget=MAX_HISTORY_BYTES, max_chats=256):
+        self.path = path
+        self.budget = budget
+        self.max_chats = max_chats
+        self.lock = threading.Lock()        # guards chats and pending
+        self.db_lock = threading.Lock()     # one statement batch at a time on the connection
+        self.chats = OrderedDict()          # chat_id → deque of messages, LRU order
+        self.pending = []                   # ('append', chat_id, role, content, ts, keep) / ('clear', chat_id)
+        self.loads = 0
+        self.evictions = 0
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')   # WAL + NORMAL: durable across app crashes
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS messages ('
+            'id INTEGER PRIMARY KEY, chat_id INTEGER NOT NULL, role TEXT NOT NULL, '
+            'content TEXT NOT NULL, ts REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS messages_chat ON messages (chat_id, id)')
+        self.wake = threading.Event()
+        self.closed = False
+        self.flusher = threading.Thread(target=self._flush_loop, name='history-flush', daemon=True)
+        self.flusher.start()
+
+    # ── Reads / writes (RAM) ──────────────────────────────────────────────────
+
+    def _chat(self, chat_id):
+        """The chat's deque, loading it from disk on a miss. Caller holds self.lock."""
+        msgs = self.chats.get(chat_id)
+        if msgs is not None:
+            self.chats.move_to_end(chat_id)
+            return msgs
+        with self.db_lock:
+            # Pending writes for an evicted chat must reach disk before it is re-read
+            if any(op[1] == chat_id for op in self.pending):
+                ops = self._take_pending()
+                try:
+                    self._write(ops)
+                except Exception:
+                    self.pending[:0] = ops
+                    raise
+            rows = self.db.execute(
+                'SELECT role, content FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?',
+                (chat_id, LOAD_ROWS)).fetchall()
+        msgs = deque({'role': r, 'content': c} for r, c in reversed(rows))
+        self._trim(msgs)
+        self.chats[chat_id] = msgs
+        self.loads += 1
+        while len(self.chats) > self.max_chats:
+            self.chats.popitem(last=False)
+            self.evictions += 1
+        return msgs
+
+    def _trim(self, msgs):
+        """Drop the oldest turns until the rest fits the budget; the newest always stays."""
+        if not msgs:
+            return
+        older = [(m['role'], m['content']) for m in list(msgs)[:-1]]
+        for _ in range(len(older) - len(recent_within_budget(older, self.budget))):
+            msgs.popleft()
+
+    def get(self, chat_id) -> list:
+        with self.lock:
+            return [dict(m) for m in self._chat(chat_id)]
+
+    def append(self, chat_id, role, content):
+        with self.lock:
+            msgs = self._chat(chat_id)
+            content = trim_turn(role, content)
+            msgs.append({'role': role, 'content': content})
+            self._trim(msgs)
+            self.pending.append(('append', chat_id, role, content, time.time(), len(msgs)))
+            if len(self.pending) >= FLUSH_BATCH:
+                self.wake.set()
+
+    def clear(self, chat_id):
+        with self.lock:
+            self._chat(chat_id).clear()
+            self.pending.append(('clear', chat_id))
+        self.wake.set()
+
+    # ── Write-behind (disk) ───────────────────────────────────────────────────
+
+    def _take_pending(self):
+        ops, self.pending = self.pending, []
+        return ops
+
+    def _write(self, ops):
+        """Apply ops in one transaction. Caller holds self.db_lock."""
+        if not ops:
+            return
+        keep = {}   # chat_id → rows to keep after this batch
+        self.db.execute('BEGIN')
+        try:
+            for op in ops:
+                if op[0] == 'clear':
+                    self.db.execute('DELETE FROM messages WHERE chat_id = ?', (op[1],))
+                else:
+                    self.db.execute(
+                        'INSERT INTO messages (chat_id, role, content, ts) VALUES (?, ?, ?, ?)', op[1:5])
+                    keep[op[1]] = op[5]
+            # Disk keeps what RAM keeps: drop rows the budget pushed out
+            for chat_id, count in keep.items():
+                self.db.execute(
+                    'DELETE FROM messages WHERE chat_id = ? AND id <= ('
+                    'SELECT id FROM messages WHERE chat_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+                    (chat_id, chat_id, count))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def flush(self):
+        # Lock order is always lock → db_lock. Taking db_lock before letting go of
+        # lock means a chat load that comes after this waits for these rows.
+        with self.lock:
+            ops = self._take_pending()
+            self.db_lock.acquire()
+        try:
+            self._write(ops)
+        except Exception:
+            self.db_lock.release()
+            with self.lock:
+                self.pending[:0] = ops   # keep them for the next attempt, in order
+            raise
+        self.db_lock.release()
+
+    def _flush_loop(self):
+        while not self.closed:
+            self.wake.wait(FLUSH_INTERVAL)
+            self.wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error:
+                time.sleep(FLUSH_INTERVAL)   # disk full / locked — retry next round
+
+    def close(self):
+        self.closed = True
+        self.wake.set()
+        self.flusher.join(timeout=5)
+        self.flush()
+        with self.db_lock:
+            self.db.close()
+
+    def chat_bytes(self, chat_id) -> int:
+        with self.lock:
+            return sum(len(m['content'].encode()) for m in self._chat(chat_id))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'chats_in_ram': len(self.chats), 'pending_writes': len(self.pending),
+                    'loads': self.loads, 'evictions': self.evictions,
+                    'bytes_in_ram': sum(len(m['content'].encode()) for msgs in self.chats.values() for m in msgs)}
@@ -17,10 +17,15 @@ CHAT_ID     = os.environ.get('TELEGRAM_CHAT_ID', '')
 TOPIC       = os.environ.get('REPORT_TOPIC', 'latest AI news and tech developments')
 ROUTER_URL  = os.environ.get('ROUTER_URL', 'http://localhost:4097/v1/chat/completions')
 ROUTER_MODEL = os.environ.get('ROUTER_MODEL', 'opencode/minimax-m2.5-free')
+# Digests are batch work: the router serves chat first and may answer 429/503 while busy
+ROUTER_HEADERS = {'X-Router-Client': 'hourly-report', 'X-Router-Priority': 'batch'}
+ROUTER_RETRIES = 3
 
 SKILLS_DIR = os.path.expanduser('~/.openclaw/workspace/skills/web-browser/scripts')
 WEB_SEARCH  = f'{SKILLS_DIR}/web_search.py'
 
+HTTP = requests.Session()   # keep-alive: one connection to the router / Telegram for the whole run
+
 
 def web_search(query, n=8):
     try:
@@ -34,22 +39,23 @@ def web_search(query, n=8):
 
 
 def call_router(prompt):
+    body = {
+        'model': ROUTER_MODEL,
+        'stream': False,
+        'messages': [
+            {'role': 'system', 'content':
+             'You are Claw, a direct AI assistant. Summarize the given news into a '
+             'concise hourly digest. Use plain text, no markdown headers or #. '
+             'Be factual, 200-350 words. End with 1 sentence of your opinion/insight.'},
+            {'role': 'user', 'content': prompt}
+        ]
+    }
     try:
-        r = requests.post(
-            ROUTER_URL,
-            json={
-                'model': ROUTER_MODEL,
-                'stream': False,
-                'messages': [
-                    {'role': 'system', 'content':
-                     'You are Claw, a direct AI assistant. Summarize the given news into a '
-                     'concise hourly digest. Use plain text, no markdown headers or #. '
-                     'Be factual, 200-350 words. End with 1 sentence of your opinion/insight.'},
-                    {'role': 'user', 'content': prompt}
-                ]
-            },
-            timeout=120,
-        )
+        for attempt in range(ROUTER_RETRIES):
+            r = HTTP.post(ROUTER_URL, headers=ROUTER_HEADERS, json=body, timeout=120)
+            if r.status_code not in (429, 503) or attempt == ROUTER_RETRIES - 1:
+                break
+            time.sleep(min(int(r.headers.get('Retry-After', '30')), 120))   # shed while chat is busy
         r.raise_for_status()
         return r.json()['choices'][0]['message']['content'].strip()
     except Exception as e:
@@ -70,7 +76,7 @@ def send_telegram(text):
             yield t[i:i + limit]
 
     for chunk in chunks(text):
-        r = requests.post(
+        r = HTTP.post(
             f'https://api.telegram.org/bot{BOT_TOKEN}/sendMessage',
             json={'chat_id': CHAT_ID, 'text': chunk},
             timeout=15
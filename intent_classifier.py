@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Intent classification shared by cli_router.py and telegram_bot.py.
+
+All keyword lists are compiled into one regex: a prefix trie of every keyword
+(so at each position the engine follows one branch instead of trying ~50
+alternatives) wrapped in a lookahead (so overlapping keywords are all found).
+One finditer over the lowercased message yields every keyword kind present;
+intent priority is then applied to that set. Exec/question detection stays as
+anchored matches on the start of the message.
+
+Deploy next to cli_router.py and telegram_bot.py (both import it as a sibling).
+Benchmark: python3 bench/intent_bench.py
+"""
+import re
+
+ESTONIAN_NEWS_KEYWORDS = [
+    'estonian news', 'estonia news', 'eesti uudised', 'eesti uudis',
+    'err.ee', 'postimees', 'delfi', 'estonian', 'estonia',
+]
+
+# Estonian keywords only mean "news" together with one of these
+NEWS_WORDS = ['news', 'uudis', 'report', 'today', 'latest', 'what', 'tell']
+
+SENTIMENT_KEYWORDS = [
+    'sentiment', 'public opinion', 'what do people think', 'what are people saying',
+    'what are conservatives', 'what are liberals', 'social media', 'facebook',
+    'twitter', 'polls', 'poll', 'survey', 'opinion poll', 'population thinks',
+    'citizens think', 'society thinks', 'public view', 'community thinks',
+    'what does society', 'population sentiment', 'deep research', 'scientific research',
+    'how do estonians', 'eestlased', 'hoiakud', 'rahvaküsitlus', 'küsitlus',
+    'what do estonians think', 'estonian opinion', 'citizen sentiment',
+]
+
+# Exec task: imperative action words that should trigger real subagent execution
+EXEC_PATTERN = re.compile(
+    r'^(install|uninstall|remove|setup|deploy|configure|run |execute|start|stop|restart'
+    r'|create|build|make |fix|update|upgrade|download|clone|write|implement|add skill'
+    r'|install skill|test |generate|render|compile)',
+    re.IGNORECASE
+)
+# Words that flip exec → question (don't exec if it's a question about doing something)
+QUESTION_PATTERN = re.compile(
+    r'^(what|how|why|when|where|which|can you|could you|would|should|is there|are there)',
+    re.IGNORECASE
+)
+
+VIDEO_PATTERN = re.compile(
+    r'\b(make|create|generate|produce|render|give me|show me|send)\s+(a\s+|me\s+|us\s+)?'
+    r'(news\s+)?video\b'
+    r'|\bvideo\s+(about|on|covering|of)\b'
+    r'|\bnews\s+video\b'
+    r'|\bvideo\s+about\b',
+    re.IGNORECASE
+)
+
+SEARCH_PATTERN = re.compile(r'\b(search|look up|find|google|research|web)\b')
+SEARCH_QUERY_PATTERN = re.compile(r'(?:search(?:\s+for)?|look\s+up|find|google|research)\s+(.+)')
+URL_PATTERN = re.compile(r'https?://\S+')
+
+_KEYWORD_GROUPS = {
+    'sentiment': SENTIMENT_KEYWORDS,
+    'estonian': ESTONIAN_NEWS_KEYWORDS,
+    'news_word': NEWS_WORDS,
+}
+
+
+def _trie_pattern(words):
+    """Regex source matching any of `words`, factored by common prefix (longest match wins)."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = {}   # end of a word
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 and '' not in node else '(?:' + '|'.join(branches) + ')'
+        return body + '?' if '' in node else body
+
+    return build(trie)
+
+
+def _compile_keywords(groups):
+    words = {w for group in groups.values() for w in group}
+    # Each keyword carries the kinds of every keyword inside it: the trie only reports the
+    # longest keyword starting at a position ('estonian news' also means 'news_word')
+    kinds = {w: frozenset(kind for kind, group in groups.items() for k in group if k in w)
+             for w in words}
+    return re.compile('(?=(' + _trie_pattern(words) + '))'), kinds
+
+
+_KEYWORD_RE, _KEYWORD_KINDS = _compile_keywords(_KEYWORD_GROUPS)
+
+
+def keyword_kinds(msg_lower):
+    """Set of keyword kinds ('sentiment', 'estonian', 'news_word') found in a lowercased message."""
+    kinds = set()
+    for m in _KEYWORD_RE.finditer(msg_lower):
+        kinds |= _KEYWORD_KINDS[m.group(1)]
+    return kinds
+
+
+def is_question(text):
+    t = text.strip()
+    return t.endswith('?') or bool(QUESTION_PATTERN.match(t))
+
+
+def is_imperative(text):
+    """Starts with an action verb and isn't phrased as a question."""
+    t = text.strip()
+    return bool(EXEC_PATTERN.match(t)) and not is_question(t)
+
+
+def is_video_request(text):
+    return bool(VIDEO_PATTERN.search(text))
+
+
+def is_exec_task(text):
+    """True if the message looks like an imperative action to execute (the bot's video command excluded)."""
+    return is_imperative(text) and not is_video_request(text)
+
+
+def detect_intent(user_msg):
+    """
+    Return (intent, param): intent is 'sentiment_research', 'estonian_news',
+    'exec_task', 'web_search', 'web_fetch' or None; param is the search query,
+    URL, or the message itself.
+    """
+    msg_lower = user_msg.lower()
+    kinds = keyword_kinds(msg_lower)
+
+    # Sentiment / deep research — checked before news/search (more specific)
+    if 'sentiment' in kinds:
+        return ('sentiment_research', user_msg)
+
+    if 'estonian' in kinds and 'news_word' in kinds:
+        return ('estonian_news', user_msg)
+
+    if is_imperative(user_msg):
+        return ('exec_task', user_msg)
+
+    # Explicit web search
+    if SEARCH_PATTERN.search(msg_lower):
+        m = SEARCH_QUERY_PATTERN.search(msg_lower)
+        return ('web_search', m.group(1).strip() if m else user_msg)
+
+    # URL in message — fetch it
+    m = URL_PATTERN.search(user_msg)
+    if m:
+        return ('web_fetch', m.group(0))
+
+    return (None, user_msg)
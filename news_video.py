@@ -39,6 +39,8 @@ BOT_TOKEN     = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 CHAT_ID       = _ARGS.chat_id or os.environ.get('TELEGRAM_CHAT_ID', '')
 ROUTER_URL    = os.environ.get('ROUTER_URL',  'http://localhost:4097/v1/chat/completions')
 ROUTER_MODEL  = os.environ.get('ROUTER_MODEL', 'opencode/minimax-m2.5-free')
+ROUTER_HEADERS = {'X-Router-Client': 'news-video', 'X-Router-Priority': 'batch'}   # chat goes first
+ROUTER_RETRIES = 3   # attempts while the router sheds batch work with 429
 GOOGLE_AI_KEY = os.environ.get('GOOGLE_AI_KEY', '')   # for script generation only
 # TartuNLP TTS — free public API, native Estonian neural synthesis
 # Male speakers: albert, indrek, kalev, luukas, meelis, peeter, tambet
@@ -47,6 +49,7 @@ TARTUNLP_URL     = 'https://api.tartunlp.ai/text-to-speech/v2'
 TARTUNLP_SPEAKER = os.environ.get('TARTUNLP_SPEAKER', 'tambet')  # deep male voice
 TARTUNLP_SPEED   = float(os.environ.get('TARTUNLP_SPEED', '0.95'))
 TOPIC            = _ARGS.topic
+HTTP             = requests.Session()   # keep-alive: reuse connections to the router, APIs and CDNs
 
 # ─── Video params — TikTok 9:16 ───────────────────────────────────────────────
 FPS    = 25
@@ -77,7 +80,7 @@ def _resolve_font() -> str:
         os.makedirs(_FONT_CACHE_DIR, exist_ok=True)
         print('     Downloading Montserrat ExtraBold font...')
         try:
-            r = requests.get(_MONTSERRAT_URL, timeout=30)
+            r = HTTP.get(_MONTSERRAT_URL, timeout=30)
             r.raise_for_status()
             with open(_MONTSERRAT_PATH, 'wb') as f:
                 f.write(r.content)
@@ -149,7 +152,7 @@ def call_llm(user_msg: str, system: str) -> str:
     """Script generation: Gemini 2.0 Flash first, router fallback."""
     if GOOGLE_AI_KEY:
         try:
-            r = requests.post(
+            r = HTTP.post(
                 f'https://generativelanguage.googleapis.com/v1beta/models/'
                 f'gemini-2.0-flash:generateContent?key={GOOGLE_AI_KEY}',
                 json={
@@ -163,18 +166,19 @@ def call_llm(user_msg: str, system: str) -> str:
             return r.json()['candidates'][0]['content']['parts'][0]['text'].strip()
         except Exception as e:
             print(f'[gemini] {e} — falling back to router', file=sys.stderr)
+    body = {
+        'model': ROUTER_MODEL, 'stream': False,
+        'messages': [
+            {'role': 'system', 'content': system},
+            {'role': 'user',   'content': user_msg},
+        ],
+    }
     try:
-        r = requests.post(
-            ROUTER_URL,
-            json={
-                'model': ROUTER_MODEL, 'stream': False,
-                'messages': [
-                    {'role': 'system', 'content': system},
-                    {'role': 'user',   'content': user_msg},
-                ],
-            },
-            timeout=120,
-        )
+        for attempt in range(ROUTER_RETRIES):
+            r = HTTP.post(ROUTER_URL, headers=ROUTER_HEADERS, json=body, timeout=120)
+            if r.status_code != 429 or attempt == ROUTER_RETRIES - 1:
+                break
+            time.sleep(min(int(r.headers.get('Retry-After', '30')), 120))
         r.raise_for_status()
         return r.json()['choices'][0]['message']['content'].strip()
     except Exception as e:
@@ -267,7 +271,7 @@ async def generate_tts(text: str, audio_path: str) -> list:
 
     # Split long texts into chunks (API handles ~300 words comfortably)
     # For our ~120-word scripts this is never needed, but split at sentence boundaries
-    response = requests.post(
+    response = HTTP.post(
         TARTUNLP_URL,
         json={'text': text, 'speaker': TARTUNLP_SPEAKER, 'speed': TARTUNLP_SPEED},
         timeout=90,
@@ -349,7 +353,7 @@ def try_fetch_background_image(topic: str):
             wiki_title = title
             break
     try:
-        r = requests.get(
+        r = HTTP.get(
             'https://en.wikipedia.org/w/api.php',
             params={
                 'action': 'query', 'titles': wiki_title,
@@ -361,7 +365,7 @@ def try_fetch_background_image(topic: str):
         pages = r.json()['query']['pages']
         img_url = next(iter(pages.values())).get('thumbnail', {}).get('source', '')
         if img_url:
-            ir = requests.get(img_url, timeout=15, headers={'User-Agent': 'ClawBot/1.0'})
+            ir = HTTP.get(img_url, timeout=15, headers={'User-Agent': 'ClawBot/1.0'})
             if ir.ok and len(ir.content) > 5000:
                 img = Image.open(io.BytesIO(ir.content)).convert('RGB')
                 img = img.resize((WIDTH, HEIGHT), Image.LANCZOS)
@@ -379,7 +383,7 @@ def try_fetch_background_image(topic: str):
     ]:
         try:
             url = f'https://images.unsplash.com/photo-{pid}?w={WIDTH}&h={HEIGHT}&fit=crop&q=80'
-            ir = requests.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
+            ir = HTTP.get(url, timeout=10, headers={'User-Agent': 'Mozilla/5.0'})
             if ir.ok and 'image' in ir.headers.get('Content-Type', '') and len(ir.content) > 10000:
                 img = Image.open(io.BytesIO(ir.content)).convert('RGB')
                 img = img.resize((WIDTH, HEIGHT), Image.LANCZOS)
@@ -663,7 +667,7 @@ def send_video(path: str, caption: str):
         return
     print('Sending to Telegram...')
     with open(path, 'rb') as f:
-        r = requests.post(
+        r = HTTP.post(
             f'https://api.telegram.org/bot{BOT_TOKEN}/sendVideo',
             data={'chat_id': CHAT_ID, 'caption': caption, 'supports_streaming': 'true'},
             files={'video': ('news.mp4', f, 'video/mp4')},
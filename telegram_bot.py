@@ -25,20 +25,41 @@ import re
 import sys
 import time
 import tempfile
-from collections import defaultdict, deque
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from telegram import Update, constants
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, ContextTypes, filters
+    Application, BaseUpdateProcessor, CommandHandler, MessageHandler, ContextTypes, filters
 )
 
+from history_store import HistoryStore
+from intent_classifier import VIDEO_PATTERN, is_exec_task, is_video_request
+
 # ─── Config ──────────────────────────────────────────────────────────────────
 BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
 ROUTER_URL = os.environ.get('ROUTER_URL', 'http://localhost:4097/v1/chat/completions')
 ROUTER_MODEL = os.environ.get('ROUTER_MODEL', 'opencode/minimax-m2.5-free')
+ROUTER_JOBS_URL = os.environ.get(
+    'ROUTER_JOBS_URL', ROUTER_URL.replace('/v1/chat/completions', '/v1/jobs')
+)
+JOB_POLL_INTERVAL = 5     # seconds between exec job status polls
+JOB_MAX_WAIT = 900        # give up polling after this long
+ROUTER_POOL_SIZE = 16     # kept-alive connections per host (router calls run on worker threads)
+MAX_CONCURRENT_UPDATES = int(os.environ.get('BOT_MAX_CONCURRENT', '16'))  # updates in flight across all chats
+CHAT_MAX_PENDING = int(os.environ.get('BOT_CHAT_MAX_PENDING', '5'))      # per chat (running + queued) before new ones are refused
+ROUTER_HEADERS = {'X-Router-Client': 'telegram-bot', 'X-Router-Priority': 'interactive'}
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY', '')
 WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'small')
+STREAM_EDIT_INTERVAL = 1.2        # seconds between edits of a streaming reply (private chats)
+STREAM_EDIT_INTERVAL_GROUP = 3.0  # groups: Telegram allows ~20 messages a minute
+TRANSCRIBE_TIMEOUT = 180  # seconds for voice_transcribe.py (Whisper + rewrite)
+TRANSCRIBE_MARGIN = 10    # the transcriber is told to finish this much sooner, so its answer still arrives
+# Warm transcription service (voice_transcribe.py --serve); without it each note spawns a process
+TRANSCRIBE_SOCKET = os.environ.get('TRANSCRIBE_SOCKET', '/tmp/claw-transcribe.sock')
 ALLOWED_CHAT_IDS = set(
     int(x) for x in os.environ.get('ALLOWED_CHAT_IDS', '').split(',') if x.strip()
 )  # empty = allow all
@@ -55,8 +76,12 @@ When given web search results or tool output, synthesize them into a useful answ
 Never list your capabilities. Just help."""
 
 # ─── Conversation history ─────────────────────────────────────────────────────
-# Per-chat, keep last 20 exchanges (40 messages: 20 user + 20 assistant)
-HISTORY: dict = defaultdict(lambda: deque(maxlen=40))
+# Per chat, the newest message plus as much older history as the router will
+# use (history_policy.MAX_HISTORY_BYTES), so every turn sends only what ends up
+# in the prompt. Persisted in SQLite (history_store.py); idle chats drop out of RAM.
+HISTORY_DB = os.environ.get('HISTORY_DB', os.path.join(_HERE, 'chat_history.db'))
+HISTORY_MAX_CHATS = int(os.environ.get('HISTORY_MAX_CHATS', '256'))   # chats kept in RAM
+HISTORY = HistoryStore(HISTORY_DB, max_chats=HISTORY_MAX_CHATS)
 
 # ─── Logging ──────────────────────────────────────────────────────────────────
 logging.basicConfig(
@@ -69,40 +94,103 @@ logging.basicConfig(
 )
 log = logging.getLogger(__name__)
 
+# ─── HTTP session ─────────────────────────────────────────────────────────────
+# Pooled keep-alive connections to the router and Telegram instead of a new
+# TCP connection per message. Shared by the asyncio.to_thread workers.
+HTTP = requests.Session()
+HTTP.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=ROUTER_POOL_SIZE))
+HTTP.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=ROUTER_POOL_SIZE))
+
+
+# ─── Update processing ────────────────────────────────────────────────────────
+# Chats run in parallel, but each chat's updates run one at a time in arrival
+# order, so a 700s router call only holds up its own chat and handlers never
+# race on HISTORY. An update waiting behind its own chat does not take one of
+# the global slots. Read-only commands skip the chat queue.
+UNORDERED_COMMANDS = {'/start', '/status', '/lang'}
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent: int, chat_max_pending: int):
+        super().__init__(max_concurrent)
+        self.chat_max_pending = chat_max_pending
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.chat_locks: dict = {}               # chat_id → asyncio.Lock (FIFO waiters)
+        self.pending: dict = defaultdict(int)    # chat_id → running + queued updates
+        self.active = 0
+
+    @staticmethod
+    def _chat_key(update):
+        if not isinstance(update, Update) or not update.effective_chat:
+            return None
+        words = (update.effective_message.text or '').split() if update.effective_message else []
+        if words and words[0].split('@')[0] in UNORDERED_COMMANDS:
+            return None
+        return update.effective_chat.id
+
+    async def process_update(self, update, coroutine):
+        chat_id = self._chat_key(update)
+        if chat_id is None:
+            await self._run(coroutine)
+            return
+        if self.pending[chat_id] >= self.chat_max_pending:
+            coroutine.close()
+            log.warning('Chat %s has %s updates pending, refusing another', chat_id, self.pending[chat_id])
+            await self._refuse(update)
+            return
+        self.pending[chat_id] += 1
+        lock = self.chat_locks.setdefault(chat_id, asyncio.Lock())
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self.pending[chat_id] -= 1
+            if not self.pending[chat_id]:
+                del self.pending[chat_id]
+                self.chat_locks.pop(chat_id, None)
+
+    async def _run(self, coroutine):
+        async with self.slots:
+            self.active += 1
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
 
-# ─── Intent detection (mirrors router) ───────────────────────────────────────
+    async def do_process_update(self, update, coroutine):
+        await coroutine   # process_update does the scheduling
 
-EXEC_PATTERN = re.compile(
-    r'^(install|uninstall|remove|setup|deploy|configure|run |execute|start|stop|restart'
-    r'|create|build|make |fix|update|upgrade|download|clone|write|implement|add skill'
-    r'|install skill|test |generate|render|compile)',
-    re.IGNORECASE
-)
-QUESTION_PATTERN = re.compile(
-    r'^(what|how|why|when|where|which|can you|could you|would|should|is there|are there)',
-    re.IGNORECASE
-)
+    async def _refuse(self, update):
+        try:
+            await update.effective_message.reply_text(
+                '⏳ Still working on your earlier messages — send this again once they are answered.')
+        except Exception as e:
+            log.warning('Could not send busy notice: %s', e)
 
-def is_exec_task(text: str) -> bool:
-    """True if message looks like an imperative action to execute."""
-    t = text.strip()
-    return (bool(EXEC_PATTERN.match(t))
-            and not t.endswith('?')
-            and not QUESTION_PATTERN.match(t)
-            and not is_video_request(t))  # video has its own handler
-
-
-VIDEO_PATTERN = re.compile(
-    r'\b(make|create|generate|produce|render|give me|show me|send)\s+(a\s+|me\s+|us\s+)?'
-    r'(news\s+)?video\b'
-    r'|\bvideo\s+(about|on|covering|of)\b'
-    r'|\bnews\s+video\b'
-    r'|\bvideo\s+about\b',
-    re.IGNORECASE
-)
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self, chat_id=None) -> dict:
+        return {'active': self.active, 'chats': len(self.pending), 'pending': self.pending.get(chat_id, 0)}
+
+
+async def _post_init(app: Application):
+    # asyncio.to_thread shares the loop's default executor (min(32, cpus + 4)
+    # threads); give every concurrent update a thread for its blocking router call
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=MAX_CONCURRENT_UPDATES + 4, thread_name_prefix='bot'))
 
-def is_video_request(text: str) -> bool:
-    return bool(VIDEO_PATTERN.search(text))
+
+async def _post_shutdown(app: Application):
+    HISTORY.close()   # write out the last batch of history
+
+
+# ─── Intent detection (shared with router) ──────────────────────────────────
+# EXEC/QUESTION/VIDEO patterns live in intent_classifier.py; is_exec_task()
+# excludes video requests, which have their own handler.
 
 
 def extract_video_topic(text: str, history: list) -> str:
@@ -165,65 +253,303 @@ def run_news_video(topic: str, chat_id: int) -> bool:
 
 # ─── Router call ─────────────────────────────────────────────────────────────
 
-def call_router(chat_history: list, timeout=700) -> str:
-    """Send conversation to CLI Router v7 and return response."""
-    messages = [{'role': 'system', 'content': SYSTEM_PROMPT}] + list(chat_history)
+class RouterSessions:
+    """
+    Per-chat router session state: the seq the router last returned and the
+    messages added to HISTORY since then that the router has not seen (user
+    turns, video/job results). With a seq the bot sends only those; without one
+    (new chat, bot restart, /clear, any failure) it sends the full history with
+    seq 0 and the router starts the session over.
+    """
+
+    def __init__(self, max_chats: int):
+        self.max_chats = max_chats
+        self.lock = threading.Lock()
+        self.chats: OrderedDict = OrderedDict()   # chat_id → {'seq': int, 'unsent': [messages]}
+
+    def note(self, chat_id: int, message: dict):
+        with self.lock:
+            if chat_id in self.chats:
+                self.chats[chat_id]['unsent'].append(message)
+
+    def delta(self, chat_id: int):
+        """(seq, messages the router has not seen), or (0, None) to send everything."""
+        with self.lock:
+            state = self.chats.get(chat_id)
+            if not state:
+                return 0, None
+            self.chats.move_to_end(chat_id)
+            return state['seq'], list(state['unsent'])
+
+    def synced(self, chat_id: int, seq: int):
+        with self.lock:
+            if not seq:
+                self.chats.pop(chat_id, None)
+                return
+            self.chats[chat_id] = {'seq': seq, 'unsent': []}
+            self.chats.move_to_end(chat_id)
+            while len(self.chats) > self.max_chats:
+                self.chats.popitem(last=False)
+
+    def reset(self, chat_id: int):
+        self.synced(chat_id, 0)
+
+
+ROUTER_SESSIONS = RouterSessions(HISTORY_MAX_CHATS)
+
+
+def remember(chat_id: int, role: str, content: str):
+    """Add a message the router did not produce to the chat history."""
+    HISTORY.append(chat_id, role, content)
+    ROUTER_SESSIONS.note(chat_id, {'role': role, 'content': content})
+
+
+def call_router(chat_history: list, timeout=700, chat_id: int = None, on_piece=None) -> str:
+    """
+    Send conversation to CLI Router v7 and return response. With a chat_id the
+    router keeps a session for the chat and only new messages are sent. With
+    on_piece the reply is streamed and on_piece(text) is called (on this
+    thread) for each piece as it arrives.
+    """
+    seq, delta = ROUTER_SESSIONS.delta(chat_id) if chat_id is not None else (0, None)
+    stream = on_piece is not None
+    text = ''
     try:
-        r = requests.post(
-            ROUTER_URL,
-            json={'model': ROUTER_MODEL, 'stream': False, 'messages': messages},
-            timeout=timeout,
-        )
+        while True:
+            if seq:
+                messages = delta
+            else:
+                messages = [{'role': 'system', 'content': SYSTEM_PROMPT}] + list(chat_history)
+            body = {'model': ROUTER_MODEL, 'stream': stream, 'messages': messages}
+            if chat_id is not None:
+                body['session'] = {'id': f'tg-{chat_id}', 'seq': seq}
+            r = HTTP.post(ROUTER_URL, headers=ROUTER_HEADERS, json=body, timeout=timeout, stream=stream)
+            if r.status_code == 409 and seq:
+                r.close()
+                log.info('Router session for chat %s out of sync, resending history', chat_id)
+                seq = 0
+                continue
+            break
+        if r.status_code == 429:
+            ROUTER_SESSIONS.reset(chat_id)
+            return f'Router is busy — try again in {r.headers.get("Retry-After", "a few")}s.'
         r.raise_for_status()
-        return r.json()['choices'][0]['message']['content'].strip()
+        if stream:
+            session = None
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data: ') or line == 'data: [DONE]':
+                    continue
+                event = json.loads(line[6:])
+                piece = (event['choices'][0].get('delta') or {}).get('content')
+                if piece:
+                    text += piece
+                    on_piece(piece)
+                session = event.get('session', session)
+            data = {'session': session}   # no final chunk (cut off) → no session → full resend next time
+            reply = text.strip()
+        else:
+            data = r.json()
+            reply = data['choices'][0]['message']['content'].strip()
+        if chat_id is not None:
+            ROUTER_SESSIONS.synced(chat_id, (data.get('session') or {}).get('seq', 0))
+        return reply
     except requests.Timeout:
+        ROUTER_SESSIONS.reset(chat_id)
+        if text.strip():
+            return f'{text.strip()}\n\n⚠️ Reply cut off (router timed out).'
         return 'Subagent timed out — task may be running in background. Check /status.'
     except Exception as e:
+        ROUTER_SESSIONS.reset(chat_id)
         log.error('Router error: %s', e)
+        if text.strip():
+            return f'{text.strip()}\n\n⚠️ Reply cut off ({e}).'
         return f'Router error: {e}'
 
 
-# ─── Voice processing ─────────────────────────────────────────────────────────
+def submit_exec_job(task: str) -> dict:
+    """Submit an exec task to the router's background job API. Returns the job."""
+    r = HTTP.post(ROUTER_JOBS_URL, headers=ROUTER_HEADERS, json={'model': ROUTER_MODEL, 'task': task}, timeout=15)
+    r.raise_for_status()
+    return r.json()
 
-def download_tg_file(file_id: str, suffix: str = '.ogg') -> str:
-    """Download a Telegram file, return local temp path."""
-    r = requests.get(
-        f'https://api.telegram.org/bot{BOT_TOKEN}/getFile',
-        params={'file_id': file_id}, timeout=15,
-    )
+
+def get_exec_job(job_id: str) -> dict:
+    r = HTTP.get(f'{ROUTER_JOBS_URL}/{job_id}', timeout=15)
     r.raise_for_status()
-    tg_path = r.json()['result']['file_path']
-    url = f'https://api.telegram.org/file/bot{BOT_TOKEN}/{tg_path}'
+    return r.json()
+
+
+# ─── Streaming replies ────────────────────────────────────────────────────────
+
+class StreamingReply:
+    """
+    Shows a router reply while it is generated. Pieces arrive from the
+    call_router thread; the visible text is refreshed by editing the message at
+    most once per edit interval, and past Telegram's length limit the reply
+    continues in a new message, split where _split_message splits the final
+    text. The user sees the first words after time-to-first-token instead of
+    after the whole generation.
+
+    Edits while streaming are best effort: a failed one is logged and the next
+    tick tries again. Only delivering the final text can raise, and by then the
+    reply is already in HISTORY (the router's session has it too).
+    """
+    CURSOR = ' ▌'
+
+    def __init__(self, anchor, chat_type: str, placeholder=None):
+        self.anchor = anchor                  # message replies are sent under
+        self.messages = [placeholder] if placeholder else []
+        self.shown = [None] * len(self.messages)
+        self.text = ''
+        self.interval = STREAM_EDIT_INTERVAL if chat_type == 'private' else STREAM_EDIT_INTERVAL_GROUP
+        self.next_edit = 0.0
+
+    async def run(self, chat_history: list, chat_id: int) -> str:
+        """Call the router with streaming on, record and show the reply; returns its text."""
+        loop = asyncio.get_running_loop()
+
+        def on_piece(piece):
+            loop.call_soon_threadsafe(self._add, piece)
+
+        task = asyncio.ensure_future(asyncio.to_thread(
+            call_router, chat_history, chat_id=chat_id, on_piece=on_piece))
+        while not task.done():
+            await asyncio.wait({task}, timeout=max(0.1, self.next_edit - loop.time()))
+            if not task.done() and loop.time() >= self.next_edit:
+                await self._show(self.text, final=False)
+        response = task.result()
+        HISTORY.append(chat_id, 'assistant', response)
+        await self._show(response, final=True)
+        return response
+
+    def _add(self, piece: str):
+        self.text += piece
+
+    async def _show(self, text: str, final: bool):
+        text = text.strip()
+        if not text:
+            return
+        chunks = list(_split_message(text))
+        if not final:
+            chunks[-1] += self.CURSOR
+        for i, chunk in enumerate(chunks):
+            if i < len(self.messages) and self.shown[i] == chunk:
+                continue
+            while True:
+                try:
+                    if i < len(self.messages):
+                        await self.messages[i].edit_text(chunk)
+                        self.shown[i] = chunk
+                    else:
+                        self.messages.append(await self.anchor.reply_text(chunk))
+                        self.shown.append(chunk)
+                    break
+                except RetryAfter as e:
+                    if not final:
+                        self.next_edit = asyncio.get_running_loop().time() + e.retry_after
+                        return
+                    await asyncio.sleep(e.retry_after)   # the final text must get through
+                except BadRequest as e:
+                    if 'not modified' in str(e).lower():
+                        if i < len(self.messages):
+                            self.shown[i] = chunk
+                        break
+                    if not final:
+                        self._skip_edit(e)
+                        return
+                    if i >= len(self.messages):
+                        raise
+                    # The message to edit is gone (deleted by the user?) — send the text anew
+                    log.warning('Final edit failed (%s), sending a new message', e)
+                    self.messages[i] = await self.anchor.reply_text(chunk)
+                    self.shown[i] = chunk
+                    break
+                except TelegramError as e:
+                    if final:
+                        raise
+                    self._skip_edit(e)
+                    return
+        # The final text can need fewer messages than a longer partial one did
+        for msg in self.messages[len(chunks):]:
+            try:
+                await msg.delete()
+            except Exception:
+                pass
+        del self.messages[len(chunks):], self.shown[len(chunks):]
+        self.next_edit = asyncio.get_running_loop().time() + self.interval
 
-    r2 = requests.get(url, timeout=60, stream=True)
-    r2.raise_for_status()
+    def _skip_edit(self, error):
+        """A streaming edit failed: keep going, the next tick (or the final text) retries."""
+        log.warning('Streaming edit failed (%s), retrying next tick', error)
+        self.next_edit = asyncio.get_running_loop().time() + self.interval
 
-    tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
-    for chunk in r2.iter_content(8192):
-        tmp.write(chunk)
-    tmp.close()
-    return tmp.name
 
+# ─── Voice processing ─────────────────────────────────────────────────────────
 
-def transcribe_audio(audio_path: str) -> dict:
+# Everything here is awaited on the event loop without blocking it: the file comes
+# through the bot's own async HTTP client and Whisper runs in a child process, so
+# other chats keep being served while a voice note is processed.
+
+async def download_tg_file(bot, file_id: str, suffix: str = '.ogg') -> str:
+    """Download a Telegram file, return local temp path."""
+    tg_file = await bot.get_file(file_id)
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    await tg_file.download_to_drive(path)
+    return path
+
+
+async def transcribe_audio(audio_path: str) -> dict:
     """
-    Call voice_transcribe.py as subprocess.
+    Transcribe + rewrite on the warm transcription service, falling back to a
+    one-off voice_transcribe.py subprocess when the service is not running.
     Returns dict with: text, organized, language, backend, changed
     """
+    try:
+        reader, writer = await asyncio.open_unix_connection(TRANSCRIBE_SOCKET, limit=1 << 20)
+    except OSError as e:
+        log.warning('Transcription service unavailable (%s), spawning voice_transcribe.py', e)
+        return await transcribe_subprocess(audio_path)
+    try:
+        writer.write(json.dumps({'op': 'transcribe', 'file': audio_path,
+                                 'timeout': TRANSCRIBE_TIMEOUT - TRANSCRIBE_MARGIN}).encode() + b'\n')
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), TRANSCRIBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise RuntimeError(f'Transcription timed out after {TRANSCRIBE_TIMEOUT}s')
+    finally:
+        writer.close()
+    if not line:
+        raise RuntimeError('Transcription service closed the connection')
+    result = json.loads(line)
+    if 'error' in result:
+        raise RuntimeError(f'Transcription failed: {result["error"][:300]}')
+    return result
+
+
+async def transcribe_subprocess(audio_path: str) -> dict:
+    """Call voice_transcribe.py as an async subprocess (cold start: loads Whisper every time)."""
     env = os.environ.copy()
     env['GROQ_API_KEY'] = GROQ_API_KEY
     env['ROUTER_URL'] = ROUTER_URL
     env['ROUTER_MODEL'] = ROUTER_MODEL
     env['WHISPER_MODEL'] = WHISPER_MODEL
 
-    result = __import__('subprocess').run(
-        [sys.executable, TRANSCRIBE_SCRIPT, '--file', audio_path],
-        capture_output=True, text=True, timeout=180, env=env,
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, TRANSCRIBE_SCRIPT, '--file', audio_path,
+        '--timeout', str(TRANSCRIBE_TIMEOUT - TRANSCRIBE_MARGIN),
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=env,
     )
-    if result.returncode != 0:
-        raise RuntimeError(f'Transcription failed: {result.stderr[:300]}')
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), TRANSCRIBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise RuntimeError(f'Transcription timed out after {TRANSCRIBE_TIMEOUT}s')
+    if proc.returncode != 0:
+        raise RuntimeError(f'Transcription failed: {stderr.decode(errors="replace")[:300]}')
 
-    return json.loads(result.stdout)
+    return json.loads(stdout)
 
 
 # ─── Auth check ───────────────────────────────────────────────────────────────
@@ -249,20 +575,23 @@ async def cmd_start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
 
 async def cmd_clear(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    HISTORY[update.effective_chat.id].clear()
+    HISTORY.clear(update.effective_chat.id)
+    ROUTER_SESSIONS.reset(update.effective_chat.id)
     await update.message.reply_text('🗑️ History cleared.')
 
 
 async def cmd_status(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    history_len = len(HISTORY[chat_id]) // 2
+    history_len = len(HISTORY.get(chat_id)) // 2
     backend = 'Groq/whisper-large-v3' if GROQ_API_KEY else f'faster-whisper/{WHISPER_MODEL}'
+    load = ctx.application.update_processor.stats(chat_id)
     status = (
         f'🦞 *Claw Status*\n\n'
         f'• Router: `{ROUTER_URL}`\n'
         f'• Model: `{ROUTER_MODEL}`\n'
         f'• Voice: `{backend}`\n'
-        f'• History: {history_len} exchanges\n'
+        f'• History: {history_len} exchanges ({HISTORY.chat_bytes(chat_id)} bytes)\n'
+        f'• Busy: {load["active"]}/{MAX_CONCURRENT_UPDATES} updates, {load["pending"]} queued here\n'
         f'• Chat ID: `{chat_id}`'
     )
     await update.message.reply_text(status, parse_mode='Markdown')
@@ -293,14 +622,15 @@ async def handle_voice(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     # Show processing status
     status_msg = await update.message.reply_text(f'🎙️ Transcribing ({duration}s)...')
 
+    audio_path = None
     try:
         # Download
-        audio_path = download_tg_file(voice.file_id, '.ogg')
+        audio_path = await download_tg_file(ctx.bot, voice.file_id, '.ogg')
         log.info('Voice from chat %s: %ss, file downloaded to %s', chat_id, duration, audio_path)
 
-        # Transcribe + rewrite (via voice_transcribe.py subprocess)
+        # Transcribe + rewrite (transcription service, or a voice_transcribe.py subprocess)
         await status_msg.edit_text('🎙️ Processing audio...')
-        result = transcribe_audio(audio_path)
+        result = await transcribe_audio(audio_path)
 
         raw = result.get('text', '')
         organized = result.get('organized', raw)
@@ -319,20 +649,22 @@ async def handle_voice(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         )
 
         # Process through router as text
-        HISTORY[chat_id].append({'role': 'user', 'content': organized})
+        remember(chat_id, 'user', organized)
         thinking_msg = await update.message.reply_text('🤔...')
 
-        response = call_router(list(HISTORY[chat_id]))
-        HISTORY[chat_id].append({'role': 'assistant', 'content': response})
-
-        await thinking_msg.delete()
-        # Split long responses for Telegram's 4096 char limit
-        for chunk in _split_message(response):
-            await update.message.reply_text(chunk)
+        # Streamed into the "🤔..." message, continuing in new ones past 4096 chars
+        reply = StreamingReply(update.message, update.effective_chat.type, thinking_msg)
+        await reply.run(HISTORY.get(chat_id), chat_id)
 
     except Exception as e:
         log.error('Voice handler error: %s', e, exc_info=True)
         await status_msg.edit_text(f'❌ Voice error: {e}')
+    finally:
+        if audio_path:
+            try:
+                os.unlink(audio_path)
+            except OSError:
+                pass
 
 
 async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -346,11 +678,11 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
 
     log.info('Text from chat %s: %s', chat_id, text[:80])
-    HISTORY[chat_id].append({'role': 'user', 'content': text})
+    remember(chat_id, 'user', text)
 
     # ── Video request ─────────────────────────────────────────────────────────
     if is_video_request(text):
-        topic = extract_video_topic(text, list(HISTORY[chat_id]))
+        topic = extract_video_topic(text, HISTORY.get(chat_id))
         label = f'"{topic}"' if topic else 'Estonia news'
         status_msg = await update.message.reply_text(
             f'🎬 Generating video about {label}...\n'
@@ -362,44 +694,65 @@ async def handle_text(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             result_text = f'⚠️ Video error: {e}'
         await status_msg.edit_text(result_text)
-        HISTORY[chat_id].append({'role': 'assistant', 'content': result_text})
+        remember(chat_id, 'assistant', result_text)
         return
 
     exec_mode = is_exec_task(text)
 
     try:
         if exec_mode:
-            # Exec tasks: send status message + keep typing alive during long wait
+            # Exec tasks run as router background jobs — poll instead of holding a 700s request
             status_msg = await update.message.reply_text('⚙️ Subagent working on it...')
-
-            async def keep_typing():
-                for _ in range(70):  # ~700s max (typing every 10s)
-                    await asyncio.sleep(10)
-                    try:
-                        await ctx.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.TYPING)
-                    except Exception:
-                        break
-
-            typing_task = asyncio.create_task(keep_typing())
             try:
-                response = await asyncio.to_thread(call_router, list(HISTORY[chat_id]))
-            finally:
-                typing_task.cancel()
-
+                job = await asyncio.to_thread(submit_exec_job, text)
+            except Exception as e:
+                log.warning('Job submit failed (%s), falling back to blocking call', e)
+                job = None
+            if job:
+                response = await _wait_for_job(job, status_msg, ctx, chat_id)
+                remember(chat_id, 'assistant', response)   # jobs run outside the chat session
+            else:
+                response = await asyncio.to_thread(call_router, HISTORY.get(chat_id), chat_id=chat_id)
+                HISTORY.append(chat_id, 'assistant', response)
             await status_msg.delete()
+            for chunk in _split_message(response):
+                await update.message.reply_text(chunk)
         else:
-            # Normal conversational message
+            # Normal conversational message, streamed as it is generated
             await ctx.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.TYPING)
-            response = await asyncio.to_thread(call_router, list(HISTORY[chat_id]))
-
-        HISTORY[chat_id].append({'role': 'assistant', 'content': response})
-        for chunk in _split_message(response):
-            await update.message.reply_text(chunk)
+            reply = StreamingReply(update.message, update.effective_chat.type)
+            await reply.run(HISTORY.get(chat_id), chat_id)
     except Exception as e:
         log.error('handle_text error: %s', e)
         await update.message.reply_text(f'⚠️ Error: {e}')
 
 
+async def _wait_for_job(job: dict, status_msg, ctx: ContextTypes.DEFAULT_TYPE, chat_id: int) -> str:
+    """Poll an exec job until it finishes, keeping typing alive and showing live output."""
+    shown = ''
+    deadline = time.monotonic() + JOB_MAX_WAIT
+    while job['status'] in ('queued', 'running'):
+        if time.monotonic() > deadline:
+            return f'Subagent still running — job {job["id"]}. Check /status later.'
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+        try:
+            await ctx.bot.send_chat_action(chat_id=chat_id, action=constants.ChatAction.TYPING)
+            job = await asyncio.to_thread(get_exec_job, job['id'])
+        except Exception as e:
+            log.warning('Job poll error: %s', e)
+            continue
+        tail = job.get('output', '')[-500:]
+        if tail and tail != shown:
+            shown = tail
+            try:
+                await status_msg.edit_text(f'⚙️ Subagent working on it...\n\n{tail}')
+            except Exception:
+                pass  # "message is not modified" / rate limits — cosmetic only
+    if job['status'] == 'cancelled':
+        return '⚠️ Subagent task was cancelled.'
+    return job.get('result') or job.get('error') or 'Task completed (no output)'
+
+
 # ─── Helpers ──────────────────────────────────────────────────────────────────
 
 def _split_message(text: str, limit: int = 4000):
@@ -448,8 +801,17 @@ def main():
     log.info('Starting Claw Telegram Bot...')
     log.info('Router: %s | Model: %s', ROUTER_URL, ROUTER_MODEL)
     log.info('Voice backend: %s', 'Groq' if GROQ_API_KEY else f'faster-whisper/{WHISPER_MODEL}')
-
-    app = Application.builder().token(BOT_TOKEN).build()
+    log.info('Concurrency: %s updates, %s pending per chat', MAX_CONCURRENT_UPDATES, CHAT_MAX_PENDING)
+    log.info('History: %s', HISTORY_DB)
+
+    app = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(ChatOrderedProcessor(MAX_CONCURRENT_UPDATES, CHAT_MAX_PENDING))
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
 
     # Commands
     app.add_handler(CommandHandler('start', cmd_start))
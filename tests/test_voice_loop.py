@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Regression test: the event loop stays responsive while a voice message is processed.
+
+handle_voice runs with fake Telegram update/context objects, a transcription
+service that blocks its own thread for TRANSCRIBE_DELAY seconds per request and
+a router call that blocks for ROUTER_DELAY. A probe task sleeps in short ticks
+alongside and records how late each tick wakes up; any blocking call made on
+the loop shows up as a stall of at least one of those delays.
+
+Needs the bot's own dependencies (python-telegram-bot, requests); no network.
+  python3 -m unittest discover tests
+"""
+import asyncio
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+TMP = tempfile.mkdtemp(prefix='claw-test-')
+os.environ['HISTORY_DB'] = os.path.join(TMP, 'history.db')
+os.environ['TRANSCRIBE_SOCKET'] = os.path.join(TMP, 'transcribe.sock')
+os.environ['ALLOWED_CHAT_IDS'] = ''
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import telegram_bot
+except ImportError as e:   # bot dependencies not installed here
+    raise unittest.SkipTest(f'telegram_bot not importable: {e}')
+
+TRANSCRIBE_DELAY = 0.6
+ROUTER_DELAY = 0.6
+PROBE_TICK = 0.01
+MAX_STALL = 0.15   # well under either delay
+
+
+# ─── Fakes ────────────────────────────────────────────────────────────────────
+
+class FakeMessage:
+    def __init__(self, chat, text='', voice=None):
+        self.chat = chat
+        self.text = text
+        self.voice = voice
+        self.audio = None
+        self.edits = []
+
+    async def reply_text(self, text, **kwargs):
+        reply = FakeMessage(self.chat, text)
+        self.chat.sent.append(reply)
+        return reply
+
+    async def edit_text(self, text, **kwargs):
+        self.text = text
+        self.edits.append(text)
+        return self
+
+    async def delete(self):
+        self.chat.sent.remove(self)
+
+
+class FakeChat:
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.type = 'private'
+        self.sent = []
+
+
+class FakeVoice:
+    file_id = 'voice-1'
+    duration = 3
+
+
+class FakeFile:
+    async def download_to_drive(self, path):
+        await asyncio.sleep(0.05)
+        with open(path, 'wb') as f:
+            f.write(b'OggS fake audio')
+
+
+class FakeBot:
+    async def get_file(self, file_id):
+        return FakeFile()
+
+
+class FakeUpdate:
+    def __init__(self, chat_id):
+        self.effective_chat = FakeChat(chat_id)
+        self.message = FakeMessage(self.effective_chat, voice=FakeVoice())
+
+
+class FakeContext:
+    bot = FakeBot()
+
+
+class SlowTranscriber(socketserver.StreamRequestHandler):
+    """The transcription service protocol (one JSON line each way), blocking its thread."""
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        time.sleep(TRANSCRIBE_DELAY)
+        result = {'text': 'what is the weather', 'organized': 'What is the weather?',
+                  'language': 'en', 'backend': 'fake', 'changed': True, 'file': request['file']}
+        self.wfile.write(json.dumps(result).encode() + b'\n')
+
+
+def slow_router(chat_history, timeout=700, chat_id=None, on_piece=None):
+    for piece in ('Sunny ', 'and ', 'warm.'):
+        time.sleep(ROUTER_DELAY / 3)
+        if on_piece:
+            on_piece(piece)
+    return 'Sunny and warm.'
+
+
+# ─── Test ─────────────────────────────────────────────────────────────────────
+
+class VoiceLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingUnixStreamServer(telegram_bot.TRANSCRIBE_SOCKET, SlowTranscriber)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.real_router = telegram_bot.call_router
+        telegram_bot.call_router = slow_router
+
+    def tearDown(self):
+        telegram_bot.call_router = self.real_router
+        self.server.shutdown()
+        self.server.server_close()
+        os.unlink(telegram_bot.TRANSCRIBE_SOCKET)
+
+    def test_loop_not_blocked_by_voice_message(self):
+        update = FakeUpdate(chat_id=42)
+        stalls = []
+
+        async def probe(done):
+            loop = asyncio.get_running_loop()
+            while not done.is_set():
+                start = loop.time()
+                await asyncio.sleep(PROBE_TICK)
+                stalls.append(loop.time() - start - PROBE_TICK)
+
+        async def main():
+            done = asyncio.Event()
+            prober = asyncio.create_task(probe(done))
+            start = time.monotonic()
+            await telegram_bot.handle_voice(update, FakeContext())
+            elapsed = time.monotonic() - start
+            done.set()
+            await prober
+            return elapsed
+
+        elapsed = asyncio.run(main())
+
+        self.assertGreaterEqual(elapsed, TRANSCRIBE_DELAY + ROUTER_DELAY)
+        self.assertLess(max(stalls), MAX_STALL, f'event loop stalled {max(stalls):.3f}s')
+        texts = [m.text for m in update.effective_chat.sent]
+        self.assertIn('Sunny and warm.', texts)
+        self.assertEqual(telegram_bot.HISTORY.get(42)[-1],
+                         {'role': 'assistant', 'content': 'Sunny and warm.'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Regression test: a WorkerPool class queue fills to exactly its cap before 429.
+
+Requests go through admission() and then slot(), as chat_pieces does. A
+request waiting in the lane must count against the queue once, not once for
+its lane place and again for the admission it arrived with.
+
+  python3 -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import time
+import unittest
+
+os.environ.setdefault('ROUTER_CACHE', '0')
+os.environ.setdefault('ROUTER_TOOL_CACHE', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli_router   # noqa: E402
+
+QUEUE_MAX = 2
+
+
+class WorkerPoolAdmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = cli_router.WorkerPool('test', 1)
+        self.pool.queue_max = {p: QUEUE_MAX for p in cli_router.PRIORITIES}
+        self.release = threading.Event()
+        self.errors = []
+        self.threads = []
+
+    def tearDown(self):
+        self.release.set()
+        for t in self.threads:
+            t.join(5)
+
+    def request(self):
+        try:
+            with self.pool.admission('agent') as admission:
+                with self.pool.slot(timeout=5, priority='agent', admission=admission):
+                    self.release.wait(5)
+        except cli_router.PoolBusy as e:
+            self.errors.append(e)
+
+    def start(self, until):
+        t = threading.Thread(target=self.request, daemon=True)
+        t.start()
+        self.threads.append(t)
+        deadline = time.monotonic() + 2
+        while not until(self.pool.stats()) and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+    def test_queue_fills_to_cap(self):
+        self.start(lambda s: s['active'] == 1)
+        for depth in range(1, QUEUE_MAX + 1):
+            self.start(lambda s, depth=depth: s['queues']['agent'] == depth)
+
+        stats = self.pool.stats()
+        self.assertEqual(self.errors, [])
+        self.assertEqual(stats['queues']['agent'], QUEUE_MAX)
+        self.assertEqual(stats['admitting']['agent'], 0)
+
+        with self.assertRaises(cli_router.PoolBusy) as cm:
+            with self.pool.admission('agent'):
+                pass
+        self.assertEqual(cm.exception.status, 429)
+
+        self.release.set()
+        for t in self.threads:
+            t.join(5)
+        self.assertEqual(self.errors, [])
+        self.assertEqual(self.pool.stats()['served'], QUEUE_MAX + 1)
+        self.assertEqual(self.pool.stats()['admitting']['agent'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
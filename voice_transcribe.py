@@ -13,15 +13,26 @@ Usage (standalone):
   python3 voice_transcribe.py --file_id BQACAgEA... --token YOUR_BOT_TOKEN
   python3 voice_transcribe.py --file audio.ogg --no-rewrite
 
+Usage (service — keeps the Whisper model loaded between voice notes):
+  python3 voice_transcribe.py --serve --workers 2
+  python3 voice_transcribe.py --reload --model medium   # swap models without downtime
+  python3 voice_transcribe.py --status
+
 Output: JSON {"text": "...", "organized": "...", "language": "et", "backend": "groq"}
 """
 import argparse
 import json
+import multiprocessing as mp
 import os
 import re
+import signal
+import socket
+import socketserver
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
 import requests
 
@@ -29,7 +40,17 @@ import requests
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY', '')
 ROUTER_URL = os.environ.get('ROUTER_URL', 'http://localhost:4097/v1/chat/completions')
 ROUTER_MODEL = os.environ.get('ROUTER_MODEL', 'opencode/minimax-m2.5-free')
+# Someone is waiting on the bot for this, so it queues with chat; set batch for bulk jobs
+ROUTER_PRIORITY = os.environ.get('ROUTER_PRIORITY', 'interactive')
 WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'small')   # tiny/base/small/medium
+HTTP = requests.Session()   # keep-alive: reuse the router / Telegram connections across calls
+TRANSCRIBE_SOCKET = os.environ.get('TRANSCRIBE_SOCKET', '/tmp/claw-transcribe.sock')
+TRANSCRIBE_WORKERS = int(os.environ.get('TRANSCRIBE_WORKERS', '2'))   # each holds its own model
+JOB_TIMEOUT = int(os.environ.get('TRANSCRIBE_JOB_TIMEOUT', '150'))     # seconds per transcription
+REWRITE_TIMEOUT = 90     # seconds for the router rewrite, cut to what is left of a caller's deadline
+REWRITE_MIN_TIME = 5     # with less than this left the raw transcript is returned unrewritten
+LOAD_TIMEOUT = int(os.environ.get('TRANSCRIBE_LOAD_TIMEOUT', '600'))   # first load may download the model
+MP = mp.get_context('spawn')   # workers start clean instead of forking a threaded server
 WORD_LISTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'word_lists')
 
 # Estonian filler words to clean in rewriting
@@ -81,7 +102,7 @@ def build_initial_prompt(language_hint=None):
 
 def download_telegram_file(file_id, bot_token):
     """Download a Telegram file by file_id. Returns local path."""
-    r = requests.get(
+    r = HTTP.get(
         f'https://api.telegram.org/bot{bot_token}/getFile',
         params={'file_id': file_id}, timeout=15
     )
@@ -89,7 +110,7 @@ def download_telegram_file(file_id, bot_token):
     tg_path = r.json()['result']['file_path']
     url = f'https://api.telegram.org/file/bot{bot_token}/{tg_path}'
 
-    r2 = requests.get(url, timeout=60, stream=True)
+    r2 = HTTP.get(url, timeout=60, stream=True)
     r2.raise_for_status()
 
     ext = os.path.splitext(tg_path)[1] or '.ogg'
@@ -159,30 +180,37 @@ def transcribe_groq(audio_path, language_hint=None):
     return {'text': text, 'language': lang, 'backend': 'groq/whisper-large-v3'}
 
 
-def transcribe_local(audio_path, language_hint=None):
+def load_whisper_model(model_size):
     """
-    faster-whisper local — offline, CPU, uses WHISPER_MODEL env var.
-    Model sizes and approx RAM on CPU:
-      tiny  ~75MB   ~0.5s/s audio (poor Estonian)
-      base  ~142MB  ~1s/s audio
-      small ~244MB  ~3s/s audio (good balance) ← default
-      medium ~769MB ~8s/s audio (best accuracy)
+    Load a faster-whisper model once per process and keep it.
+    Only pays off in a long-lived process — the transcription service workers.
     """
     try:
         from faster_whisper import WhisperModel
     except ImportError:
         raise RuntimeError('faster-whisper not installed: pip install faster-whisper')
 
-    prompt = build_initial_prompt(language_hint)
-
-    # Cache model globally to avoid reloading on every call
     global _whisper_model, _whisper_model_size
-    model_size = WHISPER_MODEL
     if not globals().get('_whisper_model') or globals().get('_whisper_model_size') != model_size:
         _whisper_model = WhisperModel(model_size, device='cpu', compute_type='int8')
         _whisper_model_size = model_size
+    return _whisper_model
 
-    segments, info = _whisper_model.transcribe(
+
+def transcribe_local(audio_path, language_hint=None):
+    """
+    faster-whisper local — offline, CPU, uses WHISPER_MODEL env var.
+    Model sizes and approx RAM on CPU:
+      tiny  ~75MB   ~0.5s/s audio (poor Estonian)
+      base  ~142MB  ~1s/s audio
+      small ~244MB  ~3s/s audio (good balance) ← default
+      medium ~769MB ~8s/s audio (best accuracy)
+    """
+    prompt = build_initial_prompt(language_hint)
+    model_size = WHISPER_MODEL
+    model = load_whisper_model(model_size)
+
+    segments, info = model.transcribe(
         audio_path,
         language=language_hint,   # None = auto-detect
         initial_prompt=prompt,
@@ -219,23 +247,21 @@ def transcribe(audio_path, language_hint=None, cleanup=True):
         return result
 
     finally:
+        # The converted WAV is always ours; the input only goes when cleanup is set
+        paths = [wav_path] if wav_path != audio_path else []
         if cleanup:
-            for p in [audio_path, wav_path]:
-                if p and os.path.exists(p) and p != audio_path:
-                    try:
-                        os.unlink(p)
-                    except Exception:
-                        pass
-            if cleanup and os.path.exists(audio_path):
+            paths.append(audio_path)
+        for p in paths:
+            if p and os.path.exists(p):
                 try:
-                    os.unlink(audio_path)
+                    os.unlink(p)
                 except Exception:
                     pass
 
 
 # ─── Text rewriter ─────────────────────────────────────────────────────────────
 
-def rewrite_transcript(raw_text, language):
+def rewrite_transcript(raw_text, language, timeout=REWRITE_TIMEOUT):
     """
     Turn raw speech-to-text into organized text via LLM.
     Removes fillers, fixes repetitions, groups thoughts, preserves language.
@@ -259,14 +285,15 @@ def rewrite_transcript(raw_text, language):
     )
 
     try:
-        r = requests.post(
+        r = HTTP.post(
             ROUTER_URL,
+            headers={'X-Router-Client': 'voice-transcribe', 'X-Router-Priority': ROUTER_PRIORITY},
             json={
                 'model': ROUTER_MODEL,
                 'stream': False,
                 'messages': [{'role': 'user', 'content': prompt}],
             },
-            timeout=90,
+            timeout=timeout,
         )
         r.raise_for_status()
         organized = r.json()['choices'][0]['message']['content'].strip()
@@ -278,6 +305,227 @@ def rewrite_transcript(raw_text, language):
         return raw_text   # fallback: return raw transcript unchanged
 
 
+def finish(result, rewrite=True, deadline=None):
+    """
+    Add the LLM rewrite to a transcription result (the CLI's JSON shape).
+    With a deadline (time.monotonic()), the rewrite only gets the time left and
+    is skipped when that is under REWRITE_MIN_TIME.
+    """
+    raw = result['text']
+    lang = result['language']
+    organized = raw
+    timeout = REWRITE_TIMEOUT
+    if deadline is not None:
+        timeout = min(timeout, deadline - time.monotonic())
+    if rewrite and raw and timeout >= REWRITE_MIN_TIME:
+        organized = rewrite_transcript(raw, lang, timeout)
+    return {
+        'text': raw,
+        'organized': organized,
+        'language': lang,
+        'backend': result.get('backend', 'unknown'),
+        'changed': organized != raw,
+    }
+
+
+# ─── Transcription service ─────────────────────────────────────────────────────
+# A long-lived daemon on a unix socket. Worker processes keep WhisperModel
+# loaded between jobs, so a voice note costs one transcription instead of a
+# Python start-up, a faster-whisper import and a model load. One JSON request
+# per line, one JSON reply per line:
+#   {"op": "transcribe", "file": "/tmp/x.ogg", "lang": null, "rewrite": true, "timeout": 170}
+#   {"op": "reload", "model": "medium"}   (model optional — same size, fresh workers)
+#   {"op": "status"}
+# SIGHUP also reloads. A reload starts and warms a new pool before swapping it
+# in; jobs already on the old workers finish there. "timeout" is the seconds the
+# caller will wait: transcription and rewrite together stay inside it.
+
+def log(msg):
+    print(f'[{time.strftime("%Y-%m-%d %H:%M:%S")}] {msg}', file=sys.stderr, flush=True)
+
+
+def _init_worker(model_size):
+    """Pool initializer: pin the model size for this worker process."""
+    global WHISPER_MODEL
+    WHISPER_MODEL = model_size
+    # systemd signals the whole unit; the daemon decides when workers stop
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_IGN)
+
+
+def _warm_worker(model_size):
+    """Load the model now rather than on the first voice note."""
+    if not GROQ_API_KEY:
+        load_whisper_model(model_size)
+    return os.getpid()
+
+
+def _transcribe_job(audio_path, language_hint):
+    # The caller owns the input file
+    return transcribe(audio_path, language_hint, cleanup=False)
+
+
+class TranscriptionService:
+    def __init__(self, model_size, workers):
+        self.workers = max(1, workers)
+        self.model_size = None
+        self.pool = None
+        self.generation = 0
+        self.lock = threading.Lock()          # guards pool swaps and counters
+        self.reload_lock = threading.Lock()   # one reload at a time
+        self.active = 0
+        self.done = 0
+        self.failed = 0
+        self.reload(model_size)
+
+    def reload(self, model_size=None):
+        """Start a warm pool for model_size and swap it in; the old one drains."""
+        model_size = model_size or self.model_size
+        with self.reload_lock:
+            started = time.monotonic()
+            pool = MP.Pool(self.workers, initializer=_init_worker, initargs=(model_size,))
+            try:
+                pool.map_async(_warm_worker, [model_size] * self.workers, chunksize=1).get(LOAD_TIMEOUT)
+            except BaseException:
+                pool.terminate()
+                raise
+            with self.lock:
+                old, self.pool = self.pool, pool
+                self.model_size = model_size
+                self.generation += 1
+            if old:
+                old.close()
+                threading.Thread(target=old.join, daemon=True).start()
+            log(f'Pool {self.generation} ready: {self.workers} x {self.backend} '
+                f'in {time.monotonic() - started:.1f}s')
+
+    @property
+    def backend(self):
+        return 'groq/whisper-large-v3' if GROQ_API_KEY else f'faster-whisper/{self.model_size}'
+
+    def transcribe(self, audio_path, language_hint=None, rewrite=True, timeout=None):
+        limit = JOB_TIMEOUT if timeout is None else min(JOB_TIMEOUT, float(timeout))
+        deadline = time.monotonic() + (float(timeout) if timeout is not None else JOB_TIMEOUT + REWRITE_TIMEOUT)
+        with self.lock:
+            job = self.pool.apply_async(_transcribe_job, (audio_path, language_hint))
+            self.active += 1
+        try:
+            result = job.get(limit)
+        except mp.TimeoutError:
+            raise RuntimeError(f'transcription timed out after {limit:g}s')
+        finally:
+            with self.lock:
+                self.active -= 1
+        # The rewrite waits on the router, so it runs here and frees the worker
+        return finish(result, rewrite, deadline)
+
+    def stats(self):
+        with self.lock:
+            return {'backend': self.backend, 'workers': self.workers, 'generation': self.generation,
+                    'active': self.active, 'done': self.done, 'failed': self.failed}
+
+    def count(self, ok):
+        with self.lock:
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def close(self):
+        with self.lock:
+            pool = self.pool
+        pool.close()
+        pool.join()
+
+
+class ServiceHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line)
+                op = req.get('op', 'transcribe')
+                if op == 'transcribe':
+                    try:
+                        reply = service.transcribe(req['file'], req.get('lang'), req.get('rewrite', True),
+                                                   req.get('timeout'))
+                    except Exception:
+                        service.count(False)
+                        raise
+                    service.count(True)
+                elif op == 'reload':
+                    service.reload(req.get('model'))
+                    reply = service.stats()
+                elif op == 'status':
+                    reply = service.stats()
+                else:
+                    reply = {'error': f'unknown op: {op}'}
+            except Exception as e:
+                log(f'Request failed: {type(e).__name__}: {e}')
+                reply = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode() + b'\n')
+            self.wfile.flush()
+
+
+def _claim_socket(path):
+    """Remove a stale socket file; refuse to start if a daemon is answering on it."""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.unlink(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f'a transcription service is already listening on {path}')
+
+
+def serve(socket_path, model_size, workers):
+    _claim_socket(socket_path)
+    service = TranscriptionService(model_size, workers)
+    server = socketserver.ThreadingUnixStreamServer(socket_path, ServiceHandler)
+    server.daemon_threads = True
+    server.service = service
+    os.chmod(socket_path, 0o600)
+
+    def on_hup(signum, frame):
+        threading.Thread(target=_reload_logged, args=(service,), daemon=True).start()
+
+    signal.signal(signal.SIGHUP, on_hup)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    log(f'Transcription service on {socket_path}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        service.close()
+
+
+def _reload_logged(service):
+    try:
+        service.reload()
+    except Exception as e:
+        log(f'Reload failed, keeping pool {service.generation}: {e}')
+
+
+def service_request(payload, socket_path=None, timeout=None):
+    """Send one request to the running service and return its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(socket_path or TRANSCRIBE_SOCKET)
+        s.sendall(json.dumps(payload).encode() + b'\n')
+        reply = s.makefile('rb').readline()
+    if not reply:
+        raise RuntimeError('transcription service closed the connection')
+    return json.loads(reply)
+
+
 # ─── CLI interface ─────────────────────────────────────────────────────────────
 
 if __name__ == '__main__':
@@ -285,6 +533,10 @@ if __name__ == '__main__':
     src = parser.add_mutually_exclusive_group(required=True)
     src.add_argument('--file', help='Local audio file path')
     src.add_argument('--file_id', help='Telegram file_id (requires --token)')
+    src.add_argument('--serve', action='store_true', help='Run the transcription service')
+    src.add_argument('--reload', action='store_true',
+                     help='Ask the running service to reload its workers (with --model to switch size)')
+    src.add_argument('--status', action='store_true', help='Print the running service status')
     parser.add_argument('--token', help='Telegram bot token (for --file_id)')
     parser.add_argument('--lang', default=None, choices=['et', 'en'],
                         help='Force language (default: auto-detect)')
@@ -292,11 +544,26 @@ if __name__ == '__main__':
                         help='Skip LLM rewriting step')
     parser.add_argument('--model', default=None,
                         help='Whisper model size (tiny/base/small/medium)')
+    parser.add_argument('--workers', type=int, default=TRANSCRIBE_WORKERS,
+                        help='Service worker processes (--serve)')
+    parser.add_argument('--socket', default=TRANSCRIBE_SOCKET, help='Service socket path')
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Seconds the caller will wait; the rewrite is cut short to fit')
     args = parser.parse_args()
+    deadline = time.monotonic() + args.timeout if args.timeout else None
 
     if args.model:
         WHISPER_MODEL = args.model
 
+    if args.serve:
+        serve(args.socket, WHISPER_MODEL, args.workers)
+        sys.exit(0)
+    if args.reload or args.status:
+        payload = {'op': 'reload', 'model': args.model} if args.reload else {'op': 'status'}
+        reply = service_request(payload, args.socket)
+        print(json.dumps(reply, indent=2))
+        sys.exit(1 if 'error' in reply else 0)
+
     # Get audio file
     if args.file_id:
         if not args.token:
@@ -312,20 +579,6 @@ if __name__ == '__main__':
     # Transcribe
     result = transcribe(audio, language_hint=args.lang, cleanup=(args.file_id is not None))
 
-    raw = result['text']
-    lang = result['language']
-    backend = result.get('backend', 'unknown')
-
     # Rewrite
-    organized = raw
-    if not args.no_rewrite and raw:
-        organized = rewrite_transcript(raw, lang)
-
-    output = {
-        'text': raw,
-        'organized': organized,
-        'language': lang,
-        'backend': backend,
-        'changed': organized != raw,
-    }
+    output = finish(result, rewrite=not args.no_rewrite, deadline=deadline)
     print(json.dumps(output, ensure_ascii=False, indent=2))